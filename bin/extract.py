@@ -0,0 +1,239 @@
+#!/usr/bin/python3
+from __future__ import absolute_import
+from __future__ import print_function
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Client, Listener
+from os import execv, path, remove, stat
+from setproctitle import setproctitle
+from signal import signal, SIGABRT, SIGINT, SIGHUP, SIGQUIT, SIGTERM
+from socket import error as socket_error, socket, AF_UNIX, SOCK_DGRAM
+from sys import argv, executable, exit as sys_exit
+from threading import Event, Thread
+from time import sleep, time
+from yaml import safe_load as load_yaml
+import logging
+import youtube_dl
+import youtube_dl.version
+from io import open
+
+'''phoebe-extractor'''
+
+logging.basicConfig(
+    filename='extract.log',
+    format='[%(asctime)s] [%(funcName)s] %(levelname)s: %(message)s',
+    datefmt='%Y-%m-%d %H:%M:%S',
+    level=logging.ERROR
+)
+
+# youtube-dl options equivalent to 'youtube-dl --dump-json'
+YDL_PARAMS = {
+    'quiet': True,
+    'no_warnings': True,
+    'simulate': True,
+    'skip_download': True,
+    'noprogress': True,
+    'logger': logging.getLogger('youtube_dl')
+}
+
+
+class ExtractionWorker(Thread):
+    '''
+    Serves one bot connection with its own YoutubeDL instance, as those
+    aren't safe to share between threads.
+    '''
+
+    def __init__(self, conn, workers):
+        super(ExtractionWorker, self).__init__()
+        self.daemon = True
+        self._conn = conn
+        self._workers = workers
+        # playlists are only ever listed (flat); anything that turns out
+        # to be one when extracting gets its first item played
+        self._ydl = youtube_dl.YoutubeDL(
+            dict(YDL_PARAMS, noplaylist=True, playlist_items='1'))
+        self._flat_ydl = youtube_dl.YoutubeDL(
+            dict(YDL_PARAMS, extract_flat='in_playlist'))
+        self.busy = False
+
+    def _extract(self, url, media_format, fields=None):
+        self._ydl.params['format'] = media_format
+        try:
+            info = self._ydl.extract_info(url, download=False)
+        except youtube_dl.utils.DownloadError as e:
+            return ['ERROR', str(e)]
+        except Exception as e:
+            logging.exception('unexpected error extracting {}'.format(url))
+            return ['ERROR', repr(e)]
+        if info and info.get('_type') == 'playlist':
+            info = (info.get('entries') or [None])[0]
+        if not info:
+            return ['ERROR', 'no media info extracted']
+        if fields:
+            # leave formats, subtitles, thumbnails... behind
+            info = dict(
+                (field, info[field]) for field in fields if field in info)
+        return ['OK', info]
+
+    def _list(self, url, max_items, fields=None):
+        self._flat_ydl.params['playlistend'] = max_items
+        try:
+            info = self._flat_ydl.extract_info(url, download=False)
+        except youtube_dl.utils.DownloadError as e:
+            return ['ERROR', str(e)]
+        except Exception as e:
+            logging.exception('unexpected error listing {}'.format(url))
+            return ['ERROR', repr(e)]
+        if not info:
+            return ['ERROR', 'no playlist info extracted']
+
+        listing = dict(
+            (key, info[key]) for key in ('title', 'extractor_key', 'entries')
+            if key in info)
+        if fields and listing.get('entries'):
+            listing['entries'] = [
+                dict((field, entry[field]) for field in fields
+                     if field in entry)
+                for entry in listing['entries'] if entry]
+        return ['OK', listing]
+
+    def run(self):
+        self._workers.add(self)
+        try:
+            while True:
+                try:
+                    command = self._conn.recv()
+                except (EOFError, IOError):
+                    # bot closed the connection
+                    break
+
+                self.busy = True
+                cmd_name = command[0].lower()
+                if cmd_name == 'extract':
+                    response = self._extract(*command[1:4])
+                elif cmd_name == 'list':
+                    response = self._list(*command[1:4])
+                elif cmd_name == 'version':
+                    response = ['OK', youtube_dl.version.__version__]
+                else:
+                    response = ['ERROR', 'unknown command']
+                self.busy = False
+
+                try:
+                    self._conn.send(response)
+                except (IOError, ValueError):
+                    # request cancelled by the bot; connection gone
+                    break
+        finally:
+            self._conn.close()
+            self._workers.discard(self)
+
+
+def get_version_mtime():
+    return stat(youtube_dl.version.__file__).st_mtime
+
+
+def main():
+    # import config
+    global_config = None
+    with open('config.yaml', 'r') as config_file:
+        global_config = load_yaml(config_file)
+        logging.info('configuration file loaded and parsed.')
+
+        if not isinstance(global_config, dict):
+            logging.critical(
+                'error: configuration file parsed into invalid type.')
+            sys_exit(2)
+
+        if len(global_config) <= 0:
+            logging.critical(
+                'error: configuration file parsed into empty object.')
+            sys_exit(3)
+
+    config = global_config['Extractor']
+
+    # craft process title from name (pe-{name})
+    process_title = 'pe-{}'.format(global_config['name'])
+
+    # set loglevel
+    target_lvl = global_config['log_level']
+    if hasattr(logging, target_lvl):
+        logging.getLogger().setLevel(getattr(logging, target_lvl))
+
+    # set lock to prevent concurrency and set proctitle
+    global lock_socket
+    lock_socket = socket(AF_UNIX, SOCK_DGRAM)
+    try:
+        lock_socket.bind('\0{}'.format(process_title))
+        logging.info('got process lock')
+    except socket_error:
+        logging.critical('failed to get process lock; already running?')
+        sys_exit(1)
+
+    setproctitle(process_title)
+
+    address = config['socket_file']
+    if path.exists(address):
+        # left behind by an unclean exit; we hold the lock, so it's stale
+        logging.warning('removing stale socket {}'.format(address))
+        remove(address)
+    listener = Listener(address, authkey=b'phoebe')
+    workers = set()
+    upgraded = Event()
+
+    def _exit():
+        logging.debug('closing listener and exiting')
+        listener.close()
+
+    def _exit_on_signal(signal, frame):
+        logging.warning('caught signal {}'.format(str(signal)))
+        _exit()
+        sys_exit(0)
+    signal(SIGABRT, _exit_on_signal)
+    signal(SIGINT, _exit_on_signal)
+    signal(SIGHUP, _exit_on_signal)
+    signal(SIGQUIT, _exit_on_signal)
+    signal(SIGTERM, _exit_on_signal)
+
+    # watch for youtube-dl upgrades; restart to load the new version
+    version_mtime = get_version_mtime()
+
+    def _watch_version():
+        while not upgraded.wait(float(config['version_check_interval'])):
+            try:
+                if get_version_mtime() != version_mtime:
+                    logging.warning('youtube-dl upgraded; restarting')
+                    upgraded.set()
+                    # unblock accept()
+                    Client(address, authkey=b'phoebe').close()
+            except (OSError, IOError):
+                # mid-upgrade; check again later
+                pass
+    Thread(target=_watch_version, daemon=True).start()
+
+    logging.info(
+        'youtube-dl {} ready on socket {}'.format(
+            youtube_dl.version.__version__, address))
+    while True:
+        try:
+            conn = listener.accept()
+        except (OSError, IOError, EOFError, AuthenticationError):
+            logging.error('error accepting connection')
+            continue
+        if upgraded.is_set():
+            conn.close()
+            break
+        ExtractionWorker(conn, workers).start()
+
+    # warm restart: let in-flight extractions finish, then re-exec; bot
+    # connections fail over to subprocess extraction until we're back
+    _exit()
+    deadline = time() + float(config['restart_grace_period'])
+    while any(worker.busy for worker in list(workers)) and time() < deadline:
+        sleep(.1)
+    lock_socket.close()
+    execv(executable, [executable] + argv)
+
+
+if __name__ == '__main__':
+    main()
+    logging.debug('exited main(); EOF')
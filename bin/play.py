@@ -4,12 +4,12 @@ from __future__ import absolute_import
 from __future__ import print_function
 from multiprocessing import Value
 from multiprocessing.connection import Listener
-from os import getpid
+from os import environ, fdopen, getpid
 from setproctitle import setproctitle
 from signal import signal, SIGABRT, SIGINT, SIGHUP, SIGQUIT, SIGTERM
 from socket import error as socket_error, socket, AF_UNIX, SOCK_DGRAM
 from sys import argv, exit as sys_exit
-from threading import Thread
+from threading import Event, Lock, Thread
 from yaml import safe_load as load_yaml
 import logging
 import gi
@@ -33,91 +33,167 @@ logging.basicConfig(
     level=logging.ERROR
 )
 
+# status pipe to the bot (see lib/player.py), if it gave us one
+status_pipe = None
 
-class Idler(Thread):
 
-    def __init__(self, config, state, stream_id):
-        super(Idler, self).__init__()
-
-        # self._config = config
-        self._state = state
-
-        self._mainloop = GLib.MainLoop()
-        self._pipeline = Gst.Pipeline()
+def report_status(status):
+    if not status_pipe:
+        return
+    try:
+        status_pipe.write('{}\n'.format(status).encode('utf-8'))
+    except (IOError, OSError):
+        logging.error('failed to report status: {}'.format(status))
 
-        bus = self._pipeline.get_bus()
-        bus.add_signal_watch()
-        bus.connect('message::application', self._on_application)
-        bus.connect('message::segment-done', self._on_segment_done)
 
-        self.src = Gst.ElementFactory.make('filesrc', None)
-        self.demux = Gst.ElementFactory.make('qtdemux', None)
-        self.parse = Gst.ElementFactory.make('h264parse', None)
-        self.mux = Gst.ElementFactory.make('flvmux', None)
-        self.sink = Gst.ElementFactory.make('rtmpsink', None)
+def claim_output(process_title):
+    # only one player streams at a time
+    global lock_socket
+    lock_socket = socket(AF_UNIX, SOCK_DGRAM)
+    try:
+        lock_socket.bind('\0{}'.format(process_title))
+        logging.info('got process lock')
+    except socket_error:
+        logging.critical('failed to get process lock; already running?')
+        lock_socket.close()
+        return False
 
-        self.src.set_property('location', 'idlebg.mp4')
-        self.mux.set_property('streamable', 'true')
-        self.sink.set_property('location',
-                               '/'.join([config['output_rtmp_baseurl'], stream_id]))
+    # write PID to file
+    with open('player_pidfile', 'w') as pidfile:
+        print(getpid(), file=pidfile)
 
-        self._pipeline.add(self.src)
-        self._pipeline.add(self.demux)
-        self._pipeline.add(self.parse)
-        self._pipeline.add(self.mux)
-        self._pipeline.add(self.sink)
+    # set custom process title
+    setproctitle(process_title)
+    return True
+
+
+class Source:
+    '''
+    Base for the sources the output switches between: a bin with encoded
+    video (H.264) and audio (MP3) on its "video" and "audio" ghost pads.
+    Buffers are held there by blocking probes until the output switches
+    to the source; it has prerolled once both branches have one held.
+    '''
+
+    def __init__(self, output, source_id):
+        self.source_id = source_id
+        self._output = output
+
+        # handle the children's asynchronous state changes here, so a
+        # source prerolling doesn't take the running output with it
+        self.bin = Gst.Bin()
+        self.bin.set_property('async-handling', True)
+
+        self.prerolled = False
+        self.ended = False
+        # output running time when switched to
+        self.live_since = None
+
+        self._pads = dict()
+        self._probes = list()
+        self._held = set()
+        self._eos = False
+        self._lock = Lock()
+
+    def _add_branch(self, branch, pad):
+        ghost = Gst.GhostPad.new(branch, pad)
+        self.bin.add_pad(ghost)
+        self._pads[branch] = ghost
+        self._probes.append((ghost, ghost.add_probe(
+            Gst.PadProbeType.BLOCK | Gst.PadProbeType.BUFFER |
+            Gst.PadProbeType.BUFFER_LIST,
+            self._on_held, branch)))
+        ghost.add_probe(
+            Gst.PadProbeType.EVENT_DOWNSTREAM, self._on_event, branch)
+
+    # PAD PROBES
+
+    def _on_held(self, pad, info, branch):
+        with self._lock:
+            self._held.add(branch)
+            if self.prerolled or self._held != set(self._pads):
+                return Gst.PadProbeReturn.OK
+            self.prerolled = True
+        GLib.idle_add(self._output._source_prerolled, self)
+        return Gst.PadProbeReturn.OK
+
+    def _on_event(self, pad, info, branch):
+        if info.get_event().type != Gst.EventType.EOS:
+            return Gst.PadProbeReturn.OK
+        # end-of-stream would end the output; the first stream to end ends
+        # the source (the muxer would wait on the other one otherwise)
+        with self._lock:
+            eos, self._eos = self._eos, True
+        if not eos:
+            GLib.idle_add(self._output._source_ended, self, False)
+        return Gst.PadProbeReturn.DROP
 
-        # dynamically link demux to parse when video pad is added
-        self.demux.connect("pad-added", self._on_pad_added)
+    # PUBLIC METHODS
 
-        self.src.link(self.demux)
-        self.parse.link(self.mux)
-        self.mux.link(self.sink)
+    def get_pad(self, branch):
+        return self._pads[branch]
 
-    def _play(self):
-        if self._pipeline.current_state == Gst.State.PLAYING:
-            return
+    def go_live(self, running_time):
+        # carry on from the output's timestamps, and let buffers through
+        self.live_since = running_time
+        for ghost in self._pads.values():
+            ghost.set_offset(running_time)
+        for pad, probe_id in self._probes:
+            pad.remove_probe(probe_id)
+        self._probes = list()
 
-        logging.warning('idling')
-        self._pipeline.set_state(Gst.State.PLAYING)
-        self._pipeline.get_state(Gst.CLOCK_TIME_NONE)
-        logging.info('performing initial seek')
-        self._rewind()
 
-    def _rewind(self):
-        # issue seek to restart playback
-        logging.debug('performing rewind seek')
-        self._pipeline.seek(
-            1.0,
-            Gst.Format.TIME,
-            Gst.SeekFlags.SEGMENT,
-            Gst.SeekType.SET, 0,
-            Gst.SeekType.NONE, 0
-        )
+class IdleSource(Source):
+    '''
+    The idle background (idlebg.mp4, H.264 already) on a loop, with
+    silence for audio.
+    '''
 
-    def _postroll(self):
-        self._pipeline.set_state(Gst.State.NULL)
-        self._mainloop.quit()
+    def __init__(self, output, config):
+        super(IdleSource, self).__init__(output, 'idle')
 
-    def _stop(self):
-        if self._pipeline.current_state == Gst.State.NULL:
-            return
+        self._src = Gst.ElementFactory.make('filesrc', None)
+        self._demux = Gst.ElementFactory.make('qtdemux', None)
+        self._parse = Gst.ElementFactory.make('h264parse', None)
 
-        logging.debug('deidling')
-        self._postroll()
+        self._silence = Gst.ElementFactory.make('audiotestsrc', None)
+        self._audio_convert = Gst.ElementFactory.make('audioconvert', None)
+        self._audio_enc = Gst.ElementFactory.make('lamemp3enc', None)
+        self._audio_parse = Gst.ElementFactory.make('mpegaudioparse', None)
 
-    # BUS MESSAGE HANDLERS
+        for element in (
+            self._src, self._demux, self._parse, self._silence,
+            self._audio_convert, self._audio_enc, self._audio_parse
+        ):
+            self.bin.add(element)
+
+        self._src.set_property('location', 'idlebg.mp4')
+        # the background's SPS/PPS differ from the encoder's; repeat them
+        # with every keyframe, so decoders pick them up after a switch
+        self._parse.set_property('config-interval', -1)
+        Gst.util_set_object_arg(self._silence, 'wave', 'silence')
+        self._audio_enc.set_property('target', 1)
+        self._audio_enc.set_property('bitrate', config['output_audio_bitrate'])
+        self._audio_enc.set_property('cbr', 'true')
 
-    def _on_application(self, bus, msg):
-        # pointer; don't free
-        structure = msg.get_structure()
+        # dynamically link demux to parse when video pad is added
+        self._demux.connect('pad-added', self._on_pad_added)
 
-        if structure.has_name('GstLaunchInterrupt'):
-            logging.warning('caught interrupt; stopping pipeline')
-            self.kill()
+        self._src.link(self._demux)
+        self._silence.link(self._audio_convert)
+        self._audio_convert.link_filtered(
+            self._audio_enc,
+            Gst.caps_from_string(
+                ','.join([
+                    'audio/x-raw',
+                    'rate={}'.format(config['output_audio_samplerate']),
+                    'channels={}'.format(
+                        config['output_audio_channels'])
+                ])))
+        self._audio_enc.link(self._audio_parse)
 
-    def _on_segment_done(self, bus, msg):
-        self._rewind()
+        self._add_branch('video', self._parse.get_static_pad('src'))
+        self._add_branch('audio', self._audio_parse.get_static_pad('src'))
 
     # SIGNAL HANDLERS
 
@@ -125,124 +201,58 @@ class Idler(Thread):
         string = pad.query_caps(None).to_string()
         logging.debug('pad added: {}'.format(string))
         if pad.name == 'video_0':
-            pad.link(self.parse.get_static_pad('sink'))
+            pad.link(self._parse.get_static_pad('sink'))
 
     # PUBLIC METHODS
 
-    def run(self):
-        if self._mainloop.is_running():
-            logging.warning(
-                'run requested when mainloop already running')
-            return None
-
-        # 0: init   1: started    2: stopped
-        self._state.value = 1
-        logging.debug('starting mainloop')
-        try:
-            self._mainloop.run()
-        except:
-            self.stop()
-        finally:
-            logging.debug('end of thread run method reached')
-            self._state.value = 2
-
-    def play(self):
-        self._play()
-
-    def stop(self):
-        self._stop()
-
-    def is_running(self):
-        return self._mainloop.is_running()
-
-    def is_playing(self):
-        if (self._pipeline.current_state == Gst.State.PAUSED or
-                self._pipeline.current_state == Gst.State.PLAYING):
-            return True
-        else:
-            return False
-
+    def rewind(self):
+        # loop by segment seeks: no flushing, and timestamps keep counting
+        # up from one loop to the next
+        logging.debug('performing rewind seek')
+        self._parse.seek(
+            1.0,
+            Gst.Format.TIME,
+            Gst.SeekFlags.SEGMENT,
+            Gst.SeekType.SET, 0,
+            Gst.SeekType.NONE, 0
+        )
 
-class Player(Thread):
 
-    def __init__(
-        self,
-        config,
-        state,
-        stream_id,
-        media_uri,
-        live_source=False
-    ):
-        super(Player, self).__init__()
+class MediaSource(Source):
+    '''
+    A media item, in the output's formats. MP3 audio at the output's
+    sample rate and channels is only parsed and remuxed, if passthrough is
+    on; the rest is decoded and encoded. Streams the media doesn't have
+    (such as video, for music) are filled in with black or silence.
+    '''
 
-        # params
+    def __init__(self, output, source_id, config, media_uri,
+                 live_source=False):
+        super(MediaSource, self).__init__(output, source_id)
 
+        self.media_uri = media_uri
+        self.live_source = live_source
         self._config = config
-        self._state = state
-        self._live_source = live_source
+        self._decoded = set()
 
-        # mainloop and pipeline
+        # makes (encoders are plugged in per stream, as pads are added)
 
-        self._mainloop = GLib.MainLoop()
-        self._pipeline = Gst.Pipeline('playerpipeline')
-
-        # bus
+        self._decodebin = Gst.ElementFactory.make('uridecodebin', None)
 
-        bus = self._pipeline.get_bus()
-        bus.add_signal_watch()
-        bus.connect('message::buffering', self._on_buffering)
-        bus.connect('message::eos', self._on_eos)
-        bus.connect('message::error', self._on_error)
-        bus.connect('message::warning', self._on_warning)
-        bus.connect('message::clock-lost', self._on_clock_lost)
-        bus.connect('message::latency', self._on_latency)
-        bus.connect('message::request-state', self._on_request_state)
-        bus.connect('message::application', self._on_application)
-
-        # makes
-
-        self._decodebin = Gst.ElementFactory.make(
-            'uridecodebin', 'playerdecodebin')
-
-        self._video_raw_queue = Gst.ElementFactory.make(
-            'queue', 'rawvideoqueue')
-        self._video_rate = Gst.ElementFactory.make('videorate', None)
-        self._video_scale = Gst.ElementFactory.make('videoscale', None)
-        self._video_convert = Gst.ElementFactory.make('videoconvert', None)
-        self._video_enc = Gst.ElementFactory.make('x264enc', None)
+        self._video_queue = Gst.ElementFactory.make('queue', None)
         self._video_parse = Gst.ElementFactory.make('h264parse', None)
 
-        self._audio_raw_queue = Gst.ElementFactory.make(
-            'queue', 'rawaudioqueue')
-        self._audio_resample = Gst.ElementFactory.make('audioresample', None)
-        self._audio_convert = Gst.ElementFactory.make('audioconvert', None)
-        self._audio_rate = Gst.ElementFactory.make('audiorate', None)
-        self._audio_enc = Gst.ElementFactory.make('lamemp3enc', None)
+        self._audio_queue = Gst.ElementFactory.make('queue', None)
         self._audio_parse = Gst.ElementFactory.make('mpegaudioparse', None)
 
-        self._mux = Gst.ElementFactory.make('flvmux', None)
-        self._sink = Gst.ElementFactory.make('rtmpsink', None)
-
         # adds
 
-        self._pipeline.add(self._decodebin)
-
-        self._pipeline.add(self._video_raw_queue)
-        self._pipeline.add(self._video_rate)
-        self._pipeline.add(self._video_scale)
-        self._pipeline.add(self._video_convert)
-        self._pipeline.add(self._video_enc)
-        self._pipeline.add(self._video_parse)
-
-        self._pipeline.add(self._audio_raw_queue)
-        self._pipeline.add(self._audio_resample)
-        self._pipeline.add(self._audio_convert)
-        self._pipeline.add(self._audio_rate)
-        self._pipeline.add(self._audio_enc)
-        self._pipeline.add(self._audio_parse)
-
-        self._pipeline.add(self._mux)
-        self._pipeline.add(self._sink)
+        for element in (
+            self._decodebin,
+            self._video_queue, self._video_parse,
+            self._audio_queue, self._audio_parse
+        ):
+            self.bin.add(element)
 
         # properties
 
@@ -251,104 +261,178 @@ class Player(Thread):
         self._decodebin.set_property('uri', media_uri)
         self._decodebin.set_property('use-buffering', 'true')
 
-        self._video_raw_queue.set_property('flush-on-eos', 'true')
-        self._video_scale.set_property('add-borders', 'true')
-        self._video_enc.set_property('bframes', 0)
-        self._video_enc.set_property('bitrate', config['output_video_bitrate'])
-        self._video_enc.set_property('tune', 'fastdecode')
-
-        self._audio_raw_queue.set_property('flush-on-eos', 'true')
-        self._audio_enc.set_property('target', 1)
-        self._audio_enc.set_property('bitrate', config['output_audio_bitrate'])
-        self._audio_enc.set_property('cbr', 'true')
-
-        self._mux.set_property('streamable', 'true')
-        self._sink.set_property('location', '/'.join(
-            [self._config['output_rtmp_baseurl'], stream_id]))
+        self._video_queue.set_property('flush-on-eos', 'true')
+        # (see IdleSource)
+        self._video_parse.set_property('config-interval', -1)
+        self._audio_queue.set_property('flush-on-eos', 'true')
 
         # connect, link
 
-        # decode linked to raw queues as pads are added
+        # decode linked to queues as pads are added
+        if config.get('passthrough', False):
+            self._decodebin.connect(
+                'autoplug-continue', self._on_autoplug_continue)
         self._decodebin.connect('pad-added', self._on_pad_added)
+        self._decodebin.connect('no-more-pads', self._on_no_more_pads)
+
+        self._add_branch('video', self._video_parse.get_static_pad('src'))
+        self._add_branch('audio', self._audio_parse.get_static_pad('src'))
 
-        self._video_raw_queue.link(self._video_rate)
-        self._video_rate.link(self._video_scale)
-        self._video_scale.link(self._video_convert)
-        self._video_convert.link_filtered(
-            self._video_enc,
+    def _passes_through(self, caps):
+        # whether a stream can go to the output without transcoding
+        # (H.264 is always re-encoded, so items all carry the encoder's
+        # codec data; a passed-through stream's would differ from item to
+        # item, and not every player takes new codec data mid-stream)
+        if not caps.is_fixed():
+            return False
+        structure = caps.get_structure(0)
+        name = structure.get_name()
+
+        if name == 'audio/mpeg':
+            found_version, version = structure.get_int('mpegversion')
+            found_layer, layer = structure.get_int('layer')
+            found_rate, rate = structure.get_int('rate')
+            found_channels, channels = structure.get_int('channels')
+            return (
+                found_version and version == 1 and
+                found_layer and layer == 3 and
+                found_rate and
+                rate == self._config['output_audio_samplerate'] and
+                found_channels and
+                channels == self._config['output_audio_channels'])
+
+        return False
+
+    def _plug_video_encoder(self):
+        video_rate = Gst.ElementFactory.make('videorate', None)
+        video_scale = Gst.ElementFactory.make('videoscale', None)
+        video_convert = Gst.ElementFactory.make('videoconvert', None)
+        video_enc = Gst.ElementFactory.make('x264enc', None)
+
+        video_scale.set_property('add-borders', 'true')
+        video_enc.set_property('bframes', 0)
+        video_enc.set_property(
+            'bitrate', self._config['output_video_bitrate'])
+        video_enc.set_property('tune', 'fastdecode')
+
+        for element in (video_rate, video_scale, video_convert, video_enc):
+            self.bin.add(element)
+
+        self._video_queue.link(video_rate)
+        video_rate.link(video_scale)
+        video_scale.link(video_convert)
+        video_convert.link_filtered(
+            video_enc,
             Gst.caps_from_string(
                 ','.join([
                     'video/x-raw', 'format=I420',
                     'framerate={}'.format(
-                        config['output_video_framerate']),
+                        self._config['output_video_framerate']),
                     'width={}'.format(
-                        config['output_video_frame_width']),
+                        self._config['output_video_frame_width']),
                     'height={}'.format(
-                        config['output_video_frame_height']),
+                        self._config['output_video_frame_height']),
                     'pixel-aspect-ratio=1/1'
                 ])))
-        self._video_enc.link(self._video_parse)
-        self._video_parse.link(self._mux)
-
-        self._audio_raw_queue.link(self._audio_resample)
-        self._audio_resample.link(self._audio_convert)
-        self._audio_convert.link(self._audio_rate)
-        self._audio_rate.link_filtered(
-            self._audio_enc,
+        video_enc.link(self._video_parse)
+
+        for element in (video_enc, video_convert, video_scale, video_rate):
+            element.sync_state_with_parent()
+
+    def _plug_audio_encoder(self):
+        audio_resample = Gst.ElementFactory.make('audioresample', None)
+        audio_convert = Gst.ElementFactory.make('audioconvert', None)
+        audio_rate = Gst.ElementFactory.make('audiorate', None)
+        audio_enc = Gst.ElementFactory.make('lamemp3enc', None)
+
+        audio_enc.set_property('target', 1)
+        audio_enc.set_property(
+            'bitrate', self._config['output_audio_bitrate'])
+        audio_enc.set_property('cbr', 'true')
+
+        for element in (audio_resample, audio_convert, audio_rate, audio_enc):
+            self.bin.add(element)
+
+        self._audio_queue.link(audio_resample)
+        audio_resample.link(audio_convert)
+        audio_convert.link(audio_rate)
+        audio_rate.link_filtered(
+            audio_enc,
             Gst.caps_from_string(
                 ','.join([
                     'audio/x-raw',
-                    'rate={}'.format(config['output_audio_samplerate']),
+                    'rate={}'.format(
+                        self._config['output_audio_samplerate']),
                     'channels={}'.format(
-                        config['output_audio_channels'])
+                        self._config['output_audio_channels'])
                 ])))
-        self._audio_enc.link(self._audio_parse)
-        self._audio_parse.link(self._mux)
+        audio_enc.link(self._audio_parse)
 
-        self._mux.link(self._sink)
+        for element in (audio_enc, audio_rate, audio_convert, audio_resample):
+            element.sync_state_with_parent()
 
-        # states
-        self._is_buffering = False
-
-    # INTERNAL CONTROL METHODS
-
-    def _play(self):
-        if self._pipeline.current_state not in (
-                Gst.State.PAUSED, Gst.State.PLAYING):
-            logging.info('playing media')
-            logging.debug('pausing pipeline for preroll')
-            self._pipeline.set_state(Gst.State.PAUSED)
-            logging.debug('prerolled; pipeline paused')
-
-    def _postroll(self):
-        if self._pipeline != Gst.State.NULL:
-            logging.debug('nulling pipeline')
-            self._pipeline.set_state(Gst.State.NULL)
+    # SIGNAL HANDLERS
 
-        self._mainloop.quit()
+    def _on_autoplug_continue(self, element, pad, caps):
+        # stop decodebin short of decoding streams we'd only re-encode
+        return not self._passes_through(caps)
 
-    def _stop(self):
-        if self._pipeline.current_state == Gst.State.NULL:
+    def _on_pad_added(self, element, pad):
+        caps = pad.query_caps(None)
+        logging.debug('pad added: {}'.format(caps.to_string()))
+        name = caps.get_structure(0).get_name()
+        branch = name.split('/')[0]
+        if branch in self._decoded or branch not in ('audio', 'video'):
+            # (only the first stream of each kind plays)
             return
 
-        logging.info('stopping pipeline')
-        self._postroll()
+        if name.endswith('/x-raw'):
+            if branch == 'audio':
+                self._plug_audio_encoder()
+            else:
+                self._plug_video_encoder()
+        else:
+            logging.info('passing {} through'.format(name))
+            if branch == 'audio':
+                self._audio_queue.link(self._audio_parse)
+            else:
+                self._video_queue.link(self._video_parse)
 
-    def _get_live_position(self):
-        pos_result, pos_ns = self._pipeline.query_position(
-            Gst.Format.TIME)
+        if branch == 'audio':
+            pad.link(self._audio_queue.get_static_pad('sink'))
+        else:
+            pad.link(self._video_queue.get_static_pad('sink'))
+        self._decoded.add(branch)
 
-        position = 0
+    def _on_no_more_pads(self, element):
+        if not self._decoded:
+            logging.error('no audio or video in {}'.format(self.media_uri))
+            GLib.idle_add(self._output._source_ended, self, True)
+            return
 
-        if pos_result:
-            position = int(pos_ns // Gst.SECOND)
+        # fill in the streams the media doesn't have
+        for branch, factory, prop, value, queue, plug in (
+            ('video', 'videotestsrc', 'pattern', 'black',
+             self._video_queue, self._plug_video_encoder),
+            ('audio', 'audiotestsrc', 'wave', 'silence',
+             self._audio_queue, self._plug_audio_encoder)
+        ):
+            if branch in self._decoded:
+                continue
+            logging.debug('no {} stream; filling in'.format(branch))
+            plug()
+            filler = Gst.ElementFactory.make(factory, None)
+            Gst.util_set_object_arg(filler, prop, value)
+            self.bin.add(filler)
+            filler.link(queue)
+            filler.sync_state_with_parent()
 
-        return position
+    # PUBLIC METHODS
 
-    def _get_position(self):
-        pos_result, pos_ns = self._pipeline.query_position(
+    def get_position(self):
+        pos_result, pos_ns = self._decodebin.query_position(
             Gst.Format.TIME)
-        dur_result, dur_ns = self._pipeline.query_duration(
+        dur_result, dur_ns = self._decodebin.query_duration(
             Gst.Format.TIME)
 
         (position, duration) = (0, 0)
@@ -360,14 +444,12 @@ class Player(Thread):
 
         return [position, duration]
 
-    def _seek(self, secs):
-        # dur_result, dur_ns = self._pipeline.query_duration(
+    def seek(self, secs):
         dur_result, dur_ns = self._decodebin.query_duration(
             Gst.Format.TIME)
         if not dur_result:
             return False
 
-        # pos_result, pos_ns = self._pipeline.query_position(
         pos_result, pos_ns = self._decodebin.query_position(
             Gst.Format.TIME)
         if not pos_result:
@@ -382,20 +464,292 @@ class Player(Thread):
             'seeking {} secs (to {} s)'.format(
                 secs, seek_to // Gst.SECOND))
 
-        seek_result = self._decodebin.seek_simple(
-            Gst.Format.TIME, Gst.SeekFlags.SEGMENT, seek_to
-            # Gst.Format.TIME, Gst.SeekFlags.NONE, seek_to
-            # Gst.Format.TIME, Gst.SeekFlags.KEY_UNIT | Gst.SeekFlags.SKIP, seek_to
-            # Gst.Format.TIME,
-            # Gst.SeekFlags.KEY_UNIT | Gst.SeekFlags.SKIP | Gst.SeekFlags.FLUSH,
-            # seek_to
+        # (segment seeks end with segment-done rather than end-of-stream)
+        return self._decodebin.seek_simple(
+            Gst.Format.TIME, Gst.SeekFlags.SEGMENT, seek_to)
+
+
+class Output(Thread):
+    '''
+    The stream to ICHC: one muxer and RTMP sink for the life of the
+    process, fed through input selectors by whichever source is live --
+    the idle background or a media item. Sources are added, prerolled and
+    switched to while the output keeps streaming, so changing items never
+    reconnects, and each source's timestamps are offset to carry on from
+    the output's.
+
+    Media is loaded (switched to as soon as it has prerolled, the live
+    source playing on until then) or preloaded (prerolled and held until
+    loaded), by ID. Once live media ends or fails, the output idles.
+    Pipeline changes all happen on the mainloop thread.
+    '''
+
+    # seconds a command may wait on the mainloop
+    INVOKE_TIMEOUT = 10
+
+    def __init__(self, config, state, stream_id):
+        super(Output, self).__init__()
+
+        self._config = config
+        self._state = state
+
+        # the live source; the one to switch to once it has prerolled; and
+        # all of them, live, next and preloaded, by ID
+        self._current = None
+        self._next = None
+        self._sources = dict()
+
+        # running time the output has reached, so a new source never
+        # starts before it
+        self._output_time = 0
+
+        self._is_buffering = False
+
+        # mainloop and pipeline
+
+        self._mainloop = GLib.MainLoop()
+        self._pipeline = Gst.Pipeline('outputpipeline')
+
+        # bus
+
+        bus = self._pipeline.get_bus()
+        bus.add_signal_watch()
+        bus.connect('message::buffering', self._on_buffering)
+        bus.connect('message::eos', self._on_eos)
+        bus.connect('message::error', self._on_error)
+        bus.connect('message::warning', self._on_warning)
+        bus.connect('message::clock-lost', self._on_clock_lost)
+        bus.connect('message::latency', self._on_latency)
+        bus.connect('message::request-state', self._on_request_state)
+        bus.connect('message::application', self._on_application)
+        bus.connect('message::segment-done', self._on_segment_done)
+
+        # makes
+
+        self._video_selector = Gst.ElementFactory.make(
+            'input-selector', 'videoselector')
+        self._audio_selector = Gst.ElementFactory.make(
+            'input-selector', 'audioselector')
+        self._mux = Gst.ElementFactory.make('flvmux', None)
+        self._sink = Gst.ElementFactory.make('rtmpsink', None)
+
+        # adds
+
+        self._pipeline.add(self._video_selector)
+        self._pipeline.add(self._audio_selector)
+        self._pipeline.add(self._mux)
+        self._pipeline.add(self._sink)
+
+        # properties
+
+        # (sources not live are held back by their own probes)
+        self._video_selector.set_property('sync-streams', False)
+        self._audio_selector.set_property('sync-streams', False)
+
+        self._mux.set_property('streamable', 'true')
+        self._sink.set_property('location', '/'.join(
+            [self._config['output_rtmp_baseurl'], stream_id]))
+
+        # link
+
+        for branch, selector in self._selectors():
+            pad = selector.get_static_pad('src')
+            pad.link(self._mux.get_request_pad(branch))
+            pad.add_probe(Gst.PadProbeType.BUFFER, self._on_output_buffer)
+        self._mux.link(self._sink)
+
+    # INTERNAL CONTROL METHODS
+
+    def _selectors(self):
+        return (
+            ('video', self._video_selector),
+            ('audio', self._audio_selector)
         )
 
-        return seek_result
+    def _invoke(self, function, *args):
+        # run a pipeline change on the mainloop thread; its result, or None
+        # if the mainloop didn't get to it
+        done = Event()
+        result = list()
+
+        def call():
+            try:
+                result.append(function(*args))
+            finally:
+                done.set()
+            return False
+
+        GLib.idle_add(call)
+        if not done.wait(self.INVOKE_TIMEOUT) or not result:
+            logging.error('mainloop did not run {}'.format(function.__name__))
+            return None
+        return result[0]
+
+    def _get_running_time(self):
+        clock = self._pipeline.get_clock()
+        if clock is None:
+            return self._output_time
+        return max(
+            clock.get_time() - self._pipeline.get_base_time(),
+            self._output_time)
+
+    def _find_source(self, element):
+        for source in self._sources.values():
+            if element is source.bin or element.has_as_ancestor(source.bin):
+                return source
+        return None
+
+    def _attach(self, source):
+        self._pipeline.add(source.bin)
+        for branch, selector in self._selectors():
+            source.get_pad(branch).link(
+                selector.get_request_pad('sink_%u'))
+        source.bin.sync_state_with_parent()
+        self._sources[source.source_id] = source
+        return source
+
+    def _detach(self, source):
+        if self._sources.get(source.source_id) is source:
+            del self._sources[source.source_id]
+        # (unblocks its held pads, too)
+        source.bin.set_state(Gst.State.NULL)
+        for branch, selector in self._selectors():
+            pad = source.get_pad(branch)
+            peer = pad.get_peer()
+            if peer:
+                pad.unlink(peer)
+                selector.release_request_pad(peer)
+        self._pipeline.remove(source.bin)
+
+    def _set_next(self, source):
+        # switch to source as soon as it has prerolled, instead of whatever
+        # was to be switched to before
+        if self._next is not None and self._next is not source:
+            self._detach(self._next)
+        self._next = source
+        if source.prerolled:
+            self._switch(source)
+
+    def _switch(self, source):
+        previous = self._current
+        self._current = source
+        self._next = None
+
+        for branch, selector in self._selectors():
+            selector.set_property(
+                'active-pad', source.get_pad(branch).get_peer())
+        source.go_live(self._get_running_time())
+        if previous is not None:
+            self._detach(previous)
+
+        if isinstance(source, IdleSource):
+            logging.warning('idling')
+            # (only once it's unblocked; the seek waits on its thread)
+            source.rewind()
+        else:
+            logging.info('playing media ({})'.format(source.source_id))
+
+    def _idle(self):
+        if isinstance(self._current, IdleSource):
+            if self._next is not None:
+                self._detach(self._next)
+                self._next = None
+            return True
+        if not isinstance(self._next, IdleSource):
+            self._set_next(self._attach(IdleSource(self, self._config)))
+        return True
+
+    def _start(self):
+        if self._current is not None or self._next is not None:
+            return True
+        logging.info('starting output')
+        self._set_next(self._attach(IdleSource(self, self._config)))
+        return self._pipeline.set_state(
+            Gst.State.PLAYING) != Gst.StateChangeReturn.FAILURE
+
+    def _load(self, source_id, media_uri, live_source):
+        source = self._sources.get(source_id)
+        if source is not None and source is self._current:
+            return True
+        if source is None:
+            source = self._attach(MediaSource(
+                self, source_id, self._config, media_uri, live_source))
+        self._set_next(source)
+        return True
+
+    def _preload(self, source_id, media_uri, live_source):
+        if source_id in self._sources:
+            return False
+        self._attach(MediaSource(
+            self, source_id, self._config, media_uri, live_source))
+        return True
+
+    def _drop(self, source_id):
+        source = self._sources.get(source_id)
+        if source is None or source is self._current:
+            return False
+        if source is self._next:
+            self._next = None
+        self._detach(source)
+        return True
+
+    def _source_prerolled(self, source):
+        if self._sources.get(source.source_id) is not source:
+            # dropped meanwhile
+            return False
+        if source is self._next:
+            self._switch(source)
+        elif isinstance(source, MediaSource):
+            logging.info('prerolled ({}); standing by'.format(
+                source.source_id))
+            report_status('prerolled {}'.format(source.source_id))
+        return False
+
+    def _source_ended(self, source, failed):
+        if source.ended or self._sources.get(source.source_id) is not source:
+            return False
+        source.ended = True
+        if isinstance(source, MediaSource):
+            report_status('{} {}'.format(
+                'failed' if failed else 'ended', source.source_id))
+
+        if source is self._current:
+            # (stays attached until something else is live)
+            logging.info('media ended ({})'.format(source.source_id))
+            if self._next is None:
+                self._idle()
+            return False
+
+        if source is self._next:
+            self._next = None
+        self._detach(source)
+        if self._current is not None and self._current.ended:
+            self._idle()
+        return False
+
+    def _postroll(self):
+        if self._pipeline != Gst.State.NULL:
+            logging.debug('nulling pipeline')
+            self._pipeline.set_state(Gst.State.NULL)
+
+        self._mainloop.quit()
+
+    def _stop(self):
+        if self._pipeline.current_state == Gst.State.NULL:
+            self._mainloop.quit()
+            return
+
+        logging.info('stopping pipeline')
+        self._postroll()
 
     # BUS MESSAGE HANDLERS
 
     def _on_buffering(self, bus, msg):
+        if self._current is None or (
+            self._find_source(msg.src) is not self._current
+        ):
+            # sources not yet live stay held until switched to
+            return
         percent = msg.parse_buffering()
         if percent == 100:
             self._is_buffering = False
@@ -410,7 +764,8 @@ class Player(Thread):
                 self._is_buffering = True
 
     def _on_eos(self, bus, msg):
-        logging.debug('reached end of stream')
+        # (sources' end-of-stream never gets this far)
+        logging.error('output reached end of stream')
         self._postroll()
 
     def _on_error(self, bus, msg):
@@ -420,6 +775,18 @@ class Player(Thread):
             out += str(gerror)
         if debug:
             out += ': {}'.format(str(gerror.message))
+
+        source = self._find_source(msg.src)
+        if isinstance(source, MediaSource):
+            # the output carries on without it
+            logging.error('media failed ({}): {}'.format(
+                source.source_id, out))
+            if source is self._current and self._is_buffering:
+                self._is_buffering = False
+                self._pipeline.set_state(Gst.State.PLAYING)
+            self._source_ended(source, True)
+            return
+
         if len(out):
             logging.critical('fatal error: {}'.format(out))
         self._stop()
@@ -461,15 +828,28 @@ class Player(Thread):
             logging.warning('caught interrupt; stopping pipeline')
             self.kill()
 
-    # SIGNAL HANDLERS
-
-    def _on_pad_added(self, element, pad):
-        string = pad.query_caps(None).to_string()
-        logging.debug('pad added: {}'.format(string))
-        if string.startswith('audio/'):
-            pad.link(self._audio_raw_queue.get_static_pad('sink'))
-        elif string.startswith('video/'):
-            pad.link(self._video_raw_queue.get_static_pad('sink'))
+    def _on_segment_done(self, bus, msg):
+        if isinstance(self._current, IdleSource):
+            self._current.rewind()
+        elif self._current is not None:
+            # media that was seeked in (segment seeks) has played out
+            self._source_ended(self._current, False)
+
+    # PAD PROBES
+
+    def _on_output_buffer(self, pad, info):
+        # track the running time reached, from the selector's segment
+        buf = info.get_buffer()
+        event = pad.get_sticky_event(Gst.EventType.SEGMENT, 0)
+        if event is None or buf.pts == Gst.CLOCK_TIME_NONE:
+            return Gst.PadProbeReturn.OK
+        running_time = event.parse_segment().to_running_time(
+            Gst.Format.TIME, buf.pts)
+        if running_time != Gst.CLOCK_TIME_NONE:
+            if buf.duration != Gst.CLOCK_TIME_NONE:
+                running_time += buf.duration
+            self._output_time = max(self._output_time, running_time)
+        return Gst.PadProbeReturn.OK
 
     # PUBLIC METHODS
 
@@ -491,7 +871,19 @@ class Player(Thread):
             self._state.value = 2
 
     def play(self):
-        self._play()
+        return self._invoke(self._start)
+
+    def load(self, source_id, media_uri, live_source=False):
+        return self._invoke(self._load, source_id, media_uri, live_source)
+
+    def preload(self, source_id, media_uri, live_source=False):
+        return self._invoke(self._preload, source_id, media_uri, live_source)
+
+    def drop(self, source_id):
+        return self._invoke(self._drop, source_id)
+
+    def idle(self):
+        return self._invoke(self._idle)
 
     def stop(self):
         self._stop()
@@ -504,30 +896,34 @@ class Player(Thread):
             return False
 
     def get_live_play_position(self):
-        position = self._get_live_position()
+        source = self._current
+        if not isinstance(source, MediaSource):
+            return None
+        position = int(
+            (self._get_running_time() - source.live_since) // Gst.SECOND)
         if not position:
             return None
         return position
 
     def get_play_position(self):
-        position = self._get_position()
-        if not position:
+        source = self._current
+        if not isinstance(source, MediaSource):
             return None
+        position = source.get_position()
         if position[1] == 0:
             return None
         return position
 
     def seek(self, secs):
-        return self._seek(secs)
+        source = self._current
+        if not isinstance(source, MediaSource):
+            return False
+        return source.seek(secs)
 
 
 def main():
-    # write PID to file
-    with open('player_pidfile', 'w') as pidfile:
-        print(getpid(), file=pidfile)
-
     # check length of arguments;
-    # 1 = error, 2 = idle, 3 = media, 4 = media w/modifier
+    # 1 = error, 2 = idle, 3 = media (then idle), 4 = media w/modifier
     stream_id = None
     media_uri = None
     live_source = False
@@ -545,6 +941,30 @@ def main():
     if len(argv) > 3 and argv[3] == 'live':
         live_source = True
 
+    # the rest comes from the bot through the environment (see
+    # lib/player.py)
+    status_fd = None
+    if environ.get('PHOEBE_STATUS_FD'):
+        status_fd = int(environ['PHOEBE_STATUS_FD'])
+
+    run_player(
+        stream_id,
+        media_uri,
+        live_source,
+        address=environ.get('PHOEBE_CONTROL_SOCKET'),
+        status_fd=status_fd
+    )
+
+
+def run_player(
+    stream_id,
+    media_uri=None,
+    live_source=False,
+    address=None,
+    status_fd=None
+):
+    # (also the entry point for players forked by bin/playserver.py)
+
     # import config
     global_config = None
     with open('config.yaml', 'r') as config_file:
@@ -570,18 +990,9 @@ def main():
         logging.getLogger().setLevel(getattr(logging, target_lvl))
 
     # set lock to prevent concurrency and set proctitle
-    global lock_socket
-    lock_socket = socket(AF_UNIX, SOCK_DGRAM)
-    try:
-        lock_socket.bind('\0{}'.format(process_title))
-        logging.info('got process lock')
-    except socket_error:
-        logging.critical('failed to get process lock; already running?')
+    if not claim_output(process_title):
         sys_exit(1)
 
-    # set custom process title
-    setproctitle(process_title)
-
     # declare now to allow access by _exit
     state = None
     runtime = None
@@ -612,23 +1023,20 @@ def main():
 
     state = Value('i', 0)
 
-    # create new runtime object based on type
-    runtime = None
-    if media_uri:
-        runtime = Player(
-            global_config['SquishPlayer'],
-            state,
-            stream_id,
-            media_uri,
-            live_source
-        )
-    else:
-        runtime = Idler(global_config['SquishPlayer'], state, stream_id)
+    # the output streams for as long as we run; media comes and goes
+    runtime = Output(global_config['SquishPlayer'], state, stream_id)
 
     # set up listener for comms with bot
-    address = global_config['control_socket_file']
+    address = address or global_config['control_socket_file']
     listener = Listener(address, authkey=b'phoebe')
 
+    # tell the bot we're ready for its connection; the status pipe stays
+    # open until we exit, so its closing tells the bot we're gone
+    global status_pipe
+    if status_fd is not None:
+        status_pipe = fdopen(status_fd, 'wb', 0)
+    report_status('ready')
+
     # block on connection from bot
     logging.debug(
         'awaiting control connection on socket at {}'.format(address))
@@ -669,6 +1077,36 @@ def main():
         # execute command actions
         if cmd_name == 'play':
             runtime.play()
+            if media_uri:
+                runtime.load('0', media_uri, live_source)
+
+        # play media (by ID, URI, live flag) as soon as it has prerolled
+        elif cmd_name == 'load':
+            if runtime.load(*command[1:4]):
+                conn.send(['OK'])
+            else:
+                conn.send(['ERROR', 'failed to load media'])
+
+        # preroll media to load later; reports "prerolled <ID>"
+        elif cmd_name == 'preload':
+            if runtime.preload(*command[1:4]):
+                conn.send(['OK'])
+            else:
+                conn.send(['ERROR', 'failed to preload media'])
+
+        # discard preloaded media
+        elif cmd_name == 'drop':
+            if cmd_arg and runtime.drop(cmd_arg):
+                conn.send(['OK'])
+            else:
+                conn.send(['ERROR', 'no such media'])
+
+        # stop media, back to the idle background
+        elif cmd_name == 'idle':
+            if runtime.idle():
+                conn.send(['OK'])
+            else:
+                conn.send(['ERROR', 'failed to idle'])
 
         # stop player and exit
         elif cmd_name == 'stop':
@@ -0,0 +1,180 @@
+#!/usr/bin/python3
+from __future__ import absolute_import
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Listener
+from multiprocessing.reduction import recv_handle
+from os import _exit as os_exit, close, fork, path, remove
+from setproctitle import setproctitle
+from signal import (
+    signal, SIG_DFL, SIG_IGN, SIGABRT, SIGCHLD, SIGINT, SIGHUP, SIGQUIT,
+    SIGTERM)
+from socket import error as socket_error, socket, AF_UNIX, SOCK_DGRAM
+from sys import exit as sys_exit
+from yaml import safe_load as load_yaml
+import logging
+from io import open
+
+# imports gi and initializes GStreamer (logging to play.log)
+import play
+from play import Gst
+
+'''phoebe-playserver'''
+
+# elements every player builds; their plugins are loaded up front, so
+# forked players find them in memory
+PRELOAD_ELEMENTS = (
+    'uridecodebin', 'queue', 'videorate', 'videoscale', 'videoconvert',
+    'x264enc', 'h264parse', 'audioresample', 'audioconvert', 'audiorate',
+    'lamemp3enc', 'mpegaudioparse', 'input-selector', 'flvmux',
+    'rtmpsink', 'filesrc', 'qtdemux', 'videotestsrc', 'audiotestsrc')
+
+
+def preload_plugins():
+    for name in PRELOAD_ELEMENTS:
+        factory = Gst.ElementFactory.find(name)
+        if factory is None or factory.load() is None:
+            logging.warning('could not preload element {}'.format(name))
+
+
+def spawn_player(conn, listener, args, status_fd):
+    pid = fork()
+    if pid:
+        # the player's copy is the only one to keep
+        close(status_fd)
+        return pid
+
+    # player: drop the server's signal handlers and sockets (closing the
+    # listening socket itself, as closing the listener would unlink the
+    # socket file, and the process lock, so a new server can start while
+    # this player runs) and run as if started on its own
+    exit_code = 0
+    try:
+        for signum in (SIGABRT, SIGINT, SIGHUP, SIGQUIT, SIGTERM, SIGCHLD):
+            signal(signum, SIG_DFL)
+        conn.close()
+        listener._listener._socket.close()
+        lock_socket.close()
+        stream_id, address = args
+        play.run_player(stream_id, address=address, status_fd=status_fd)
+    except SystemExit as e:
+        exit_code = e.code or 0
+    except Exception:
+        logging.exception('forked player failed')
+        exit_code = 1
+    finally:
+        logging.shutdown()
+        # (skip the server's exit handlers, e.g. the listener's unlink)
+        os_exit(exit_code)
+
+
+def serve(conn, listener):
+    # one bot connection at a time; commands come from its event loop
+    while True:
+        try:
+            command = conn.recv()
+        except (EOFError, IOError, OSError):
+            logging.info('bot connection closed')
+            return None
+
+        if command[0] == 'spawn':
+            # the player's status pipe follows as a passed fd
+            try:
+                status_fd = recv_handle(conn)
+            except (EOFError, IOError, OSError) as e:
+                logging.error('failed to receive status pipe: {}'.format(e))
+                return None
+            try:
+                pid = spawn_player(conn, listener, command[1:], status_fd)
+            except OSError as e:
+                close(status_fd)
+                logging.error('fork failed: {}'.format(e))
+                conn.send(['ERROR', str(e)])
+                continue
+            logging.info('forked player {}'.format(pid))
+            conn.send(['OK', pid])
+        else:
+            conn.send(['ERROR', 'unknown command'])
+
+
+def main():
+    # import config
+    global_config = None
+    with open('config.yaml', 'r') as config_file:
+        global_config = load_yaml(config_file)
+        logging.info('configuration file loaded and parsed.')
+
+        if not isinstance(global_config, dict):
+            logging.critical(
+                'error: configuration file parsed into invalid type.')
+            sys_exit(2)
+
+        if len(global_config) <= 0:
+            logging.critical(
+                'error: configuration file parsed into empty object.')
+            sys_exit(3)
+
+    config = global_config['PlayServer']
+
+    # craft process title from name (pps-{name})
+    process_title = 'pps-{}'.format(global_config['name'])
+
+    # set loglevel
+    target_lvl = global_config['log_level']
+    if hasattr(logging, target_lvl):
+        logging.getLogger().setLevel(getattr(logging, target_lvl))
+
+    # set lock to prevent concurrency and set proctitle
+    global lock_socket
+    lock_socket = socket(AF_UNIX, SOCK_DGRAM)
+    try:
+        lock_socket.bind('\0{}'.format(process_title))
+        logging.info('got process lock')
+    except socket_error:
+        logging.critical('failed to get process lock; already running?')
+        sys_exit(1)
+
+    setproctitle(process_title)
+
+    preload_plugins()
+
+    # players are reaped automatically; the bot learns of their exit
+    # through their status pipes
+    signal(SIGCHLD, SIG_IGN)
+
+    address = config['socket_file']
+    if path.exists(address):
+        # left behind by an unclean exit; we hold the lock, so it's stale
+        logging.warning('removing stale socket {}'.format(address))
+        remove(address)
+    listener = Listener(address, authkey=b'phoebe')
+
+    def _exit():
+        logging.debug('closing listener and exiting')
+        listener.close()
+
+    def _exit_on_signal(signal, frame):
+        logging.warning('caught signal {}'.format(str(signal)))
+        _exit()
+        sys_exit(0)
+    signal(SIGABRT, _exit_on_signal)
+    signal(SIGINT, _exit_on_signal)
+    signal(SIGHUP, _exit_on_signal)
+    signal(SIGQUIT, _exit_on_signal)
+    signal(SIGTERM, _exit_on_signal)
+
+    logging.info('player server ready on socket {}'.format(address))
+    while True:
+        try:
+            conn = listener.accept()
+        except (OSError, IOError, EOFError, AuthenticationError):
+            logging.error('error accepting connection')
+            continue
+        try:
+            serve(conn, listener)
+        finally:
+            conn.close()
+
+
+if __name__ == '__main__':
+    main()
+    logging.debug('exited main(); EOF')
@@ -0,0 +1,65 @@
+from __future__ import absolute_import
+from threading import Lock
+from time import time
+import logging
+
+
+class CircuitBreaker:
+    '''
+    Fails lookups fast for sites whose lookups keep failing.
+
+    After breaker_failure_threshold lookups in a row fail for a site, its
+    circuit opens: lookups are refused, except for one probe let through
+    every breaker_cooldown seconds. The first lookup to succeed closes the
+    circuit again; a threshold of 0 never opens it. Resolver threads share
+    one breaker, so all access is under a lock.
+    '''
+
+    def __init__(self, config, stats):
+        # (configs from before the breaker don't get one)
+        self.threshold = config.get('breaker_failure_threshold', 0)
+        self.cooldown = config.get('breaker_cooldown', 300)
+
+        self.stats = stats
+        self.stats['circuits_opened'] = 0
+        self.stats['lookups_refused'] = 0
+
+        # site: [consecutive failures, when to let the next probe through]
+        self.sites = dict()
+        self.lock = Lock()
+
+    def allow(self, site):
+        now = time()
+        with self.lock:
+            state = self.sites.get(site)
+            if not state or state[1] is None:
+                return True
+            if now < state[1]:
+                self.stats['lookups_refused'] += 1
+                return False
+            # let this one through as a probe; refuse others meanwhile
+            state[1] = now + self.cooldown
+            logging.info('probing lookups for {}'.format(site))
+            return True
+
+    def succeeded(self, site):
+        with self.lock:
+            state = self.sites.pop(site, None)
+        if state and state[1] is not None:
+            logging.warning('lookups for {} working again'.format(site))
+
+    def failed(self, site):
+        now = time()
+        with self.lock:
+            state = self.sites.setdefault(site, [0, None])
+            state[0] += 1
+            if state[1] is not None:
+                # probe failed; stay open
+                state[1] = now + self.cooldown
+            elif self.threshold and state[0] >= self.threshold:
+                state[1] = now + self.cooldown
+                self.stats['circuits_opened'] += 1
+                logging.warning(
+                    '{} lookups in a row failed for {}; refusing lookups '
+                    'for {}s'.format(state[0], site, self.cooldown))
+
@@ -0,0 +1,196 @@
+from __future__ import absolute_import
+from collections import OrderedDict
+from threading import Lock
+from time import time
+import logging
+import sqlite3
+
+
+class MediaInfoCache:
+    '''
+    Cache of the media info youtube-dl extracts for a request URL.
+
+    Entries live in an in-memory LRU, backed by an SQLite file so they
+    survive restarts. An entry's metadata (title, duration, source site,
+    liveness) is served for metadata_ttl seconds after it was fetched; its
+    media URL is only good until the entry's own expiry time. Lookups come
+    from the resolver pool, so all access is under a lock.
+    '''
+
+    FIELDS = (
+        'title', 'duration', 'source_site', 'is_live', 'media_uri', 'fetched',
+        'expires')
+
+    def __init__(self, config, stats):
+        self.size = config.get('media_cache_size', 500)
+        self.metadata_ttl = config.get('media_cache_ttl', 604800)
+
+        self.stats = stats
+        self.stats['mediacache_hits'] = 0
+        self.stats['mediacache_media_hits'] = 0
+        self.stats['mediacache_misses'] = 0
+
+        self.entries = OrderedDict()
+        self.lock = Lock()
+
+        self.db = None
+        # (configs from before the cache keep it in memory only)
+        cache_file = config.get('media_cache_file')
+        if cache_file:
+            try:
+                self.db = sqlite3.connect(cache_file, check_same_thread=False)
+                self.db.execute(
+                    'CREATE TABLE IF NOT EXISTS media_info ('
+                    'url TEXT PRIMARY KEY, title TEXT, duration INTEGER, '
+                    'source_site TEXT, is_live INTEGER, media_uri TEXT, '
+                    'fetched REAL, expires REAL)')
+                columns = [
+                    row[1] for row in
+                    self.db.execute('PRAGMA table_info(media_info)')]
+                if 'expires' not in columns:
+                    # cache file from before per-item expiry; treat its
+                    # media URLs as expired
+                    self.db.execute(
+                        'ALTER TABLE media_info '
+                        'ADD COLUMN expires REAL DEFAULT 0')
+                self.db.execute(
+                    'DELETE FROM media_info WHERE fetched < ?',
+                    (time() - self.metadata_ttl,))
+                self.db.commit()
+            except sqlite3.Error as e:
+                logging.error(
+                    "can't open media cache '{}': {}; not persisting".format(
+                        cache_file, e))
+                self.db = None
+
+    # CONVENIENCE METHODS ##############################################
+
+    def _load(self, url):
+        if url in self.entries:
+            self.entries.move_to_end(url)
+            return self.entries[url]
+        if not self.db:
+            return None
+
+        row = self.db.execute(
+            'SELECT {} FROM media_info WHERE url = ?'.format(
+                ', '.join(self.FIELDS)),
+            (url,)).fetchone()
+        if not row:
+            return None
+        entry = dict(zip(self.FIELDS, row))
+        entry['is_live'] = bool(entry['is_live'])
+        self._remember(url, entry)
+        return entry
+
+    def _remember(self, url, entry):
+        self.entries[url] = entry
+        self.entries.move_to_end(url)
+        while len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+
+    def _forget(self, url):
+        self.entries.pop(url, None)
+        if self.db:
+            self.db.execute('DELETE FROM media_info WHERE url = ?', (url,))
+            self.db.commit()
+
+    # PUBLIC METHODS ###################################################
+
+    def get(self, url):
+        '''
+        Returns (entry, media_fresh) for a URL, or (None, False) on a miss;
+        media_fresh is False once the entry's media URL is too old to use.
+        '''
+        now = time()
+        with self.lock:
+            try:
+                entry = self._load(url)
+                if entry and now - entry['fetched'] > self.metadata_ttl:
+                    self._forget(url)
+                    entry = None
+            except sqlite3.Error as e:
+                logging.error('media cache lookup failed: {}'.format(e))
+                entry = None
+
+            if not entry:
+                self.stats['mediacache_misses'] += 1
+                return (None, False)
+
+            self.stats['mediacache_hits'] += 1
+            media_fresh = now < entry['expires']
+            if media_fresh:
+                self.stats['mediacache_media_hits'] += 1
+            return (dict(entry), media_fresh)
+
+    def put(self, url, entry):
+        entry = dict((field, entry[field]) for field in self.FIELDS)
+        with self.lock:
+            self._remember(url, entry)
+            if not self.db:
+                return None
+            try:
+                self.db.execute(
+                    'INSERT OR REPLACE INTO media_info (url, {}) '
+                    'VALUES (?, ?, ?, ?, ?, ?, ?, ?)'.format(
+                        ', '.join(self.FIELDS)),
+                    (url,) + tuple(
+                        int(entry[field]) if field == 'is_live'
+                        else entry[field] for field in self.FIELDS))
+                self.db.commit()
+            except sqlite3.Error as e:
+                logging.error('media cache update failed: {}'.format(e))
+
+    def close(self):
+        with self.lock:
+            if self.db:
+                self.db.close()
+                self.db = None
+
+
+class FailureCache:
+    '''
+    Cache of recent failures to resolve a request URL, so retries fail with
+    the same error without another youtube-dl run.
+
+    How long a failure is remembered depends on its cause (failure_ttls, in
+    seconds, by FailureTypes value); causes without a TTL aren't cached.
+    Memory only; entries are few and short-lived.
+    '''
+
+    def __init__(self, config, stats):
+        self.size = config.get('failure_cache_size', 500)
+        # (configs from before the cache don't remember failures)
+        self.ttls = config.get('failure_ttls') or {}
+
+        self.stats = stats
+        self.stats['failure_hits'] = 0
+
+        # url: (error, failure type, expiry time)
+        self.entries = OrderedDict()
+        self.lock = Lock()
+
+    def get(self, url):
+        '''
+        Returns (error, failure type) if resolving the URL failed recently,
+        or None.
+        '''
+        with self.lock:
+            entry = self.entries.get(url)
+            if not entry:
+                return None
+            if time() >= entry[2]:
+                del self.entries[url]
+                return None
+            self.stats['failure_hits'] += 1
+            return entry[:2]
+
+    def put(self, url, error, failure_type):
+        ttl = self.ttls.get(failure_type, 0)
+        if not ttl:
+            return None
+        with self.lock:
+            self.entries[url] = (error, failure_type, time() + ttl)
+            self.entries.move_to_end(url)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
@@ -0,0 +1,191 @@
+from __future__ import absolute_import
+from .search import load_filter_module
+from re import match
+from six.moves.urllib.parse import (
+    parse_qsl, urlencode, urlparse, urlunparse)
+import logging
+
+# query parameters that only track where a link was shared from, on any
+# site (names other sites may use for something else go in site rules)
+TRACKING_PARAMS = frozenset([
+    'fbclid', 'gclid', 'dclid', 'igshid', 'mc_cid', 'mc_eid', 'ref_src',
+    'ref_url', 'yclid', '_ga'])
+
+# youtube's share links
+YOUTUBE_TRACKING_PARAMS = frozenset(['feature', 'si', 'pp'])
+
+DEFAULT_PORTS = {'http': 80, 'https': 443}
+
+
+def get_query(parsed):
+    # first value of each query parameter
+    query = dict()
+    for key, value in parse_qsl(parsed.query, keep_blank_values=True):
+        query.setdefault(key, value)
+    return query
+
+
+# SITE RULES #######################################################
+# each takes the generically normalized URL (parsed) and returns the
+# canonical URL, or None to keep the normalized one
+
+def canonicalize_youtube(parsed):
+    query = get_query(parsed)
+    video_id = None
+    if parsed.hostname == 'youtu.be':
+        video_id = parsed.path.strip('/').split('/')[0]
+    elif parsed.path == '/watch':
+        # (drops list=, index=, t=: a single video is played from its start)
+        video_id = query.get('v')
+    elif parsed.path == '/playlist' and query.get('list'):
+        return 'https://www.youtube.com/playlist?{}'.format(
+            urlencode({'list': query['list']}))
+    else:
+        path_match = match(
+            r'/(?:shorts|embed|v|live)/([\w-]{11})(?:/|$)', parsed.path)
+        if path_match:
+            video_id = path_match.group(1)
+
+    if video_id and match(r'[\w-]{11}$', video_id):
+        return 'https://www.youtube.com/watch?v={}'.format(video_id)
+    # channels and such
+    query = [
+        (key, value) for key, value in
+        parse_qsl(parsed.query, keep_blank_values=True)
+        if key not in YOUTUBE_TRACKING_PARAMS]
+    return urlunparse(parsed._replace(
+        scheme='https', netloc='www.youtube.com', query=urlencode(query)))
+
+
+def canonicalize_vimeo(parsed):
+    path_match = match(
+        r'/(?:video/)?(\d+)(?:/([\da-f]{10}))?/?$', parsed.path)
+    if not path_match:
+        return None
+    # unlisted videos need their hash, in the path or as h=
+    video_hash = path_match.group(2) or get_query(parsed).get('h')
+    if video_hash:
+        return 'https://vimeo.com/{}/{}'.format(
+            path_match.group(1), video_hash)
+    return 'https://vimeo.com/{}'.format(path_match.group(1))
+
+
+def canonicalize_dailymotion(parsed):
+    if parsed.hostname == 'dai.ly':
+        path_match = match(r'/(x[\da-z]+)', parsed.path)
+    else:
+        path_match = match(r'/(?:embed/)?video/(x[\da-z]+)', parsed.path)
+    if not path_match:
+        return None
+    return 'https://www.dailymotion.com/video/{}'.format(path_match.group(1))
+
+
+def canonicalize_soundcloud(parsed):
+    # private links carry their token in the path; the query is all tracking
+    return 'https://soundcloud.com{}'.format(parsed.path.rstrip('/'))
+
+
+def canonicalize_twitch(parsed):
+    return 'https://www.twitch.tv{}'.format(parsed.path.rstrip('/'))
+
+
+SITE_RULES = {
+    'youtube.com': canonicalize_youtube,
+    'music.youtube.com': canonicalize_youtube,
+    'youtube-nocookie.com': canonicalize_youtube,
+    'youtu.be': canonicalize_youtube,
+    'vimeo.com': canonicalize_vimeo,
+    'player.vimeo.com': canonicalize_vimeo,
+    'dailymotion.com': canonicalize_dailymotion,
+    'dai.ly': canonicalize_dailymotion,
+    'soundcloud.com': canonicalize_soundcloud,
+    'twitch.tv': canonicalize_twitch
+}
+
+
+class Canonicalizer:
+    '''
+    Maps request URLs to one stable form, so the same media reached through
+    short links, mobile hosts, tracking parameters or reordered queries is
+    cached, deduplicated and resolved as one.
+
+    Every http(s) URL is normalized (scheme and host case, default ports,
+    tracking parameters, query order, fragments); other URIs, such as local
+    files, are left as they are. URLs on sites with a rule are then
+    rewritten to the site's canonical page URL. More rules can be added as
+    modules in filters/ (see filters/canonical.py.sample), named in
+    canonical_rules; their rules take precedence over the built-in ones.
+    '''
+
+    def __init__(self, config):
+        self.rules = dict(SITE_RULES)
+        for rules_name in config.get('canonical_rules') or []:
+            try:
+                rules_module = load_filter_module(rules_name)
+                for host in rules_module.HOSTS:
+                    self.rules[host] = rules_module.canonicalize
+            except Exception as e:
+                error = ' '.join([
+                    'error loading URL rules',
+                    '\'filters/{}.py\''.format(rules_name)
+                ])
+                logging.warning(error)
+                logging.warning(str(e))
+
+    def normalize(self, url):
+        url = url.strip()
+        if '://' not in url:
+            url = 'http://{}'.format(url)
+        # (scheme-less URLs once came through as http:///host/path)
+        url = url.replace(':///', '://', 1)
+
+        parsed = urlparse(url)
+        scheme = parsed.scheme.lower()
+        host = parsed.hostname or ''
+        try:
+            port = parsed.port
+        except ValueError:
+            port = None
+        netloc = host
+        if port and port != DEFAULT_PORTS.get(scheme):
+            netloc = '{}:{}'.format(host, port)
+        if parsed.username:
+            netloc = '{}@{}'.format(
+                parsed.netloc.rsplit('@', 1)[0], netloc)
+
+        query = sorted(
+            (key, value) for key, value in
+            parse_qsl(parsed.query, keep_blank_values=True)
+            if key not in TRACKING_PARAMS and not key.startswith('utm_'))
+        # fragments are client-side only, except for #! routes
+        fragment = parsed.fragment if parsed.fragment.startswith('!') else ''
+
+        return parsed._replace(
+            scheme=scheme, netloc=netloc, path=parsed.path or '/',
+            query=urlencode(query), fragment=fragment)
+
+    def canonicalize(self, url):
+        url = url.strip()
+        scheme, separator, _ = url.partition('://')
+        if separator and scheme.lower() not in DEFAULT_PORTS:
+            # (file:///path and such)
+            return url
+        parsed = self.normalize(url)
+
+        host = parsed.hostname or ''
+        rule = self.rules.get(host)
+        if not rule:
+            for prefix in ('www.', 'm.'):
+                if host.startswith(prefix):
+                    rule = self.rules.get(host[len(prefix):])
+                    break
+        if rule:
+            try:
+                canonical = rule(parsed)
+                if canonical:
+                    return canonical
+            except Exception as e:
+                logging.error(
+                    'URL rule for {} failed on {}: {}'.format(
+                        host, url, repr(e)))
+        return urlunparse(parsed)
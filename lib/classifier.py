@@ -0,0 +1,81 @@
+from __future__ import absolute_import
+from re import compile as rexcomp
+
+
+class MessageTypes:
+    CHAT = 1
+    COMMAND = 2
+    STREAM_ID = 3
+
+
+class LineClassifier:
+    '''
+    Classifies the chat lines of an API response body.
+
+    Each line is checked against the configured patterns in turn: control
+    lines and our own messages are dropped, private messages are unwrapped
+    and classified like any other line. What's left comes back as (type,
+    payload) tuples, so MessageProcessor needn't look at the lines again:
+    (COMMAND, (user, command)), (STREAM_ID, stream_id) or (CHAT, line).
+
+    Only the first stream ID is of any use, so lines are checked for one
+    only until it has been found.
+    '''
+
+    def __init__(self, api_config, msgproc_config):
+        self.ctrlre = rexcomp(api_config['control_regex'])
+        self.privmsgre = rexcomp(api_config['privmsg_regex'])
+        self.selfmsgre = rexcomp(''.join([
+            api_config['chat_prefix_regex'],
+            api_config['app_username']
+        ]))
+        self.cmdre = rexcomp(msgproc_config['command_regex'])
+        self.stridre = rexcomp(msgproc_config['stream_id_regex'])
+
+        self.find_stream_id = True
+
+    def classify(self, body):
+        # hot loop; keep lookups local
+        ctrl_search = self.ctrlre.search
+        privmsg_search = self.privmsgre.search
+        selfmsg_search = self.selfmsgre.search
+        cmd_search = self.cmdre.search
+
+        messages = list()
+        append = messages.append
+        for line in body.decode(errors='replace').split('\n'):
+            if not line:
+                continue
+            if ctrl_search(line):
+                # keep PMs; skip other control sequences
+                privmsg_match = privmsg_search(line)
+                if not privmsg_match:
+                    continue
+                line = privmsg_match.group('message')
+            elif selfmsg_search(line):
+                # our own message; filter out
+                continue
+
+            cmd_match = cmd_search(line)
+
+            # if we don't yet have a stream_id, check for one
+            if self.find_stream_id:
+                strid_match = self.stridre.search(line)
+                if strid_match:
+                    self.find_stream_id = False
+                    append((
+                        MessageTypes.STREAM_ID,
+                        strid_match.group('stream_id').strip()
+                    ))
+                    if not cmd_match:
+                        continue
+
+            if cmd_match:
+                append((
+                    MessageTypes.COMMAND,
+                    cmd_match.group('user', 'command')
+                ))
+            else:
+                append((MessageTypes.CHAT, line))
+
+        return messages
@@ -1,5 +1,6 @@
 from __future__ import absolute_import
 from . import events
+from .outbound import MessagePriority
 from circuits import BaseComponent, Event, handler
 from re import match, search
 import six
@@ -163,7 +164,7 @@ class CommandExecutor(BaseComponent):
         if len(outlines):
             for line in outlines:
                 self.fire(
-                    events.do_send_message(line),
+                    events.do_send_message(line, MessagePriority.LOW),
                     self.parent.ichcapi.channel
                 )
 
@@ -174,7 +175,7 @@ class CommandExecutor(BaseComponent):
             'http://bit.ly/2d9yknp'
         ])
         self.fire(
-            events.do_send_message(msg),
+            events.do_send_message(msg, MessagePriority.LOW),
             self.parent.ichcapi.channel
         )
 
@@ -212,7 +213,7 @@ class CommandExecutor(BaseComponent):
         if len(outlines):
             for line in outlines:
                 self.fire(
-                    events.do_send_message(line),
+                    events.do_send_message(line, MessagePriority.LOW),
                     self.parent.ichcapi.channel
                 )
         # if len(pm_outlines):
@@ -1,20 +1,33 @@
 from __future__ import division
 from __future__ import absolute_import
 from . import commands, events
-from .utils import PlayRequest, RequestTypes
+from .breaker import CircuitBreaker
+from .cache import FailureCache, MediaInfoCache
+from .canonical import Canonicalizer
+from .classifier import LineClassifier, MessageTypes
+from .extractor import ExtractorClient
+from .library import MediaLibrary
+from .outbound import MessagePriority, OutboundQueue
+from .player import PlayerProcess, PlayServerClient
+from .polling import get_polling_strategy
+from .probe import DirectMediaProbe
+from .search import SearchFilters
+from .singleflight import SingleFlight
+from .utils import FormatSelector, PlayRequest, RequestTypes
 from circuits import BaseComponent, handler, Timer
 from collections import deque
-from imp import load_source
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from itertools import count, islice
 from multiprocessing.connection import Client
 from OpenSSL.SSL import Error as OpenSSLError, SysCallError
-from os import path, remove
-from re import compile as rexcomp
 from requests import Response
 from requests.exceptions import (
     ConnectionError, SSLError as ReqSSLError, Timeout as HTTPTimeout)
 from subprocess import Popen
-from time import sleep, time
-from six.moves.urllib.parse import urlparse
+from time import time
+from six.moves.urllib.parse import urlparse, ParseResult
+from weakref import WeakSet
 import logging
 
 
@@ -38,23 +51,41 @@ class ICHCAPI(BaseComponent):
             'room_joined': False,
             'rejoining': False,
             'join_lock': False,
-            'just_rejoined': False
+            'just_rejoined': False,
+            'query_in_flight': False,
+            'last_sync': 0,
+            'recvs': 0,
+            'recv_hits': 0
         }
         self.shm['stats']['ICHCAPI'] = {
             'api_requests': 0,
-            'messages_sent': 0
+            'messages_sent': 0,
+            'recvs_skipped': 0,
+            'polling_interval': self.config['polling_interval'],
+            'recv_hit_ratio': 0.0
         }
 
         self.actionqueue = deque([])
         self.httpsession = self.shm['httpsession']
         self.http_poll_timer = None
+        self.http_retry_timer = None
 
-        self.ctrlre = rexcomp(self.config['control_regex'])
-        self.privmsgre = rexcomp(self.config['privmsg_regex'])
-        self.selfmsgre = rexcomp(
-            self.config['chat_prefix_regex'] +
-            self.config['app_username']
-        )
+        # outbound messages, one ordered lane per destination (the room, or
+        # each user we /msg); at most one send per lane is in flight
+        self.outbound = OutboundQueue(
+            self.config, self.shm['stats']['ICHCAPI'])
+        self.sends_in_flight = set()
+        # (one at a time, as before, for configs without the setting)
+        self.max_sends = self.config.get('max_concurrent_sends', 1)
+
+        # all HTTP(S) I/O runs here, off the event loop: one worker for the
+        # join/recv polling lane, the rest for outbound sends
+        self.httpworker = ThreadPoolExecutor(max_workers=1 + self.max_sends)
+
+        self.polling = get_polling_strategy(self.config)
+
+        self.classifier = LineClassifier(
+            self.config, self.shm['config']['MessageProcessor'])
 
         self.in_shutdown = False
 
@@ -67,7 +98,11 @@ class ICHCAPI(BaseComponent):
         discard = False
         action = None
 
-        if len(self.actionqueue):
+        if self.shm['state']['ICHCAPI']['query_in_flight']:
+            # previous query (or its retries) still outstanding; check back
+            # next tick rather than stacking requests behind it
+            pass
+        elif len(self.actionqueue):
             logging.debug('dequeuing next API action')
             # pop from queue
             action = self.actionqueue.popleft()
@@ -77,6 +112,16 @@ class ICHCAPI(BaseComponent):
 
         delay = self.config['polling_interval']
 
+        if action and action[0] == 'recv':
+            # a send response carries new messages too; skip the recv if one
+            # synced us more recently than a poll would have
+            since_sync = time() - self.shm['state']['ICHCAPI']['last_sync']
+            interval = self.shm['state']['ICHCAPI']['last_interval']
+            if since_sync < interval:
+                action = None
+                delay = interval - since_sync
+                self.shm['stats']['ICHCAPI']['recvs_skipped'] += 1
+
         if action:
             requeue = True
             # process only join requests when not joined
@@ -98,28 +143,14 @@ class ICHCAPI(BaseComponent):
             elif not discard:
                 self.shm['state']['ICHCAPI']['last_action'] = action[0]
                 self.shm['state']['ICHCAPI']['last_query'] = time()
-                # send in line
+                # hand off to the I/O worker
                 self._query_api_from_action(action)
 
                 self.shm['stats']['ICHCAPI']['api_requests'] += 1
 
-                # throttle if we recv'd last time and got no new messages
-                if (
-                    action[0] == 'recv' and
-                    self.shm['state']['ICHCAPI']['last_action'] == 'recv' and
-                    self.shm['state']['ICHCAPI']['empty_recvs'] > (int(
-                        self.config['api_throttle_idle_timeout'] //
-                        self.config['polling_interval']) - 1)
-                ):
-                    delay = self.shm['state']['ICHCAPI']['last_interval']
-                    if (
-                        delay <
-                        self.config['max_polling_interval']
-                    ):
-                        delay += self.config['api_throttle_step']
-                        self.shm['state']['ICHCAPI']['last_interval'] = delay
-                        logging.debug(
-                            "throttling API polling to {}s".format(delay))
+                # let the polling strategy pace the next recv
+                if action[0] == 'recv':
+                    delay = self._set_polling_interval(time())
 
         self.http_poll_timer = Timer(
             float(delay),
@@ -181,40 +212,48 @@ class ICHCAPI(BaseComponent):
             timeout=float(self.config['http_timeout'])
         )
 
-        self.shm['stats']['ICHCAPI']['messages_sent'] += 1
-
         return response
 
     # PROCESS ICHC API RESPONSE ######################################
     @handler('do_process_api_response')
-    def _process_api_response_body(self, query_type, content):
-        messages = list()
-        error = None
+    def _process_api_response_body(self, action, content, attempt=0):
+        query_type = action[0]
+        if query_type != 'send':
+            self.shm['state']['ICHCAPI']['query_in_flight'] = False
+
+        # log message if this is a retry
+        if attempt:
+            logging.warning(
+                'retry successful after {} attempts'.format(attempt))
 
         if query_type == 'join':
             self.shm['state']['ICHCAPI']['join_lock'] = False
+        elif query_type == 'send':
+            self.shm['stats']['ICHCAPI']['messages_sent'] += 1
 
-        response_text = content.decode().replace('\r', '').split('\n')
+        if not content:
+            if query_type == 'send':
+                self._release_send_lane(action)
+            return
 
-        for idx, line in enumerate(response_text):
-            # all responses must start with OK
-            if idx == 0:
-                if line.strip() != 'OK':
-                    error = 'non-OK response'
-                    break
-            # extract room key from (successful) join response
-            elif (idx == 1) and (query_type == 'join'):
+        error = None
+
+        # work on the response bytes; only the header lines get split off,
+        # the classifier takes the rest of the body as is
+        status, _, body = content.replace(b'\r', b'').partition(b'\n')
+
+        # all responses must start with OK
+        if status.strip() != b'OK':
+            error = 'non-OK response'
+        # extract room key from (successful) join response
+        elif query_type == 'join':
+            roomkey, _, body = body.partition(b'\n')
+            if len(roomkey.strip()):
                 self.shm['state']['ICHCAPI']['room_joined'] = True
                 self.shm['state']['ICHCAPI']['api_join_attempts'] = 0
-                self.roomkey = line.strip()
+                self.roomkey = roomkey.strip().decode()
                 self.fire(events.room_joined(), self.channel)
-            # assume remaining lines are chat messages
-            else:
-                messages.append(line)
-
-        # LEAK?
-        # del response_text
-        # del content
+        # assume remaining lines are chat messages
 
         if error:
             self.shm['state']['ICHCAPI']['room_joined'] = False
@@ -223,49 +262,67 @@ class ICHCAPI(BaseComponent):
                 '{}'.format(error)
             )
 
-        filtered_messages = list()
         if not self.shm['state']['ICHCAPI']['room_joined']:
             reason = 'not joined'
             self._join_or_shutdown(reason)
-        elif len(messages):
+        else:
             self.shm['state']['ICHCAPI']['last_receipt'] = time()
-            for line in messages:
-                # filter out empty lines
-                if len(line) == 0:
-                    continue
-
-                # filter out control messages (might use later)
-                if self.ctrlre.search(line):
-                    # keep PMs
-                    privmsg_match = self.privmsgre.search(line)
-                    if privmsg_match:
-                        filtered_messages.append(
-                            privmsg_match.group('message'))
-                    # else:
-                        # other control seqs: for now, do nothing; just skip
-                    continue
-
-                # filter out our own messages
-                if self.selfmsgre.search(line):
-                    continue
-
-                # retain all other lines yet unfiltered
-                filtered_messages.append(line)
-
-            # process anything left over (ideally just chat messages)
+            if query_type == 'send':
+                # (recvs are paced by the poll timer; only a send response
+                # catches us up ahead of it)
+                self.shm['state']['ICHCAPI']['last_sync'] = time()
+
+            # drop control lines and our own messages; classify the rest
+            # (ideally just chat messages) for the message processor
+            filtered_messages = self.classifier.classify(body)
             if len(filtered_messages):
                 self.fire(
                     events.messages_received(filtered_messages),
                     self.parent.msgproc.channel
                 )
                 self.shm['state']['ICHCAPI']['empty_recvs'] = 0
-                self.shm['state']['ICHCAPI']['last_interval'] = self.shm[
-                    'config']['ICHCAPI']['polling_interval']
             else:
                 self.shm['state']['ICHCAPI']['empty_recvs'] += 1
 
+            if query_type == 'recv':
+                self.shm['state']['ICHCAPI']['recvs'] += 1
+                if len(filtered_messages):
+                    self.shm['state']['ICHCAPI']['recv_hits'] += 1
+                self.shm['stats']['ICHCAPI']['recv_hit_ratio'] = round(
+                    self.shm['state']['ICHCAPI']['recv_hits'] /
+                    self.shm['state']['ICHCAPI']['recvs'], 2)
+
+            self.polling.on_receive(len(filtered_messages), time())
+            if len(filtered_messages):
+                self._hasten_next_poll()
+
+        if query_type == 'send':
+            self._release_send_lane(action)
+
     # ON-DEMAND EVENT HANDLERS #########################################
 
+    @handler('command_activity')
+    def _note_command_activity(self):
+        self.polling.on_command(time())
+        self._hasten_next_poll()
+
+    def _set_polling_interval(self, now):
+        interval = self.polling.next_interval(now)
+        if interval != self.shm['state']['ICHCAPI']['last_interval']:
+            logging.debug('polling API every {}s'.format(interval))
+        self.shm['state']['ICHCAPI']['last_interval'] = interval
+        self.shm['stats']['ICHCAPI']['polling_interval'] = round(interval, 2)
+        return interval
+
+    def _hasten_next_poll(self):
+        # bring the next poll forward if the strategy now wants it sooner
+        # than currently scheduled
+        now = time()
+        interval = self._set_polling_interval(now)
+        timer = self.http_poll_timer
+        if timer and timer.expiry and timer.expiry - now > interval:
+            timer.reset(interval)
+
     def _join_or_shutdown(self, reason):
         # join the room if we haven't already tried too many times
         max_attempts = self.config['api_rejoin_retry_count']
@@ -284,10 +341,14 @@ class ICHCAPI(BaseComponent):
 
     # SEND MESSAGE WITH ICHC API #####################################
     @handler('do_send_message')
-    def _send_message(self, message):
-        logging.debug("sending message: '{}'".format(message))
-        self.actionqueue.append(['send', message])
-        self.shm['stats']['ICHCAPI']['messages_sent'] += 1
+    def _send_message(
+        self, message, priority=MessagePriority.NORMAL, supersede=None
+    ):
+        logging.debug("queuing message: '{}'".format(message))
+        if self.outbound.push(message, priority, supersede):
+            self.shm['stats']['ICHCAPI']['messages_sent'] += 1
+
+        self._dispatch_sends()
 
     # FSM EVENT HANDLERS ###############################################
 
@@ -305,7 +366,8 @@ class ICHCAPI(BaseComponent):
             "joined room '{}' successfully. starting receive polling".format(
                 self.roomname
             ))
-        # get mod; start broadcasting
+        # get mod; start broadcasting (setup commands never merge, so these
+        # go out in order, ahead of anything else queued)
         msg = [
             '/modme',
             '/broadcast',
@@ -322,20 +384,46 @@ class ICHCAPI(BaseComponent):
             msg.append('/me has rejoined after disconnect.')
 
         for line in msg:
-            self.fire(events.do_send_message(line), self.channel)
+            self.fire(
+                events.do_send_message(line, MessagePriority.HIGH),
+                self.channel
+            )
         self.shm['state']['ICHCAPI']['just_rejoined'] = False
 
+        # flush anything held while we weren't joined
+        self._dispatch_sends()
+
     # NON-HANDLER METHODS ##############################################
 
+    # OUTBOUND SEND LANES ############################################
+    def _dispatch_sends(self):
+        if self.in_shutdown:
+            return
+        if not self.shm['state']['ICHCAPI']['room_joined']:
+            return
+
+        for lane in self.outbound.lanes():
+            if len(self.sends_in_flight) >= self.max_sends:
+                break
+            if lane in self.sends_in_flight:
+                continue
+
+            self._query_api_from_action(
+                ['send', self.outbound.pop(lane), lane])
+            self.shm['stats']['ICHCAPI']['api_requests'] += 1
+
+    def _release_send_lane(self, action):
+        self.sends_in_flight.discard(action[2])
+        self._dispatch_sends()
+
     # HTTPS SEND THREAD ##############################################
-    def _query_api_from_action(self, action):
+    def _query_api_from_action(self, action, attempt=0):
         if self.in_shutdown:
             return
 
         query_type = action[0]
-        query_msg = None
+        query_args = list()
         request_method = None
-        response = None
 
         if query_type == 'join':
             request_method = getattr(self, '_send_join_request')
@@ -343,72 +431,100 @@ class ICHCAPI(BaseComponent):
             request_method = getattr(self, '_send_recv_request')
         elif query_type == 'send':
             request_method = getattr(self, '_send_message_request')
-            query_msg = action[1]
+            query_args.append(action[1])
 
-        attempts_remaining = self.config['polling_retry_count']
+        # hand the request to the I/O worker; the outcome comes back to this
+        # component as an event once the worker is done with it
+        if query_type == 'send':
+            self.sends_in_flight.add(action[2])
+        else:
+            self.shm['state']['ICHCAPI']['query_in_flight'] = True
+        future = self.httpworker.submit(
+            self._read_api_response, request_method, *query_args)
+        future.add_done_callback(
+            partial(self._on_query_done, action, attempt))
 
-        # keep trying until we succeed or run out of retries
-        while True:
-            try:
-                if query_msg:
-                    response = request_method(query_msg)
-                else:
-                    response = request_method()
-            except (
-                ConnectionError,
-                HTTPTimeout,
-                OpenSSLError,
-                ReqSSLError,
-                SysCallError
-            ) as err:
-                if attempts_remaining:
-                    attempts_remaining -= 1
-                    logging.warning(
-                        'error sending HTTP(S) request '
-                        '({}); retrying in {} seconds'.format(
-                            str(err),
-                            self.config['polling_retry_interval']
-                        ))
-                    sleep(self.config['polling_retry_interval'])
-                    continue
-                else:
-                    logging.critical(
-                        'failed to query API after reset ({})'.format(
-                            str(err)))
-                    self.fire(events.do_shutdown(), self.parent.channel)
-                    break
+    @staticmethod
+    def _read_api_response(request_method, *args):
+        # runs on the I/O worker
+        response = request_method(*args)
 
-            # log message if this is a retry
-            if attempts_remaining < self.config['polling_retry_count']:
-                attempts = self.config[
-                    'polling_retry_count'] - attempts_remaining
-                logging.warning(
-                    'retry successful after {} attempts'.format(attempts))
+        content = None
+        if isinstance(response, Response):
+            # set encoding to prevent chardet invocation
+            response.encoding = 'utf-8'
 
-            # exit retry loop if successful
-            break
+            # grab content while still on the worker
+            content = response.content
 
-        if response:
-            if isinstance(response, Response):
-                # set encoding to prevent chardet invocation
-                response.encoding = 'utf-8'
+        return content
 
-                # grab content, then close
-                content = response.content
-                # response.close()
+    def _on_query_done(self, action, attempt, future):
+        # runs on the I/O worker; only fire events from here
+        error = future.exception()
+        if error:
+            self.fire(
+                events.api_query_failed(action, attempt, error),
+                self.channel
+            )
+        else:
+            self.fire(
+                events.do_process_api_response(
+                    action, future.result(), attempt),
+                self.channel
+            )
 
-                if content:
-                    if len(content):
-                        self.fire(
-                            events.do_process_api_response(
-                                query_type, content),
-                            self.channel
-                        )
+    # RETRY FAILED QUERIES WITH BACKOFF ###############################
+    @handler('api_query_failed')
+    def _retry_failed_query(self, action, attempt, error):
+        if self.in_shutdown:
+            return
 
-                # LEAK?
-                # del response
+        if not isinstance(error, (
+            ConnectionError,
+            HTTPTimeout,
+            OpenSSLError,
+            ReqSSLError,
+            SysCallError
+        )):
+            # not a transport hiccup; don't retry
+            if action[0] == 'send':
+                self._release_send_lane(action)
+            else:
+                self.shm['state']['ICHCAPI']['query_in_flight'] = False
+            if action[0] == 'join':
+                self.shm['state']['ICHCAPI']['join_lock'] = False
+            logging.error(
+                "unexpected error during API '{}' query ({})".format(
+                    action[0], str(error)))
+            return
 
-        return None
+        if attempt < self.config['polling_retry_count']:
+            # exponential backoff, capped (at the base interval, i.e. no
+            # backoff, for configs from before the cap)
+            delay = min(
+                self.config['polling_retry_interval'] * (2 ** attempt),
+                self.config.get(
+                    'polling_retry_max_interval',
+                    self.config['polling_retry_interval'])
+            )
+            logging.warning(
+                'error sending HTTP(S) request '
+                '({}); retrying in {} seconds'.format(str(error), delay))
+            self.http_retry_timer = Timer(
+                float(delay),
+                events.do_retry_api_query(action, attempt + 1),
+                self.channel
+            ).register(self)
+        else:
+            logging.critical(
+                'failed to query API after reset ({})'.format(str(error)))
+            self.fire(events.do_shutdown(), self.parent.channel)
+
+    @handler('do_retry_api_query')
+    def _retry_query(self, action, attempt):
+        self.http_retry_timer = None
+        self._query_api_from_action(action, attempt)
 
 
 class MessageProcessor(BaseComponent):
@@ -421,32 +537,23 @@ class MessageProcessor(BaseComponent):
             'messages_received': 0,
             'commands_executed': 0
         }
-        self.cmdre = rexcomp(
-            self.shm['config']['MessageProcessor']['command_regex']
-        )
-        self.stridre = rexcomp(
-            self.shm['config']['MessageProcessor']['stream_id_regex']
-        )
         self.stream_id = None
 
     @handler('messages_received')
     def _parse_messages(self, messages):
-        # parse lines for commands
-        for line in messages:
+        # lines arrive already classified by ICHCAPI
+        for message_type, payload in messages:
             self.shm['stats']['MessageProcessor']['messages_received'] += 1
-            cmd_match = self.cmdre.search(line)
 
-            # if we don't yet have a stream_id, check for one
-            if not self.stream_id:
-                strid_match = self.stridre.search(line)
-                if strid_match:
-                    self.stream_id = strid_match.group('stream_id').strip()
+            # if we don't yet have a stream_id, take this one
+            if message_type == MessageTypes.STREAM_ID:
+                if not self.stream_id:
+                    self.stream_id = payload
                     self.fire(
                         events.broadcast_ready(
                             self.stream_id), self.parent.playmgr.channel)
-            if cmd_match:
-                self.fire(events.command_received(
-                    *cmd_match.group('user', 'command')), self.channel)
+            elif message_type == MessageTypes.COMMAND:
+                self.fire(events.command_received(*payload), self.channel)
 
     @handler('command_received')
     def _dispatch_command(self, raw_sender, raw_command):
@@ -471,6 +578,9 @@ class MessageProcessor(BaseComponent):
                     sender, command, arguments), self.parent.cmdexec.channel)
             self.shm['stats']['MessageProcessor']['commands_executed'] += 1
 
+            # a reply is likely on its way; keep polling responsive
+            self.fire(events.command_activity(), self.parent.ichcapi.channel)
+
 
 class PlayerManager(BaseComponent):
 
@@ -484,6 +594,18 @@ class PlayerManager(BaseComponent):
         self.player_process = None
         self.player_client = None
         self.player_mode = None
+        self.players_started = 0
+        # set once players keep failing and playback is given up on
+        self.player_given_up = False
+
+        # media preloaded in the player for upcoming items, to switch to
+        # without a gap (ID: request), those of them prerolled, and
+        # requests whose standby media failed; and the media playing
+        self.standby_media = dict()
+        self.standby_prerolled = set()
+        self.standby_failed = WeakSet()
+        self.media_ids = count(1)
+        self.current_media = None
         self.requestqueue = deque([])
         self.current_request = None
         self.stream_id = None
@@ -493,23 +615,268 @@ class PlayerManager(BaseComponent):
         # self._player_ready = False
         self._dequeue_lock = False
 
-        # load the search filter module
-        filter_module = None
-        filter_name = self.shm['config']['PlayRequest']['search_filter']
-        try:
-            filter_module = load_source(
-                filter_name, 'filters/{}.py'.format(filter_name))
-        except Exception as e:
-            error = ' '.join([
-                'error loading search filter',
-                '\'filters/{}.py\''.format(filter_name)
-            ])
-            logging.warning(error)
-            logging.warning(str(e))
-        self.filter_module = filter_module
+        # when the current media started playing, for queue ETAs
+        self.playback_started = 0
+        self.refresh_timer = None
+        self.service_timer = None
+
+        # requests are prepared (search, youtube-dl) off the event loop
+        self.resolver = ThreadPoolExecutor(
+            max_workers=self.shm['config']['PlayerManager'].get(
+                'resolve_workers', 4))
+        self.resolve_timeout = float(
+            self.shm['config']['PlayerManager'].get('resolve_timeout', 30.0))
+
+        self.shm['stats']['PlayerManager'] = {
+            'requests_resolved': 0,
+            'requests_failed': 0,
+            'requests_timed_out': 0,
+            'media_refreshes': 0,
+            'standby_switches': 0
+        }
+
+        request_config = self.shm['config']['PlayRequest']
+        max_age = self.shm['config']['PlayerManager'].get(
+            'site_media_info_max_age')
+        if 'media_ttl' not in request_config and max_age is not None:
+            # the fixed max age media_ttl replaced
+            logging.warning(
+                'site_media_info_max_age is deprecated; set media_ttl '
+                'under PlayRequest instead')
+            request_config['media_ttl'] = max_age
+
+        self.shm['stats']['MediaInfoCache'] = dict()
+        self.mediacache = MediaInfoCache(
+            self.shm['config']['PlayRequest'],
+            self.shm['stats']['MediaInfoCache'])
+
+        self.shm['stats']['FailureCache'] = dict()
+        self.failurecache = FailureCache(
+            self.shm['config']['PlayRequest'],
+            self.shm['stats']['FailureCache'])
+
+        self.shm['stats']['CircuitBreaker'] = dict()
+        self.breaker = CircuitBreaker(
+            self.shm['config']['PlayRequest'],
+            self.shm['stats']['CircuitBreaker'])
+
+        self.canonicalizer = Canonicalizer(self.shm['config']['PlayRequest'])
+
+        # concurrent lookups of one URL share a youtube-dl run
+        self.shm['stats']['SingleFlight'] = dict()
+        self.inflight = SingleFlight(self.shm['stats']['SingleFlight'])
+
+        # direct-play links are checked before they're queued
+        self.shm['stats']['DirectMediaProbe'] = dict()
+        self.prober = DirectMediaProbe(
+            self.shm['config']['PlayRequest'],
+            self.httpsession,
+            self.shm['stats']['DirectMediaProbe'])
+
+        self.format_selector = FormatSelector(
+            self.shm['config']['SquishPlayer'])
+
+        # resident services: name: [early exits in a row, when started,
+        # when to restart it]
+        self.services = dict()
+
+        # resident youtube-dl process, if enabled
+        self.extractor = None
+        self.extractor_process = None
+        if self.shm['config'].get('Extractor', {}).get('enabled', False):
+            self.start_extractor()
+            self.extractor = ExtractorClient(self.shm['config']['Extractor'])
+
+        # resident player forking process, if enabled
+        self.playserver = None
+        self.playserver_process = None
+        if self.shm['config'].get('PlayServer', {}).get('enabled', False):
+            self.start_playserver()
+            self.playserver = PlayServerClient(
+                self.shm['config']['PlayServer'])
+
+        # load the search filter modules
+        self.shm['stats']['SearchFilters'] = dict()
+        self.searcher = SearchFilters(
+            self.shm['config']['PlayRequest'],
+            self.shm['stats']['SearchFilters'])
+
+        # local media library, if enabled; searched before the filters
+        self.library = None
+        if self.shm['config'].get('MediaLibrary', {}).get('enabled', False):
+            self.shm['stats']['MediaLibrary'] = dict()
+            self.library = MediaLibrary(
+                self.shm['config']['MediaLibrary'],
+                self.shm['stats']['MediaLibrary'])
+            self.library.start_scan()
+            Timer(
+                float(self.shm['config']['MediaLibrary']['rescan_interval']),
+                events.do_scan_library(),
+                self.channel,
+                persist=True
+            ).register(self)
 
     # CONVENIENCE METHODS ##############################################
 
+    def _queue_ready(self):
+        # the head of the queue must be resolved, with a fresh media URL,
+        # before it can play
+        if not len(self.requestqueue):
+            return False
+        head = self.requestqueue[0]
+        if self._get_standby(head) in self.standby_prerolled:
+            # connected to its media already
+            return True
+        if head.resolving or head.refreshing:
+            return False
+        if head.error:
+            # let the dequeue report it
+            return True
+        if self._media_stale(head, 0):
+            # missed by the refresher; refresh before playing
+            self._refresh_request(head)
+            return False
+        return True
+
+    def _media_stale(self, request, eta):
+        # whether a request's media URL will be too old by the time it plays
+        if request.request_type != RequestTypes.SITE:
+            return False
+        return time() + eta > request.expires_at
+
+    def _refresh_request(self, request):
+        logging.info('refreshing media info: "{}"'.format(request.title))
+        request.refreshing = True
+        # (the head of the queue waits on it, so it gets the same time as
+        # a new request)
+        request.watchdog = Timer(
+            self.resolve_timeout,
+            events.request_timed_out(request),
+            self.channel
+        ).register(self)
+        if request.prepared:
+            future = self.resolver.submit(request.update_site_media_info)
+        else:
+            # queued from a playlist; never resolved yet
+            future = self.resolver.submit(request.prepare)
+        future.add_done_callback(
+            partial(self._on_lookup_done, request, events.request_refreshed))
+
+    def _on_lookup_done(self, request, event, future):
+        # runs on the resolver pool; only fire events from here
+        error = future.exception()
+        if error:
+            # (prepare and the like report their own failures in error;
+            # anything raised is a bug, but the sender still gets told)
+            logging.error('looking up request failed: {}'.format(
+                repr(error)))
+            request.error = 'failed to look up media ({})'.format(
+                error.__class__.__name__)
+        self.fire(event(request), self.channel)
+
+    def _expand_playlist(self, playlist):
+        # replace a listed playlist with its items, unresolved; they count
+        # as stale, so each is resolved as it nears the head of the queue
+        config = self.shm['config']['PlayRequest']
+
+        items = list()
+        for entry in playlist.playlist_entries:
+            item = PlayRequest(
+                config,
+                self.httpsession,
+                playlist.sender,
+                request_uri=urlparse(
+                    self.canonicalizer.canonicalize(entry['uri'])),
+                cache=self.mediacache,
+                extractor=self.extractor,
+                format_selector=self.format_selector,
+                failures=self.failurecache,
+                breaker=self.breaker,
+                canonicalizer=self.canonicalizer,
+                inflight=self.inflight
+            )
+            item.request_type = RequestTypes.SITE
+            item.title = entry['title']
+            item.duration = entry['duration']
+            item.source_site = entry['source_site']
+            items.append(item)
+
+        position = self.requestqueue.index(playlist)
+        self.requestqueue.rotate(-position)
+        self.requestqueue.popleft()
+        self.requestqueue.extendleft(reversed(items))
+        self.requestqueue.rotate(position)
+        return (position + 1, position + len(items))
+
+    def _find_queued(self, uri, exclude=None):
+        # queue index of another request for the same (canonical) URL
+        for idx, queued in enumerate(self.requestqueue):
+            if queued is exclude or queued.direct:
+                continue
+            queued_uri = queued.request_uri
+            if isinstance(queued_uri, ParseResult):
+                queued_uri = queued_uri.geturl()
+            if queued_uri and (
+                self.canonicalizer.canonicalize(queued_uri) == uri
+            ):
+                return idx
+        return None
+
+    def _absorb_duplicate(self, sender, uri, exclude=None):
+        # apply duplicate_policy to a request for an already queued URL;
+        # True if the request was merged into the queued one, or rejected
+        policy = self.shm['config']['PlayerManager'].get(
+            'duplicate_policy', 'keep')
+        if policy == 'keep':
+            return False
+        idx = self._find_queued(uri, exclude)
+        if idx is None:
+            return False
+
+        queued = self.requestqueue[idx]
+        if policy == 'merge':
+            # counts as a vote for the queued request
+            queued.upvote(sender)
+            msg = '/msg {} "{}" is already queued (#{}); '.format(
+                sender, queued.title, idx + 1
+            ) + 'your request was merged with it.'
+            self.fire(events.do_send_message(msg),
+                      self.parent.ichcapi.channel)
+        else:
+            msg = "/msg {} couldn't queue your request &mdash; ".format(
+                sender) + 'already queued at #{}.'.format(idx + 1)
+            self.fire(events.do_send_message(msg, MessagePriority.HIGH),
+                      self.parent.ichcapi.channel)
+        return True
+
+    def _preresolve(self, uris):
+        # look up the URLs repeat searches would get next, into the cache
+        config = self.shm['config']['PlayRequest']
+        for uri in uris:
+            request = PlayRequest(
+                config,
+                self.httpsession,
+                None,
+                request_uri=urlparse(self.canonicalizer.canonicalize(uri)),
+                cache=self.mediacache,
+                extractor=self.extractor,
+                format_selector=self.format_selector,
+                failures=self.failurecache,
+                breaker=self.breaker,
+                canonicalizer=self.canonicalizer,
+                inflight=self.inflight
+            )
+            self.resolver.submit(request.prepare)
+
+    def _get_remaining_time(self):
+        # seconds left of the current media; 0 if unknown
+        if not self._media_playing():
+            return 0
+        if self.current_request.live_source:
+            return 0
+        elapsed = time() - self.playback_started
+        return max(0, self.current_request.duration - elapsed)
+
     def _media_playing(self):
         if self.player_mode is None:
             return False
@@ -537,54 +904,285 @@ class PlayerManager(BaseComponent):
             return None
         return response
 
-    def player_active(self):
-        socket_file = self.shm['config']['control_socket_file']
-        if path.exists(socket_file):
-            # check for zombie
-            if self.player_process:
-                if self.player_process.poll():
-                    logging.warning(
-                        'player socket active with exited player process')
-                    if self.player_client:
-                        self.player_client.close()
-                    # del self.player_process
-                    self.player_process.wait()
-                    remove(socket_file)
-                    return False
-                return True
-            else:
-                logging.critical(
-                    'player socket active with no tracked player process')
-                self.fire(events.do_shutdown(), self.parent.channel)
+    def start_extractor(self):
+        logging.info('starting extraction service')
+        self.extractor_process = Popen(['/usr/bin/python3', 'bin/extract.py'])
+        self._service_started('extraction service')
+
+    def start_playserver(self):
+        logging.info('starting player server')
+        self.playserver_process = Popen(
+            ['/usr/bin/python3', 'bin/playserver.py'])
+        self._service_started('player server')
+
+    def _service_started(self, name):
+        state = self.services.setdefault(name, [0, None, None])
+        state[1] = time()
+        state[2] = None
+
+    def _service_exited(self, name):
+        # how long to wait before restarting a service that exited: not at
+        # all after a good run, and doubling with each exit in a row soon
+        # after starting; None once that has happened service_max_restarts
+        # times, and it's to be given up on
+        config = self.shm['config']['PlayerManager']
+        state = self.services[name]
+        if time() - state[1] < config.get('service_min_uptime', 60):
+            state[0] += 1
         else:
+            state[0] = 0
+        if state[0] >= config.get('service_max_restarts', 5):
+            return None
+        if not state[0]:
+            return 0
+        return config.get('service_restart_delay', 5) * 2 ** (state[0] - 1)
+
+    def _check_service(self, name, process, restart):
+        # bring a resident service back if it died; returns False once it's
+        # given up on
+        if process.poll() is None:
+            return True
+
+        state = self.services[name]
+        if state[2] is None:
+            delay = self._service_exited(name)
+            if delay is None:
+                logging.error(
+                    '{} exited ({}) {} times in a row right after '
+                    'starting; giving up on it'.format(
+                        name, process.returncode, state[0]))
+                return False
+            state[2] = time() + delay
+            logging.error('{} exited ({}); restarting in {}s'.format(
+                name, process.returncode, delay))
+
+        if time() >= state[2]:
+            restart()
+        return True
+
+    def _player_restart_due(self):
+        # (backing off from players that keep failing, like services)
+        if self.player_given_up:
             return False
+        state = self.services.get('player')
+        return not state or state[2] is None or time() >= state[2]
+
+    def _spawn_player(self):
+        # status and exit come back as player_* events (the callbacks run
+        # on the player's watcher thread); each player gets a control
+        # socket of its own, so a new one never trips over the last one's
+        self.players_started += 1
+        self._service_started('player')
+        player = PlayerProcess(
+            self.stream_id,
+            '{}.{}'.format(
+                self.shm['config']['control_socket_file'],
+                self.players_started),
+            self._on_player_status,
+            lambda player: self.fire(
+                events.player_exited(player), self.channel),
+            playserver=self.playserver)
+
+        Timer(
+            float(self.shm['config']['PlayerManager'].get(
+                'player_start_timeout', 30)),
+            events.player_start_timed_out(player),
+            self.channel
+        ).register(self)
+        return player
+
+    def _on_player_status(self, player, status, *args):
+        if status == 'ready':
+            self.fire(events.player_ready(player), self.channel)
+        elif status == 'prerolled' and args:
+            self.fire(events.player_prerolled(player, args[0]), self.channel)
+        elif status in ('ended', 'failed') and args:
+            self.fire(
+                events.player_media_ended(
+                    player, args[0], status == 'failed'),
+                self.channel)
+
+    def _get_standby(self, request):
+        # ID of the media preloaded for a request, if any
+        for media_id, standby in self.standby_media.items():
+            if standby is request:
+                return media_id
+        return None
 
-    def stop_player(self):
-        self.player_mode = None
-        # try graceful stop with command
+    def _fill_standby(self):
+        # keep each of the next standby_depth resolved items in the queue
+        # preloaded in the player, and nothing else
+        # (configs from before warm standby load each item as it comes up)
+        depth = self.shm['config']['PlayerManager'].get('standby_depth', 0)
+        upcoming = list(islice(self.requestqueue, depth))
+        for media_id, request in list(self.standby_media.items()):
+            if request not in upcoming or request.error:
+                self._drop_standby(media_id)
+
+        if self.in_shutdown or not self.player_client:
+            return None
+        for request in upcoming:
+            if self._get_standby(request) or not request.prepared:
+                continue
+            if request.resolving or request.refreshing or request.error:
+                continue
+            if request in self.standby_failed:
+                # would likely fail again; it gets loaded when it's up
+                continue
+            if request.live_source or self._media_stale(request, 0):
+                # (live media would fall behind while standing by)
+                continue
+            logging.info('prerolling on standby: "{}"'.format(request.title))
+            media_id = str(next(self.media_ids))
+            response = self._command_player(
+                ['preload', media_id, request.media_uri, False])
+            if response and response[0] == 'OK':
+                self.standby_media[media_id] = request
+            else:
+                self.standby_failed.add(request)
+
+    def _drop_standby(self, media_id):
+        request = self.standby_media.pop(media_id)
+        self.standby_prerolled.discard(media_id)
+        logging.info('dropping standby media: "{}"'.format(request.title))
         if self.player_client:
+            self._command_player(['drop', media_id])
+
+    def _advance_queue(self):
+        # have the player play what's next, or idle; the player streams
+        # throughout, and the player_* event handlers take it from there
+        self._dequeue_lock = True
+
+        if self.player_process is None:
+            # no player running; it idles once it's connected
+            if (
+                self.stream_id and not self.in_shutdown and
+                self._player_restart_due()
+            ):
+                self.player_mode = None
+                self.player_process = self._spawn_player()
+        elif self.player_client:
+            self._fill_standby()
+            if self.player_mode != 'media':
+                self._play_next()
+
+        self._dequeue_lock = False
+
+    def _play_next(self):
+        if not self._queue_ready():
+            if self.player_mode != 'idle':
+                # nothing ready to play; idle
+                logging.info('request queue empty; idling')
+                self._command_player(['idle'])
+                self.player_mode = 'idle'
+            return None
+
+        # pop next request from queue
+        logging.info('dequeing and playing next request')
+        self.current_request = self.requestqueue.popleft()
+
+        # send error message if request prep failed, otherwise play
+        if self.current_request.error:
+            logging.warning('request failed to update')
+            self._send_playback_error(self.current_request.error)
+            return None
+
+        # the player switches to it once it has prerolled, right away if
+        # it's preloaded already
+        media_id = self._get_standby(self.current_request)
+        if media_id is not None:
+            del self.standby_media[media_id]
+            if media_id in self.standby_prerolled:
+                self.standby_prerolled.discard(media_id)
+                self.shm['stats']['PlayerManager']['standby_switches'] += 1
+        else:
+            media_id = str(next(self.media_ids))
+        response = self._command_player([
+            'load',
+            media_id,
+            self.current_request.media_uri,
+            self.current_request.live_source
+        ])
+        if not response or response[0] != 'OK':
+            logging.error('player failed to load media: {}'.format(
+                response[1] if response else 'no response'))
+            self._send_playback_error('player failed to load media')
+            return None
+
+        dur_string = '~'
+        if self.current_request.live_source:
+            dur_string = 'LIVE'
+        elif self.current_request.duration > 0:
+            dur_string = '{:d}:{:02d}'.format(
+                *self.get_min_sec(self.current_request.duration))
+
+        msg = '/me is now playing * **{}** (from '.format(
+            self.current_request.title
+        ) + '**{}**)* &mdash; {} &mdash; *for {}*'.format(
+            self.current_request.source_site,
+            dur_string, self.current_request.sender)
+        self.fire(
+            events.do_send_message(msg, MessagePriority.HIGH),
+            self.parent.ichcapi.channel
+        )
+
+        self.player_mode = 'media'
+        self.current_media = media_id
+        self.playback_started = time()
+
+        # the next item's standby, now that this one's taken
+        self._fill_standby()
+
+    def _send_playback_error(self, error):
+        msg = "/msg {} error trying to play ".format(
+            self.current_request.sender
+        ) + "your request &mdash; {}".format(error)
+        self.fire(
+            events.do_send_message(msg, MessagePriority.HIGH),
+            self.parent.ichcapi.channel
+        )
+
+    def _stop_media(self):
+        # back to idling; the next queue check plays what's next
+        logging.info('stopping media')
+        self.current_media = None
+        self.player_mode = 'idle'
+        self._command_player(['idle'])
+
+    def _stop_process(self, player, wait=False):
+        # ask a player process to exit; player_exited follows once it has
+        # (wait: block until then, for shutdown)
+        if player.exited:
+            return None
+        player.stopping = True
+
+        # try graceful stop with command
+        if player.client:
             logging.info('sending stop command to player')
             try:
-                self.player_client.send(['stop'])
+                player.client.send(['stop'])
             except IOError:
-                # DEBUG THIS BRANCH -- SEEMS TO HANG; CHECK FOR DEFUNCTS
                 logging.error(
                     "IO error encountered when attempting to send to player "
                     "connection")
-            finally:
-                # loop until socket file created
-                timeout = self.shm['config']['PlayerManager'][
-                    'player_state_change_timeout']
-                wait = self.shm['config']['PlayerManager'][
-                    'player_state_change_delay']
-                socket_file = self.shm['config']['control_socket_file']
-                while timeout > 0:
-                    timeout -= 1
-                    if not path.exists(socket_file):
-                        break
-                    sleep(wait)
-
-                self.player_client.close()
+                player.process.terminate()
+            player.client.close()
+            player.client = None
+        else:
+            # not taking commands yet
+            player.process.terminate()
+
+        if wait:
+            player.wait(float(self.shm['config']['PlayerManager'].get(
+                'player_stop_timeout', 10)))
+
+    def stop_player(self, wait=False):
+        self.player_mode = None
+        self.player_client = None
+        if self.player_process:
+            self._stop_process(self.player_process, wait)
+            if wait:
+                self.player_process.remove_socket()
 
     # HANDLER METHODS ##################################################
 
@@ -596,6 +1194,80 @@ class PlayerManager(BaseComponent):
             "'{}' received; checking request queue".format(self.stream_id))
         self.fire(events.do_check_request_queue(), self.channel)
 
+        if not self.refresh_timer:
+            self.refresh_timer = Timer(
+                float(self.shm['config']['PlayerManager'].get(
+                    'refresh_check_interval', 5)),
+                events.do_refresh_queued_media(),
+                self.channel,
+                persist=True
+            ).register(self)
+
+    @handler('do_check_services')
+    def _check_services(self):
+        if self.in_shutdown:
+            return None
+
+        # bring the extraction service back if it died (requests run
+        # youtube-dl themselves meanwhile, and from then on if it's given
+        # up on)
+        if self.extractor_process and not self._check_service(
+            'extraction service', self.extractor_process,
+            self.start_extractor
+        ):
+            self.extractor_process = None
+            self.extractor = None
+
+        # likewise the player server (players start directly meanwhile)
+        if self.playserver_process and not self._check_service(
+            'player server', self.playserver_process, self.start_playserver
+        ):
+            self.playserver_process = None
+            self.playserver = None
+
+        if not self.service_timer:
+            self.service_timer = Timer(
+                float(self.shm['config']['PlayerManager'].get(
+                    'service_check_interval', 5)),
+                events.do_check_services(),
+                self.channel,
+                persist=True
+            ).register(self)
+
+    @handler('do_scan_library')
+    def _scan_library(self):
+        self.library.start_scan()
+
+    @handler('do_refresh_queued_media')
+    def _refresh_queued_media(self):
+        # re-resolve media URLs that would go stale before the items at the
+        # head of the queue get to play, shortly before they do
+        config = self.shm['config']['PlayerManager']
+
+        eta = self._get_remaining_time()
+        for idx, request in enumerate(self.requestqueue):
+            # (configs from before background refreshes don't get them)
+            if idx >= config.get('refresh_lookahead', 0):
+                break
+            if eta > config.get('refresh_lead_time', 60):
+                break
+            if not (request.resolving or request.refreshing or request.error):
+                if self._media_stale(request, eta):
+                    self._refresh_request(request)
+            eta += request.duration
+
+    @handler('request_refreshed')
+    def _request_refreshed(self, request):
+        request.watchdog.unregister()
+        request.refreshing = False
+        if request.cancelled:
+            return None
+        self.shm['stats']['PlayerManager']['media_refreshes'] += 1
+        if request.error:
+            logging.warning(
+                'failed to refresh media info: "{}" ({})'.format(
+                    request.title, request.error))
+
     @handler('do_queue_play_request')
     def _queue_request(self, request):
         config = self.shm['config']['PlayRequest']
@@ -611,15 +1283,33 @@ class PlayerManager(BaseComponent):
                 config,
                 self.httpsession,
                 request_sender,
-                filter_module=self.filter_module,
-                search_terms=request_body
+                searcher=self.searcher,
+                search_terms=request_body,
+                library=self.library,
+                cache=self.mediacache,
+                extractor=self.extractor,
+                format_selector=self.format_selector,
+                failures=self.failurecache,
+                breaker=self.breaker,
+                canonicalizer=self.canonicalizer,
+                inflight=self.inflight
             )
         elif request_type == 'site':
+            request_body = self.canonicalizer.canonicalize(request_body)
+            if self._absorb_duplicate(request_sender, request_body):
+                return None
             request = PlayRequest(
                 config,
                 self.httpsession,
                 request_sender,
-                request_uri=urlparse(request_body, scheme='http')
+                request_uri=urlparse(request_body, scheme='http'),
+                cache=self.mediacache,
+                extractor=self.extractor,
+                format_selector=self.format_selector,
+                failures=self.failurecache,
+                breaker=self.breaker,
+                canonicalizer=self.canonicalizer,
+                inflight=self.inflight
             )
         elif request_type == 'direct':
             request = PlayRequest(
@@ -627,170 +1317,140 @@ class PlayerManager(BaseComponent):
                 self.httpsession,
                 request_sender,
                 direct=True,
-                request_uri=urlparse(request_body, scheme='http')
+                request_uri=urlparse(request_body, scheme='http'),
+                prober=self.prober
             )
 
         if request:
+            # queue a placeholder now; prepare() runs in the resolver pool
+            request.title = '(resolving) {}'.format(request_body)
+            request.resolving = True
+            self.requestqueue.append(request)
+
+            request.watchdog = Timer(
+                self.resolve_timeout,
+                events.request_timed_out(request),
+                self.channel
+            ).register(self)
 
-            request.prepare()
+            future = self.resolver.submit(request.prepare)
+            future.add_done_callback(partial(
+                self._on_lookup_done, request, events.request_prepared))
+
+    def _remove_resolving(self, request, reason):
+        # drop a request that failed to resolve and let its sender know
+        request.resolving = False
+        if request in self.requestqueue:
+            self.requestqueue.remove(request)
+
+        msg = "/msg {} couldn't queue your request &mdash; {}".format(
+            request.sender, reason)
+        self.fire(events.do_send_message(msg, MessagePriority.HIGH),
+                  self.parent.ichcapi.channel)
+
+    @handler('request_prepared')
+    def _request_prepared(self, request):
+        request.watchdog.unregister()
+        if request.cancelled:
+            # dropped or timed out while resolving; already handled
+            return None
 
-            if request.prepared:
+        if not request.prepared:
+            self.shm['stats']['PlayerManager']['requests_failed'] += 1
+            self._remove_resolving(request, request.error)
+            return None
 
-                logging.warning(
-                    'queuing request: "{}" (page: {} | media: {})'.format(
-                        request.title, request.request_uri, request.media_uri
-                    ))
-                self.requestqueue.append(request)
+        self.shm['stats']['PlayerManager']['requests_resolved'] += 1
+        request.resolving = False
 
-                dur_string = '~'
-                if request.live_source:
-                    dur_string = 'LIVE'
-                elif request.duration > 0:
-                    dur_string = '{:d}:{:02d}'.format(
-                        *self.get_min_sec(request.duration))
-
-                if self.player_mode == 'media':
-                    msg = '/msg {} "{}" (from {}) &mdash; '.format(
-                        request.sender,
-                        request.title,
-                        request.source_site
-                    ) + '{} &mdash; added to queue (#{}).'.format(
-                        dur_string, len(self.requestqueue))
-                    self.fire(events.do_send_message(msg),
-                              self.parent.ichcapi.channel)
-            else:
-                msg = "/msg {} couldn't queue your request &mdash; {}".format(
-                    request_sender, request.error)
-                self.fire(events.do_send_message(msg),
-                          self.parent.ichcapi.channel)
+        if request.request_type == RequestTypes.PLAYLIST:
+            if request not in self.requestqueue:
+                return None
+            first, last = self._expand_playlist(request)
+            logging.warning(
+                'queuing {} items from playlist: "{}" (page: {})'.format(
+                    last - first + 1, request.title, request.request_uri))
+            msg = '/msg {} "{}" (from {}) &mdash; {} items '.format(
+                request.sender,
+                request.title,
+                request.source_site,
+                last - first + 1
+            ) + 'added to queue (#{}&ndash;{}).'.format(first, last)
+            self.fire(events.do_send_message(msg),
+                      self.parent.ichcapi.channel)
+            return None
 
-    @handler('do_check_request_queue')
-    def _check_request_queue(self):
-        if not self.in_shutdown:
+        if request.search_terms and self._absorb_duplicate(
+            request.sender, request.request_uri, exclude=request
+        ):
+            # search found something already queued
+            if request in self.requestqueue:
+                self.requestqueue.remove(request)
+            return None
 
-            self._dequeue_lock = True
+        if request.search_candidates:
+            self._preresolve(request.search_candidates)
 
-            start_playback = False
+        logging.warning(
+            'queuing request: "{}" (page: {} | media: {})'.format(
+                request.title, request.request_uri, request.media_uri
+            ))
 
-            if self.player_process:
-                if not self.player_active():
-                    self.player_mode = None
-                    # player exited; make new player process, at least for idle
-                    start_playback = True
-                elif self.player_mode != 'media' and len(self.requestqueue):
-                    # player in idle mode; requests queued -- stop current
-                    # player
-                    self.stop_player()
-                    start_playback = True
-            else:
-                # no player loaded; make new player process, at least for idle
-                start_playback = True
+        dur_string = '~'
+        if request.live_source:
+            dur_string = 'LIVE'
+        elif request.duration > 0:
+            dur_string = '{:d}:{:02d}'.format(
+                *self.get_min_sec(request.duration))
+        elif request.content_length:
+            dur_string = '{:.1f} MB'.format(request.content_length / 1e6)
+
+        if self.player_mode == 'media' and request in self.requestqueue:
+            msg = '/msg {} "{}" (from {}) &mdash; '.format(
+                request.sender,
+                request.title,
+                request.source_site
+            ) + '{} &mdash; added to queue (#{}).'.format(
+                dur_string, self.requestqueue.index(request) + 1)
+            self.fire(events.do_send_message(msg),
+                      self.parent.ichcapi.channel)
+
+        # switch from idle without waiting for the next queue check
+        if self.player_mode == 'idle' and not self.in_shutdown:
+            self._advance_queue()
+
+    @handler('request_timed_out')
+    def _request_timed_out(self, request):
+        if request.cancelled:
+            return None
 
-            playback_error = None
+        if request.refreshing:
+            # give up on it; the dequeue reports the error
+            logging.warning(
+                'timed out refreshing media info: "{}"'.format(
+                    request.title))
+            request.cancel()
+            request.refreshing = False
+            request.error = (
+                'timed out looking up media; please try again later')
+            self.shm['stats']['PlayerManager']['requests_timed_out'] += 1
+            return None
 
-            if start_playback:
-                address = self.shm['config']['control_socket_file']
-                if not len(self.requestqueue):
-                    # nothing queued to play; idle
-                    logging.info('request queue empty; idling')
+        if not request.resolving:
+            return None
 
-                    self.player_mode = 'idle'
-                    self.player_process = Popen([
-                        '/usr/bin/python3', 'bin/play.py', self.stream_id
-                    ])
-                else:
-                    # pop next request from queue
-                    logging.info('dequeing and playing next request')
-                    self.current_request = self.requestqueue.popleft()
-
-                    # refresh info in case our media url went stale
-                    if self.current_request.request_type == RequestTypes.SITE:
-                        age = time() - self.current_request.last_fetched
-                        if age > self.shm['config']['PlayerManager'][
-                                'site_media_info_max_age']:
-                            logging.warning('media info stale; updating')
-                            self.current_request.update_site_media_info()
-
-                    # send error message if request prep failed, otherwise play
-                    if self.current_request.error:
-                        logging.warning('request failed to update')
-                        playback_error = True
-                    else:
-
-                        dur_string = '~'
-                        if self.current_request.live_source:
-                            dur_string = 'LIVE'
-                        elif self.current_request.duration > 0:
-                            dur_string = '{:d}:{:02d}'.format(
-                                *self.get_min_sec(
-                                    self.current_request.duration))
-
-                        msg = '/me is now playing * **{}** (from '.format(
-                            self.current_request.title
-                        ) + '**{}**)* &mdash; {} &mdash; *for {}*'.format(
-                            self.current_request.source_site,
-                            dur_string, self.current_request.sender)
-                        self.fire(events.do_send_message(msg),
-                                  self.parent.ichcapi.channel)
-
-                        self.player_mode = 'media'
-                        self.player_process = Popen([
-                            '/usr/bin/python3',
-                            'bin/play.py',
-                            self.stream_id,
-                            self.current_request.media_uri
-                        ])
-
-                if self.player_process:
-                    # loop until socket file created
-                    timeout = self.shm['config']['PlayerManager'][
-                        'player_state_change_timeout']
-                    wait = self.shm['config']['PlayerManager'][
-                        'player_state_change_delay']
-                    while timeout > 0:
-                        timeout -= 1
-                        if path.exists(address):
-                            break
-                        sleep(wait)
-
-                    if timeout == 0:
-                        # see if player simply failed to start
-                        if not self.player_process.poll():
-                            logging.critical(
-                                'timed out waiting for player socket and '
-                                'player still alive')
-                            self.fire(events.do_shutdown(),
-                                      self.parent.channel)
-                        else:
-                            logging.error('player failed to start')
-                            playback_error = True
-                    else:
-                        # send play command to new player process, via client
-                        self.player_client = Client(address, authkey=b'phoebe')
-
-                        try:
-                            self.player_client.send(['play'])
-                        except IOError:
-                            logging.error(
-                                "IO error encountered when attempting to send "
-                                "to player connection")
-                            logging.critical(
-                                'failed to issue play command to player '
-                                'process')
-                            self.fire(events.do_shutdown(),
-                                      self.parent.channel)
-
-                if playback_error:
-                    msg = "/msg {} error trying to play ".format(
-                        self.current_request.sender
-                    ) + "your request &mdash; {}".format(
-                        self.current_request.error)
-                    self.fire(
-                        events.do_send_message(msg),
-                        self.parent.ichcapi.channel
-                    )
+        logging.warning(
+            'timed out resolving request: "{}"'.format(
+                request.request_uri or request.search_terms))
+        request.cancel()
+        self.shm['stats']['PlayerManager']['requests_timed_out'] += 1
+        self._remove_resolving(
+            request, 'timed out looking up media; please try again later')
 
-            self._dequeue_lock = False
+    @handler('do_check_request_queue')
+    def _check_request_queue(self):
+        if not self.in_shutdown:
+            self._advance_queue()
 
             Timer(
                 float(self.shm['config']['PlayerManager']
@@ -799,6 +1459,127 @@ class PlayerManager(BaseComponent):
                 self.channel
             ).register(self)
 
+    @handler('player_ready')
+    def _player_ready(self, player):
+        if player is not self.player_process or player.stopping:
+            # superseded meanwhile
+            return None
+
+        # send play command to new player process, via client; it idles
+        # until given media
+        try:
+            player.client = Client(player.address, authkey=b'phoebe')
+            player.client.send(['play'])
+        except IOError:
+            logging.error(
+                "IO error encountered when attempting to send "
+                "to player connection")
+            logging.critical(
+                'failed to issue play command to player process')
+            self.fire(events.do_shutdown(), self.parent.channel)
+            return None
+
+        self.player_client = player.client
+        self.player_mode = 'idle'
+        if not self.in_shutdown:
+            self._advance_queue()
+
+    @handler('player_prerolled')
+    def _player_prerolled(self, player, media_id):
+        if player is not self.player_process:
+            return None
+        if media_id in self.standby_media:
+            self.standby_prerolled.add(media_id)
+
+    @handler('player_media_ended')
+    def _player_media_ended(self, player, media_id, failed):
+        if player is not self.player_process:
+            return None
+
+        if media_id in self.standby_media:
+            request = self.standby_media.pop(media_id)
+            self.standby_prerolled.discard(media_id)
+            if failed:
+                logging.error('standby media failed: "{}"'.format(
+                    request.title))
+                self.standby_failed.add(request)
+            return None
+
+        if media_id != self.current_media:
+            # stopped meanwhile
+            return None
+        self.current_media = None
+
+        if failed and self.player_mode == 'media':
+            logging.error('player failed to play media')
+            self._send_playback_error('player failed to play media')
+
+        # the player idles by itself until given what's next
+        self.player_mode = 'idle'
+        if not self.in_shutdown:
+            self._advance_queue()
+
+    @handler('player_exited')
+    def _player_exited(self, player):
+        player.remove_socket()
+        if player is not self.player_process:
+            return None
+        self.player_process = None
+
+        if self.player_client:
+            self.player_client.close()
+            self.player_client = None
+
+        failed = not player.ready and not player.stopping
+        if failed:
+            logging.error('player failed to start')
+        elif not player.stopping:
+            logging.error('player exited unexpectedly')
+            if self.player_mode == 'media':
+                self._send_playback_error('player stopped unexpectedly')
+
+        # standby media went with it
+        self.standby_media.clear()
+        self.standby_prerolled.clear()
+        self.current_media = None
+        self.player_mode = None
+
+        if player.stopping or self.in_shutdown:
+            return None
+
+        # start a new player right away after a good run; one that keeps
+        # failing gets a growing delay, left to the queue checks, and is
+        # given up on after a few tries
+        delay = self._service_exited('player')
+        if delay is None:
+            logging.critical(
+                'player failed {} times in a row; giving up on '
+                'playback'.format(self.services['player'][0]))
+            self.player_given_up = True
+            msg = (
+                '/me has stopped playing media &mdash; the player keeps '
+                'failing; an operator needs to take a look.')
+            self.fire(
+                events.do_send_message(msg, MessagePriority.HIGH),
+                self.parent.ichcapi.channel)
+            return None
+        self.services['player'][2] = time() + delay
+        if delay:
+            logging.error('starting a new player in {}s'.format(delay))
+        else:
+            self._advance_queue()
+
+    @handler('player_start_timed_out')
+    def _player_start_timed_out(self, player):
+        if player.exited or player.stopping:
+            return None
+        if player is not self.player_process or player.ready:
+            return None
+        logging.critical(
+            'timed out waiting for player to get ready and player still '
+            'alive')
+        self.fire(events.do_shutdown(), self.parent.channel)
+
     @handler('do_change_vote')
     def _change_vote(self, sender, change):
         if not self._media_playing():
@@ -824,7 +1605,13 @@ class PlayerManager(BaseComponent):
             b = '&mdash; to **{}{}** &mdash; *for {}*'.format(
                 adjective, self.current_request.rating, sender)
             msg = '{} {}'.format(a, b)
-            self.fire(events.do_send_message(msg), self.parent.ichcapi.channel)
+            # only the latest rating of an item is worth sending
+            self.fire(
+                events.do_send_message(
+                    msg, supersede='rating:{}'.format(
+                        id(self.current_request))),
+                self.parent.ichcapi.channel
+            )
 
         min_rating = self.shm['config']['PlayerManager']['min_request_rating']
         if self.current_request.rating < min_rating:
@@ -834,9 +1621,12 @@ class PlayerManager(BaseComponent):
                     self.current_request.request_uri
                 ))
             msg = '/me stopped player &mdash; item voted out.'
-            self.fire(events.do_send_message(msg), self.parent.ichcapi.channel)
+            self.fire(
+                events.do_send_message(msg, MessagePriority.HIGH),
+                self.parent.ichcapi.channel
+            )
 
-            self.stop_player()
+            self._stop_media()
 
     @handler('do_seek_current_media')
     def _seek_current_media(self, sender, seek_secs, is_elevated):
@@ -848,6 +1638,12 @@ class PlayerManager(BaseComponent):
             return None
         if sender != self.current_request.sender and not is_elevated:
             return None
+        if not self.current_request.seekable:
+            msg = "/msg {} can't seek &mdash; {}".format(
+                sender, "the file's server doesn't support it.")
+            self.fire(events.do_send_message(msg),
+                      self.parent.ichcapi.channel)
+            return None
 
         # send seek command, interval to player
         response = self._command_player(['seek', seek_secs])
@@ -868,6 +1664,12 @@ class PlayerManager(BaseComponent):
             return None
         if sender != self.current_request.sender and not is_elevated:
             return None
+        if not self.current_request.seekable:
+            msg = "/msg {} can't jump &mdash; {}".format(
+                sender, "the file's server doesn't support it.")
+            self.fire(events.do_send_message(msg),
+                      self.parent.ichcapi.channel)
+            return None
 
         # send jump command, target to player
         response = self._command_player(['jump', jump_secs])
@@ -895,7 +1697,7 @@ class PlayerManager(BaseComponent):
                 self.current_request.title,
                 self.current_request.request_uri
             ))
-        self.stop_player()
+        self._stop_media()
 
     @handler('do_get_current_info')
     def _get_current_info(self, sender):
@@ -945,7 +1747,10 @@ class PlayerManager(BaseComponent):
             '/me also has a * **direct link** &mdash;* {}'.format(
                 self.current_request.request_uri))
         for m in msg:
-            self.fire(events.do_send_message(m), self.parent.ichcapi.channel)
+            self.fire(
+                events.do_send_message(m, MessagePriority.HIGH),
+                self.parent.ichcapi.channel
+            )
 
     @handler('do_get_queue_info')
     def _get_queue_info(self, sender):
@@ -982,6 +1787,12 @@ class PlayerManager(BaseComponent):
         if self.requestqueue[item_idx].sender != sender and not is_elevated:
             return False
         dropped_title = self.requestqueue[item_idx].title
+        if (
+            self.requestqueue[item_idx].resolving or
+            self.requestqueue[item_idx].refreshing
+        ):
+            # stop any lookup in progress
+            self.requestqueue[item_idx].cancel()
         del self.requestqueue[item_idx]
 
         msg = '/me has dropped from the queue: {}. &mdash; *{}*'.format(
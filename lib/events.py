@@ -2,12 +2,24 @@ from __future__ import absolute_import
 from circuits import Event
 
 
+class api_query_failed(Event):
+    '''
+    Event fired by the HTTP worker when an API query raises an error.
+    '''
+
+
 class broadcast_ready(Event):
     '''
     Event fired when a stream ID is received, signaling broadcasting can begin.
     '''
 
 
+class command_activity(Event):
+    '''
+    Event fired when a command is dispatched, to keep API polling responsive.
+    '''
+
+
 class command_received(Event):
     '''
     Event fired whenever a command is parsed from new messages.
@@ -27,6 +39,12 @@ class do_check_request_queue(Event):
     '''
 
 
+class do_check_services(Event):
+    '''
+    Event fired (by timer) to restart resident services that have exited.
+    '''
+
+
 class do_get_current_info(Event):
     '''
     Event fired to fetch info about media
@@ -71,6 +89,24 @@ class do_queue_play_request(Event):
     '''
 
 
+class do_refresh_queued_media(Event):
+    '''
+    Event fired to refresh media URLs of queued items about to play.
+    '''
+
+
+class do_retry_api_query(Event):
+    '''
+    Event fired (by timer) to retry a failed API query.
+    '''
+
+
+class do_scan_library(Event):
+    '''
+    Event fired (by timer) to look for changed files in the media library.
+    '''
+
+
 class do_send_message(Event):
     '''
     Event fired whenever a new message is to be sent to the channel.
@@ -108,6 +144,56 @@ class messages_received(Event):
     '''
 
 
+class player_exited(Event):
+    '''
+    Event fired when a player process has exited.
+    '''
+
+
+class player_media_ended(Event):
+    '''
+    Event fired when media in the player process has ended, or failed.
+    '''
+
+
+class player_prerolled(Event):
+    '''
+    Event fired when the player process has prerolled standby media.
+    '''
+
+
+class player_ready(Event):
+    '''
+    Event fired when a player process is ready for its control connection.
+    '''
+
+
+class player_start_timed_out(Event):
+    '''
+    Event fired (by timer) if a player process took too long to get ready.
+    '''
+
+
+class request_prepared(Event):
+    '''
+    Event fired by the resolver pool when a play request is done preparing.
+    '''
+
+
+class request_refreshed(Event):
+    '''
+    Event fired by the resolver pool when a queued item's media info is
+    done refreshing.
+    '''
+
+
+class request_timed_out(Event):
+    '''
+    Event fired when a play request takes too long to prepare, or a queued
+    item's media info too long to refresh.
+    '''
+
+
 class room_joined(Event):
     '''
     Event fired after room successfully joined.
@@ -0,0 +1,87 @@
+from __future__ import absolute_import
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Client
+from threading import local
+
+
+class ExtractionFailed(Exception):
+    '''
+    Raised when youtube-dl could not extract media info for a URL.
+    '''
+
+
+class ExtractorUnavailable(Exception):
+    '''
+    Raised when the extraction service can't be reached.
+    '''
+
+
+class ExtractorClient:
+    '''
+    Client for the resident extraction service (bin/extract.py).
+
+    Each resolver thread keeps a connection of its own, served by its own
+    worker (and YoutubeDL instance) in the service, so extractions run in
+    parallel. A lost connection is reported as ExtractorUnavailable and
+    reopened on the next call.
+    '''
+
+    def __init__(self, config):
+        self.address = config['socket_file']
+        self.local = local()
+
+    def _connect(self):
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            try:
+                conn = Client(self.address, authkey=b'phoebe')
+            except (
+                OSError, IOError, EOFError, AuthenticationError
+            ) as e:
+                raise ExtractorUnavailable(str(e))
+            self.local.conn = conn
+        return conn
+
+    def _disconnect(self):
+        conn = getattr(self.local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self.local.conn = None
+
+    def _call(self, command, request):
+        conn = self._connect()
+        try:
+            conn.send(command)
+        except (IOError, OSError):
+            # the service restarted since we last used this connection
+            self._disconnect()
+            conn = self._connect()
+            try:
+                conn.send(command)
+            except (IOError, OSError) as e:
+                self._disconnect()
+                raise ExtractorUnavailable(str(e))
+
+        try:
+            # wait for the result, giving up if the request is cancelled
+            while not conn.poll(.25):
+                if request is not None and request.cancelled:
+                    self._disconnect()
+                    raise ExtractionFailed('cancelled')
+            response = conn.recv()
+        except (EOFError, IOError, OSError) as e:
+            self._disconnect()
+            raise ExtractorUnavailable(str(e) or 'connection lost')
+
+        if response[0] != 'OK':
+            raise ExtractionFailed(response[1])
+        return response[1]
+
+    def extract(self, url, media_format, fields=None, request=None):
+        # fields: the info dict keys to return (default: all of them)
+        return self._call(['extract', url, media_format, fields], request)
+
+    def list_playlist(self, url, max_items, fields=None, request=None):
+        # a flat listing: title, extractor_key and unresolved entries (with
+        # just the given fields)
+        return self._call(['list', url, max_items, fields], request)
@@ -0,0 +1,272 @@
+from __future__ import absolute_import
+from concurrent.futures import ThreadPoolExecutor
+from os import path, walk
+from re import findall, MULTILINE, search
+from subprocess import (
+    CalledProcessError, check_output, STDOUT, TimeoutExpired)
+from threading import Lock
+from time import time
+import logging
+import sqlite3
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    mtime REAL,
+    size INTEGER,
+    playable INTEGER,
+    title TEXT,
+    duration INTEGER,
+    codecs TEXT
+);
+CREATE VIRTUAL TABLE IF NOT EXISTS titles USING fts5(
+    path UNINDEXED,
+    title,
+    name
+);
+'''
+
+# files between commits while scanning, so progress survives a restart
+COMMIT_EVERY = 50
+
+
+def parse_discoverer_output(output):
+    # title, duration (secs) and codecs from gst-discoverer-1.0 output;
+    # None if it found no media
+    if not search(r'^\s*(?:video|audio)(?: #\d+)?: ', output, MULTILINE):
+        return None
+
+    duration = 0
+    duration_match = search(
+        r'^\s*Duration: (\d+):(\d+):([\d.]+)', output, MULTILINE)
+    if duration_match:
+        duration = int(
+            int(duration_match.group(1)) * 3600 +
+            int(duration_match.group(2)) * 60 +
+            float(duration_match.group(3)))
+
+    title_match = search(r'^\s*title: (.+)$', output, MULTILINE)
+    codecs = findall(
+        r'^\s*(?:video|audio)(?: #\d+)?: (.+)$', output, MULTILINE)
+
+    return {
+        'title': title_match.group(1).strip() if title_match else None,
+        'duration': duration,
+        'codecs': ', '.join(codec.strip() for codec in codecs)
+    }
+
+
+class MediaLibrary:
+    '''
+    Full-text index of the media files under a local directory, so
+    keyword searches can be answered without going out to the network.
+
+    Files are probed with gst-discoverer-1.0 for title, duration and
+    codecs (falling back to the file name when it isn't installed) and
+    kept in an SQLite FTS5 index. Scans are incremental: only files whose
+    size or modification time changed are probed again, and files that
+    went away are dropped. Scans run one at a time, off the event loop.
+    '''
+
+    def __init__(self, config, stats):
+        self.root = path.abspath(path.expanduser(config['library_path']))
+        self.extensions = tuple(
+            '.{}'.format(extension.lower().lstrip('.'))
+            for extension in config['library_extensions'])
+        self.discoverer_bin = config['discoverer_bin']
+        self.discoverer_timeout = config['discoverer_timeout']
+
+        self.stats = stats
+        self.stats['library_files'] = 0
+        self.stats['library_scans'] = 0
+        self.stats['library_lookups'] = 0
+        self.stats['library_hits'] = 0
+
+        self.db = sqlite3.connect(
+            config['index_file'] or ':memory:', check_same_thread=False)
+        self.db.executescript(SCHEMA)
+        self.lock = Lock()
+        self._count_files()
+
+        self.scanner = ThreadPoolExecutor(max_workers=1)
+        self.scanning = False
+        self.stopping = False
+
+    # CONVENIENCE METHODS ##############################################
+
+    def _count_files(self):
+        with self.lock:
+            self.stats['library_files'] = self.db.execute(
+                'SELECT COUNT(*) FROM files WHERE playable = 1').fetchone()[0]
+
+    def _list_files(self):
+        # path: (mtime, size) for media files under the library root
+        found = dict()
+        for dirpath, dirnames, filenames in walk(self.root):
+            # skip hidden directories (.Trash and such)
+            dirnames[:] = [
+                dirname for dirname in dirnames if not dirname.startswith('.')]
+            for filename in filenames:
+                if not filename.lower().endswith(self.extensions):
+                    continue
+                filepath = path.join(dirpath, filename)
+                try:
+                    found[filepath] = (
+                        path.getmtime(filepath), path.getsize(filepath))
+                except OSError:
+                    # gone already
+                    continue
+        return found
+
+    def _discover(self, filepath):
+        # info for the index; None if it's no media, False if it couldn't
+        # be probed this time
+        fallback = {'title': None, 'duration': 0, 'codecs': ''}
+        if not self.discoverer_bin:
+            return fallback
+        try:
+            output = check_output(
+                [self.discoverer_bin, filepath],
+                stderr=STDOUT,
+                timeout=self.discoverer_timeout
+            ).decode('utf-8', 'replace')
+        except OSError:
+            logging.warning(
+                "'{}' not found; indexing file names only".format(
+                    self.discoverer_bin))
+            self.discoverer_bin = None
+            return fallback
+        except CalledProcessError:
+            # not media, or broken
+            return None
+        except TimeoutExpired:
+            # (a busy disk, say) leave it to the next scan
+            logging.warning('timed out probing {}'.format(filepath))
+            return False
+        except Exception as e:
+            logging.warning('could not probe {}: {}'.format(
+                filepath, repr(e)))
+            return None
+        return parse_discoverer_output(output)
+
+    @staticmethod
+    def _file_title(filepath):
+        # "some_clip.name.mp4" -> "some clip name"
+        name = path.splitext(path.basename(filepath))[0]
+        return ' '.join(findall(r'[^\W_]+', name)) or name
+
+    def _index_file(self, filepath, mtime, size, info):
+        relpath = path.relpath(filepath, self.root)
+        self.db.execute('DELETE FROM titles WHERE path = ?', (filepath,))
+        if info is None:
+            self.db.execute(
+                'INSERT OR REPLACE INTO files (path, mtime, size, playable) '
+                'VALUES (?, ?, ?, 0)', (filepath, mtime, size))
+            return
+        title = info['title'] or self._file_title(filepath)
+        self.db.execute(
+            'INSERT OR REPLACE INTO files VALUES (?, ?, ?, 1, ?, ?, ?)',
+            (filepath, mtime, size, title, info['duration'], info['codecs']))
+        self.db.execute(
+            'INSERT INTO titles (path, title, name) VALUES (?, ?, ?)',
+            (filepath, title, ' '.join(findall(r'[^\W_]+', relpath))))
+
+    def _forget_file(self, filepath):
+        self.db.execute('DELETE FROM files WHERE path = ?', (filepath,))
+        self.db.execute('DELETE FROM titles WHERE path = ?', (filepath,))
+
+    def _close(self):
+        if self.db:
+            self.db.close()
+            self.db = None
+
+    # PUBLIC METHODS ###################################################
+
+    def scan(self):
+        start = time()
+        found = self._list_files()
+        with self.lock:
+            known = dict(
+                (row[0], (row[1], row[2])) for row in
+                self.db.execute('SELECT path, mtime, size FROM files'))
+
+        changed = [
+            filepath for filepath in found if known.get(filepath) != (
+                found[filepath])]
+        removed = [filepath for filepath in known if filepath not in found]
+
+        for idx, filepath in enumerate(changed):
+            if self.stopping:
+                break
+            # probe outside the lock; lookups go on meanwhile
+            info = self._discover(filepath)
+            if info is False:
+                continue
+            with self.lock:
+                self._index_file(filepath, *found[filepath], info=info)
+                if idx % COMMIT_EVERY == COMMIT_EVERY - 1:
+                    self.db.commit()
+        with self.lock:
+            for filepath in removed:
+                self._forget_file(filepath)
+            self.db.commit()
+            self.stats['library_scans'] += 1
+        self._count_files()
+
+        if changed or removed:
+            logging.warning(
+                'library scan: {} files updated, {} removed ({:.1f}s)'.format(
+                    len(changed), len(removed), time() - start))
+
+    def start_scan(self):
+        # scan in the background, unless a scan is running already
+        if self.scanning or self.stopping:
+            return False
+        self.scanning = True
+
+        def run_scan():
+            try:
+                self.scan()
+            except Exception as e:
+                logging.error('library scan failed: {}'.format(repr(e)))
+            finally:
+                with self.lock:
+                    self.scanning = False
+                    if self.stopping:
+                        self._close()
+
+        self.scanner.submit(run_scan)
+        return True
+
+    def search(self, search_terms):
+        '''
+        Returns the best match (dict of path, title, duration, codecs) for
+        files matching all of the search terms, or None.
+        '''
+        words = findall(r'[^\W_]+', search_terms.lower())
+        if not words:
+            return None
+        query = ' '.join('"{}"'.format(word) for word in words)
+
+        with self.lock:
+            if not self.db:
+                return None
+            self.stats['library_lookups'] += 1
+            row = self.db.execute(
+                'SELECT files.path, files.title, files.duration, '
+                'files.codecs FROM titles JOIN files USING (path) '
+                'WHERE titles MATCH ? ORDER BY bm25(titles) LIMIT 1',
+                (query,)).fetchone()
+            if not row or not path.isfile(row[0]):
+                # (or removed since the last scan)
+                return None
+            self.stats['library_hits'] += 1
+        return dict(zip(('path', 'title', 'duration', 'codecs'), row))
+
+    def shutdown(self):
+        # a running scan stops after the file it's on, and closes the index
+        with self.lock:
+            self.stopping = True
+            if not self.scanning:
+                self._close()
+        self.scanner.shutdown(wait=False)
@@ -0,0 +1,162 @@
+from __future__ import absolute_import
+from collections import OrderedDict
+import logging
+
+
+class MessagePriority:
+    LOW = 0
+    NORMAL = 1
+    HIGH = 2
+
+
+class OutboundQueue:
+    '''
+    Scheduler for messages waiting to be sent to the API.
+
+    Messages are kept in lanes, one per destination (the room, or each user
+    we /msg), and leave a lane highest priority first, oldest first. Queued
+    messages with the same supersede key replace one another, consecutive
+    messages that share a prefix are merged into a single send, and the
+    configured drop policy applies once the queue is full.
+    '''
+
+    def __init__(self, config, stats):
+        # (configs from before the queue lack these; messages then go out
+        # one by one, and none are dropped)
+        self.coalesce = config.get('coalesce_messages', False)
+        self.max_length = config.get('max_message_length', 400)
+        self.max_queued = config.get('max_queued_messages', 0)
+        self.drop_policy = config.get('queue_drop_policy', 'lowest')
+
+        self.stats = stats
+        self.stats['messages_coalesced'] = 0
+        self.stats['messages_superseded'] = 0
+        self.stats['messages_dropped'] = 0
+
+        # lane -> list of [priority, sequence, message, supersede key]
+        self._lanes = OrderedDict()
+        self._sequence = 0
+        self._count = 0
+
+    def __len__(self):
+        return self._count
+
+    # CONVENIENCE METHODS ##############################################
+
+    @staticmethod
+    def get_lane(message):
+        # private messages only need ordering per recipient
+        if message.startswith('/msg '):
+            parts = message.split(' ', 2)
+            if len(parts) > 2:
+                return 'msg:{}'.format(parts[1].lower())
+        return 'room'
+
+    @staticmethod
+    def get_merge_prefix(message):
+        # returns the prefix under which a message can be merged with others
+        # sharing it, or None when it must be sent on its own
+        if message.startswith('/msg '):
+            parts = message.split(' ', 2)
+            if len(parts) > 2:
+                return '/msg {} '.format(parts[1].lower())
+            return None
+        if message.startswith('/me '):
+            return '/me '
+        if message.startswith('/'):
+            # other slash commands (/modme, /cam ...) never merge
+            return None
+        return ''
+
+    def _remove(self, entry):
+        lane = self.get_lane(entry[2])
+        self._lanes[lane].remove(entry)
+        if not len(self._lanes[lane]):
+            del self._lanes[lane]
+        self._count -= 1
+
+    def _entries(self):
+        for entries in self._lanes.values():
+            for entry in entries:
+                yield entry
+
+    def _make_room(self, priority):
+        # returns False when the incoming message is the one to drop
+        if self.drop_policy == 'newest' or not self._count:
+            return False
+
+        if self.drop_policy == 'oldest':
+            victim = min(self._entries(), key=lambda e: e[1])
+        else:
+            victim = min(self._entries(), key=lambda e: (e[0], e[1]))
+            if victim[0] > priority:
+                return False
+
+        logging.warning(
+            "outbound queue full; dropping message: '{}'".format(victim[2]))
+        self._remove(victim)
+        self.stats['messages_dropped'] += 1
+        return True
+
+    # PUBLIC METHODS ###################################################
+
+    def lanes(self):
+        return list(self._lanes.keys())
+
+    def push(self, message, priority=MessagePriority.NORMAL, supersede=None):
+        if supersede is not None:
+            for entry in list(self._entries()):
+                if entry[3] == supersede:
+                    self._remove(entry)
+                    self.stats['messages_superseded'] += 1
+
+        if self.max_queued and self._count >= self.max_queued:
+            if not self._make_room(priority):
+                logging.warning(
+                    "outbound queue full; dropping message: '{}'".format(
+                        message))
+                self.stats['messages_dropped'] += 1
+                return False
+
+        lane = self.get_lane(message)
+        if lane not in self._lanes:
+            self._lanes[lane] = list()
+
+        self._sequence += 1
+        self._lanes[lane].append(
+            [priority, self._sequence, message, supersede])
+        self._count += 1
+        return True
+
+    def pop(self, lane):
+        entries = sorted(self._lanes[lane], key=lambda e: (-e[0], e[1]))
+
+        head = entries[0]
+        taken = [head]
+        message = head[2]
+
+        # merge following messages of the same priority and prefix, as long
+        # as the result stays within the maximum message length
+        prefix = self.get_merge_prefix(message) if self.coalesce else None
+        if prefix is not None:
+            for entry in entries[1:]:
+                if entry[0] != head[0]:
+                    break
+                if self.get_merge_prefix(entry[2]) != prefix:
+                    break
+                merged = '{} &mdash; {}'.format(
+                    message, entry[2][len(prefix):])
+                if len(merged) > self.max_length:
+                    break
+                message = merged
+                taken.append(entry)
+
+        for entry in taken:
+            self._remove(entry)
+        self.stats['messages_coalesced'] += len(taken) - 1
+
+        # rotate lanes for fairness
+        if lane in self._lanes:
+            self._lanes.move_to_end(lane)
+
+        return message
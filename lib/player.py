@@ -0,0 +1,212 @@
+from __future__ import absolute_import
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Client
+from multiprocessing.reduction import send_handle
+from os import close, environ, fdopen, kill, path, pipe, remove
+from signal import SIGKILL, SIGTERM
+from subprocess import Popen
+from threading import Event, Thread
+from time import sleep, time
+import logging
+
+# environment variables for bin/play.py: the inherited fd to report status
+# on, and the control socket to listen on
+STATUS_FD_VARIABLE = 'PHOEBE_STATUS_FD'
+CONTROL_SOCKET_VARIABLE = 'PHOEBE_CONTROL_SOCKET'
+
+
+class PlayServerUnavailable(Exception):
+    '''
+    Raised when the player server can't be reached, or can't fork.
+    '''
+
+
+class PlayServerClient:
+    '''
+    Client for the resident player server (bin/playserver.py), which forks
+    players off a process with GStreamer loaded already instead of each
+    starting a Python interpreter of its own. Used from the event loop
+    only. A lost connection is reported as PlayServerUnavailable and
+    reopened on the next call.
+    '''
+
+    def __init__(self, config):
+        self.address = config['socket_file']
+        self.conn = None
+
+    def _disconnect(self):
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+    def _send(self, command, status_fd):
+        if self.conn is None:
+            try:
+                self.conn = Client(self.address, authkey=b'phoebe')
+            except (
+                OSError, IOError, EOFError, AuthenticationError
+            ) as e:
+                raise PlayServerUnavailable(str(e))
+        self.conn.send(command)
+        send_handle(self.conn, status_fd, None)
+
+    def spawn(self, args, status_fd):
+        # args: stream ID, address; returns the player's PID
+        command = ['spawn'] + list(args)
+        try:
+            self._send(command, status_fd)
+        except (IOError, OSError):
+            # the server restarted since we last used this connection
+            self._disconnect()
+            try:
+                self._send(command, status_fd)
+            except (IOError, OSError) as e:
+                self._disconnect()
+                raise PlayServerUnavailable(str(e))
+
+        try:
+            response = self.conn.recv()
+        except (EOFError, IOError, OSError) as e:
+            self._disconnect()
+            raise PlayServerUnavailable(str(e) or 'connection lost')
+
+        if response[0] != 'OK':
+            raise PlayServerUnavailable(response[1])
+        return response[1]
+
+
+class ForkedProcess:
+    '''
+    Stands in for the Popen of a player forked by the player server; the
+    server reaps it, so its exit status is unknown here.
+    '''
+
+    # seconds between checks for the process being gone
+    POLL_INTERVAL = .01
+
+    def __init__(self, pid):
+        self.pid = pid
+
+    def _signal(self, signum):
+        try:
+            kill(self.pid, signum)
+        except OSError:
+            # gone already
+            pass
+
+    def terminate(self):
+        self._signal(SIGTERM)
+
+    def kill(self):
+        self._signal(SIGKILL)
+
+    def wait(self, timeout=None):
+        # the status pipe can close before the player's other sockets (the
+        # output lock among them) are released, so wait for the process to
+        # be gone entirely, as Popen.wait does
+        deadline = None if timeout is None else time() + timeout
+        while deadline is None or time() < deadline:
+            try:
+                kill(self.pid, 0)
+            except OSError:
+                return None
+            sleep(self.POLL_INTERVAL)
+        return None
+
+
+class PlayerProcess:
+    '''
+    A player process (bin/play.py) and the status pipe it reports on.
+
+    The player writes "ready" to the pipe once it accepts control
+    connections on its address, and then a line per change in the media
+    it was given: "prerolled", "ended" or "failed", each followed by the
+    media's ID. It holds the pipe open until it exits, so end-of-file on
+    it means the process is gone, however it went. A watcher thread reads
+    the pipe and calls on_status(player, status, *args) and
+    on_exit(player) as that happens; neither needs any polling.
+
+    Players are forked by the player server if one is given (and
+    reachable), or else started as processes of their own.
+    '''
+
+    def __init__(
+        self,
+        stream_id,
+        address,
+        on_status,
+        on_exit,
+        playserver=None
+    ):
+        self.address = address
+        self.on_status = on_status
+        self.on_exit = on_exit
+
+        # control connection, once ready
+        self.client = None
+
+        self.ready = False
+        self.exited = False
+        self.stopping = False
+        self.returncode = None
+        self.closed = Event()
+
+        read_fd, write_fd = pipe()
+        try:
+            self.process = None
+            if playserver:
+                try:
+                    self.process = ForkedProcess(playserver.spawn(
+                        [stream_id, address], write_fd))
+                except PlayServerUnavailable as e:
+                    logging.warning(
+                        'player server unavailable ({}); starting player '
+                        'process directly'.format(e))
+
+            if self.process is None:
+                env = dict(environ)
+                env[STATUS_FD_VARIABLE] = str(write_fd)
+                env[CONTROL_SOCKET_VARIABLE] = address
+                self.process = Popen(
+                    ['/usr/bin/python3', 'bin/play.py', stream_id],
+                    pass_fds=(write_fd,), env=env)
+        except Exception:
+            close(read_fd)
+            raise
+        finally:
+            # the player's copy is the only one left
+            close(write_fd)
+
+        self.watcher = Thread(target=self._watch, args=(read_fd,))
+        self.watcher.daemon = True
+        self.watcher.start()
+
+    def _watch(self, read_fd):
+        with fdopen(read_fd, 'rb') as status_pipe:
+            for line in status_pipe:
+                status = line.decode('utf-8', 'replace').split()
+                if not status:
+                    continue
+                if status[0] == 'ready':
+                    self.ready = True
+                self.on_status(self, *status)
+        # end of file: the player exited (or closed the pipe on its way out)
+        self.closed.set()
+        self.returncode = self.process.wait()
+        self.exited = True
+        logging.info('player process {} exited ({})'.format(
+            self.process.pid, self.returncode))
+        self.on_exit(self)
+
+    def wait(self, timeout):
+        # block until exited, killing the process past the timeout
+        if not self.closed.wait(timeout):
+            logging.error('player process {} did not exit; killing'.format(
+                self.process.pid))
+            self.process.kill()
+            self.closed.wait(timeout)
+
+    def remove_socket(self):
+        # a player that crashed leaves its socket file behind
+        if path.exists(self.address):
+            remove(self.address)
@@ -0,0 +1,153 @@
+from __future__ import absolute_import
+from __future__ import division
+from time import localtime
+
+
+class PollingStrategy:
+    '''
+    Decides how long ICHCAPI waits between recv polls.
+
+    Strategies are told about each API response (with the number of chat
+    lines it carried) and each command received, and asked for the next
+    interval whenever a recv poll is sent.
+    '''
+
+    def __init__(self, config):
+        self.config = config
+        self.interval = config['polling_interval']
+
+    def on_receive(self, count, now):
+        pass
+
+    def on_command(self, now):
+        pass
+
+    def next_interval(self, now):
+        return self.interval
+
+
+class StepThrottle(PollingStrategy):
+    '''
+    Steps the interval up by api_throttle_step once recvs have come back
+    empty for api_throttle_idle_timeout seconds, and back down to
+    polling_interval on the first new message.
+    '''
+
+    def __init__(self, config):
+        super(StepThrottle, self).__init__(config)
+        self.empty_recvs = 0
+
+    def on_receive(self, count, now):
+        if count:
+            self.empty_recvs = 0
+            self.interval = self.config['polling_interval']
+            return
+
+        self.empty_recvs += 1
+        idle_polls = int(
+            self.config['api_throttle_idle_timeout'] //
+            self.config['polling_interval'])
+        if (
+            self.empty_recvs > idle_polls - 1 and
+            self.interval < self.config['max_polling_interval']
+        ):
+            self.interval += self.config['api_throttle_step']
+
+
+class EWMAPolling(PollingStrategy):
+    '''
+    Polls at a fraction of the moving average of the time between messages,
+    stretching towards max_polling_interval as chat goes quiet and dropping
+    straight to the floor for a while after any command.
+    '''
+
+    def __init__(self, config):
+        super(EWMAPolling, self).__init__(config)
+        self.alpha = config.get('polling_ewma_alpha', 0.3)
+        self.scale = config.get('polling_ewma_scale', 0.5)
+        self.command_hold = config.get('polling_command_hold', 30.0)
+
+        self.mean_gap = None
+        self.last_arrival = None
+        self.last_command = None
+
+    def _get_bounds(self, now):
+        return (
+            self.config['polling_interval'],
+            self.config['max_polling_interval']
+        )
+
+    def on_receive(self, count, now):
+        if not count:
+            return
+        if self.last_arrival is not None:
+            gap = (now - self.last_arrival) / count
+            if self.mean_gap is None:
+                self.mean_gap = gap
+            else:
+                self.mean_gap = (
+                    self.alpha * gap + (1 - self.alpha) * self.mean_gap)
+        self.last_arrival = now
+
+    def on_command(self, now):
+        self.last_command = now
+
+    def next_interval(self, now):
+        floor, ceiling = self._get_bounds(now)
+
+        # someone using the bot keeps polling at the floor for a while
+        busy = (
+            self.last_command is not None and
+            now - self.last_command < self.command_hold)
+
+        interval = floor
+        if self.mean_gap is not None and not busy:
+            # a silence longer than the average gap is itself evidence the
+            # room has slowed down
+            gap = max(self.mean_gap, now - self.last_arrival)
+            interval = self.scale * gap
+
+        self.interval = min(max(interval, floor), ceiling)
+        return self.interval
+
+
+class ScheduledPolling(EWMAPolling):
+    '''
+    EWMAPolling with a per-hour floor taken from polling_profile, a mapping
+    of local hour ranges ('start-end', inclusive, or a single hour) to
+    minimum intervals. Ranges may wrap past midnight ('22-6').
+    '''
+
+    def __init__(self, config):
+        super(ScheduledPolling, self).__init__(config)
+        self.profile = list()
+        for hours, floor in (config.get('polling_profile') or {}).items():
+            start, _, end = str(hours).partition('-')
+            start = int(start)
+            end = int(end) if end else start
+            self.profile.append((start, end, float(floor)))
+
+    def _get_bounds(self, now):
+        floor, ceiling = super(ScheduledPolling, self)._get_bounds(now)
+        hour = localtime(now).tm_hour
+        for start, end, profile_floor in self.profile:
+            if start <= end:
+                in_range = start <= hour <= end
+            else:
+                in_range = hour >= start or hour <= end
+            if in_range:
+                floor = min(profile_floor, ceiling)
+                break
+        return (floor, ceiling)
+
+
+STRATEGIES = {
+    'step': StepThrottle,
+    'ewma': EWMAPolling,
+    'schedule': ScheduledPolling
+}
+
+
+def get_polling_strategy(config):
+    # (configs from before polling_strategy get the step throttle they had)
+    return STRATEGIES[config.get('polling_strategy', 'step')](config)
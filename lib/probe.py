@@ -0,0 +1,144 @@
+from __future__ import absolute_import
+from collections import OrderedDict
+from OpenSSL.SSL import Error as OpenSSLError
+from requests.exceptions import RequestException
+from threading import Lock
+from time import time
+import logging
+
+# non-audio/video content types media files are served as
+MEDIA_CONTENT_TYPES = frozenset([
+    'application/octet-stream',
+    'binary/octet-stream',
+    'application/ogg',
+    'application/mp4',
+    'application/x-mpegurl',
+    'application/vnd.apple.mpegurl',
+    'application/dash+xml',
+    'application/x-matroska',
+    'application/x-flv'
+])
+
+
+class DirectMediaProbe:
+    '''
+    Checks direct-play links before they're queued: one HEAD request (or a
+    one-byte ranged GET, for servers that don't do HEAD) tells whether the
+    link is alive and serves media, and how long and seekable it is.
+
+    Results, good and bad, are kept for probe_cache_ttl seconds. Probes run
+    from the resolver pool, so cache access is under a lock.
+    '''
+
+    def __init__(self, config, httpsession, stats):
+        self.timeout = float(config.get('probe_timeout', 5.0))
+        self.ttl = config.get('probe_cache_ttl', 600)
+        self.size = config.get('probe_cache_size', 200)
+        self.httpsession = httpsession
+
+        self.stats = stats
+        self.stats['direct_probes'] = 0
+        self.stats['probe_cache_hits'] = 0
+        self.stats['direct_probes_rejected'] = 0
+
+        # url: (result, probed)
+        self.results = OrderedDict()
+        self.lock = Lock()
+
+    # CONVENIENCE METHODS ##############################################
+
+    def _request(self, method, url, headers=None):
+        # headers only; the body is never read
+        response = self.httpsession.request(
+            method, url, headers=headers, timeout=self.timeout,
+            allow_redirects=True, stream=True)
+        response.close()
+        return response
+
+    @staticmethod
+    def _is_media(content_type):
+        if not content_type:
+            # unknown; let the player find out
+            return True
+        if content_type.startswith(('video/', 'audio/')):
+            return True
+        return content_type in MEDIA_CONTENT_TYPES
+
+    def _probe(self, url):
+        result = {
+            'error': None,
+            'content_type': None,
+            'length': None,
+            'seekable': False
+        }
+
+        try:
+            response = self._request('HEAD', url)
+            if response.status_code in (403, 405, 501) or (
+                'Content-Type' not in response.headers
+            ):
+                # some servers only answer GETs properly
+                response = self._request('GET', url, {'Range': 'bytes=0-0'})
+        except (RequestException, OpenSSLError) as e:
+            logging.info('probe of {} failed: {}'.format(url, repr(e)))
+            result['error'] = "couldn't reach the link; check it for typos"
+            return result
+
+        if response.status_code >= 400:
+            result['error'] = 'link is dead (HTTP {})'.format(
+                response.status_code)
+            return result
+
+        content_type = response.headers.get('Content-Type', '')
+        content_type = content_type.split(';')[0].strip().lower()
+        result['content_type'] = content_type
+        if not self._is_media(content_type):
+            result['error'] = ' '.join([
+                'link isn\'t a media file ({});'.format(content_type),
+                'try !play for pages with media on them'
+            ])
+            return result
+
+        try:
+            if response.status_code == 206:
+                # Content-Range: bytes 0-0/<length>
+                result['length'] = int(
+                    response.headers['Content-Range'].rsplit('/', 1)[1])
+            elif 'Content-Length' in response.headers:
+                result['length'] = int(response.headers['Content-Length'])
+        except (KeyError, IndexError, ValueError):
+            # unknown ('*') or garbled
+            pass
+        if result['length'] == 0:
+            result['error'] = 'link is an empty file'
+            return result
+
+        result['seekable'] = response.status_code == 206 or (
+            response.headers.get('Accept-Ranges', '').lower() == 'bytes')
+        return result
+
+    # PUBLIC METHODS ###################################################
+
+    def probe(self, url):
+        '''
+        Returns a dict of error (None if the link looks playable),
+        content_type, length (None if unknown) and seekable.
+        '''
+        now = time()
+        with self.lock:
+            cached = self.results.get(url)
+            if cached and now - cached[1] < self.ttl:
+                self.stats['probe_cache_hits'] += 1
+                self.results.move_to_end(url)
+                return dict(cached[0])
+
+        result = self._probe(url)
+        with self.lock:
+            self.stats['direct_probes'] += 1
+            if result['error']:
+                self.stats['direct_probes_rejected'] += 1
+            self.results[url] = (result, now)
+            self.results.move_to_end(url)
+            while len(self.results) > self.size:
+                self.results.popitem(last=False)
+        return dict(result)
@@ -0,0 +1,195 @@
+from __future__ import absolute_import
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from importlib.util import module_from_spec, spec_from_file_location
+from threading import Lock
+from time import time
+import logging
+
+
+class SearchFailed(Exception):
+    '''
+    Raised when no search filter found anything for the search terms.
+    '''
+
+
+def load_filter_module(name):
+    # filters/{name}.py; filters/ is no package, so load by path
+    spec = spec_from_file_location(
+        'filters.{}'.format(name), 'filters/{}.py'.format(name))
+    if spec is None:
+        raise ImportError('no such module: filters/{}.py'.format(name))
+    module = module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+class SearchFilters:
+    '''
+    Registry of the keyword search filters in filters/ named in
+    search_filters.
+
+    A search queries all filters at once, each within its own timeout
+    (the module's TIMEOUT, or search_timeout); the first to come back with
+    results wins. Filters return candidate URLs, best first, with
+    get_uris(httpsession, search_terms) -> [0, [url, ...]] or
+    [code, error]; older single-result filters (get_uri -> [0, url]) still
+    work, but their results aren't cached.
+
+    Candidates are kept per search terms (search_cache_ttl), and searching
+    again takes the next one from there instead of querying the filters.
+    The candidates after it (search_preresolve of them) are returned too,
+    so they can be looked up ahead of time.
+    '''
+
+    def __init__(self, config, stats):
+        # (configs from before this don't keep or look ahead at candidates)
+        self.timeout = float(config.get('search_timeout', 5.0))
+        self.cache_ttl = config.get('search_cache_ttl', 0)
+        self.cache_size = config.get('search_cache_size', 200)
+        self.preresolve = config.get('search_preresolve', 0)
+
+        self.stats = stats
+        self.stats['searches'] = 0
+        self.stats['search_cache_hits'] = 0
+        self.stats['filter_timeouts'] = 0
+        self.stats['filter_errors'] = 0
+
+        filter_names = config.get('search_filters')
+        if filter_names is None and config.get('search_filter'):
+            # the single filter setting search_filters replaced
+            logging.warning(
+                'search_filter is deprecated; list the filter under '
+                'search_filters instead')
+            filter_names = [config['search_filter']]
+
+        # (name, function, timeout, cacheable)
+        self.filters = list()
+        for filter_name in filter_names or []:
+            try:
+                filter_module = load_filter_module(filter_name)
+                timeout = float(getattr(
+                    filter_module, 'TIMEOUT', self.timeout))
+                if hasattr(filter_module, 'get_uris'):
+                    self.filters.append((
+                        filter_name, filter_module.get_uris, timeout, True))
+                else:
+                    self.filters.append((
+                        filter_name, self._wrap_get_uri(filter_module),
+                        timeout, False))
+            except Exception as e:
+                error = ' '.join([
+                    'error loading search filter',
+                    '\'filters/{}.py\''.format(filter_name)
+                ])
+                logging.warning(error)
+                logging.warning(str(e))
+
+        self.workers = ThreadPoolExecutor(
+            max_workers=config.get('search_workers', 8))
+
+        # search terms: [candidates, next index, fetched]
+        self.candidates = OrderedDict()
+        self.lock = Lock()
+
+    @staticmethod
+    def _wrap_get_uri(filter_module):
+        def get_uris(httpsession, search_terms):
+            output = filter_module.get_uri(httpsession, search_terms)
+            if isinstance(output, list) and len(output) == 2:
+                if output[0] == 0:
+                    return [0, [output[1]]]
+            return output
+        return get_uris
+
+    # CONVENIENCE METHODS ##############################################
+
+    def _take(self, entry):
+        # the next candidate, and the ones after it to resolve ahead
+        candidates = entry[0]
+        idx = entry[1] % len(candidates)
+        entry[1] += 1
+        upcoming = [
+            candidates[(idx + offset) % len(candidates)]
+            for offset in range(1, min(self.preresolve + 1, len(candidates)))]
+        return (candidates[idx], upcoming)
+
+    def _query(self, httpsession, search_terms):
+        start = time()
+        futures = dict()
+        for name, get_uris, timeout, cacheable in self.filters:
+            future = self.workers.submit(get_uris, httpsession, search_terms)
+            futures[future] = (name, timeout, cacheable)
+
+        errors = list()
+        pending = set(futures)
+        while pending:
+            # give up on filters past their timeout (they finish unheeded)
+            now = time()
+            for future in list(pending):
+                name, timeout = futures[future][:2]
+                if now - start >= timeout:
+                    pending.discard(future)
+                    self.stats['filter_timeouts'] += 1
+                    logging.warning(
+                        "search filter '{}' timed out".format(name))
+            if not pending:
+                break
+
+            done, pending = wait(
+                pending,
+                timeout=min(
+                    start + futures[future][1] for future in pending) - now,
+                return_when=FIRST_COMPLETED)
+            for future in done:
+                name, timeout, cacheable = futures[future]
+                try:
+                    output = future.result()
+                except Exception as e:
+                    self.stats['filter_errors'] += 1
+                    logging.error(
+                        "search filter '{}' failed: {}".format(name, repr(e)))
+                    continue
+
+                if not (isinstance(output, list) and len(output) == 2):
+                    errors.append('search filter returned unexpected data')
+                elif output[0] != 0:
+                    errors.append(output[1])
+                elif not (isinstance(output[1], list) and output[1]):
+                    errors.append('search filter returned unexpected data')
+                else:
+                    return (output[1], cacheable)
+
+        if errors:
+            raise SearchFailed(errors[0])
+        raise SearchFailed('search timed out; please try again later')
+
+    # PUBLIC METHODS ###################################################
+
+    def search(self, httpsession, search_terms):
+        '''
+        Returns (URL, upcoming URLs) for the search terms; raises
+        SearchFailed if nothing was found.
+        '''
+        key = ' '.join(search_terms.lower().split())
+        with self.lock:
+            self.stats['searches'] += 1
+            entry = self.candidates.get(key)
+            if entry and time() - entry[2] < self.cache_ttl:
+                self.stats['search_cache_hits'] += 1
+                self.candidates.move_to_end(key)
+                return self._take(entry)
+
+        candidates, cacheable = self._query(httpsession, search_terms)
+        entry = [list(candidates), 0, time()]
+        if cacheable:
+            with self.lock:
+                self.candidates[key] = entry
+                self.candidates.move_to_end(key)
+                while len(self.candidates) > self.cache_size:
+                    self.candidates.popitem(last=False)
+        with self.lock:
+            return self._take(entry)
+
+    def shutdown(self):
+        self.workers.shutdown(wait=False)
@@ -0,0 +1,58 @@
+from __future__ import absolute_import
+from threading import Event, Lock
+
+
+class _Call:
+
+    def __init__(self):
+        self.done = Event()
+        self.result = None
+
+
+class SingleFlight:
+    '''
+    Coalesces concurrent calls by key: the first caller for a key runs the
+    function, and callers arriving while it runs wait for it and share its
+    result instead of running their own.
+
+    A result of None means the run was abandoned (e.g. cancelled), so
+    waiting callers go again, one of them running the function afresh.
+    Waiting callers give up once their request is cancelled.
+    '''
+
+    def __init__(self, stats):
+        self.stats = stats
+        self.stats['lookups_coalesced'] = 0
+
+        self.calls = dict()
+        self.lock = Lock()
+
+    def run(self, key, function, request=None):
+        '''
+        Returns (result, shared); shared is True for a result another
+        caller's run produced, or (None, True) if the request was cancelled
+        while waiting.
+        '''
+        while True:
+            with self.lock:
+                call = self.calls.get(key)
+                leader = call is None
+                if leader:
+                    call = self.calls[key] = _Call()
+
+            if leader:
+                try:
+                    call.result = function()
+                finally:
+                    with self.lock:
+                        del self.calls[key]
+                    call.done.set()
+                return (call.result, False)
+
+            while not call.done.wait(.25):
+                if request is not None and request.cancelled:
+                    return (None, True)
+            if call.result is not None:
+                with self.lock:
+                    self.stats['lookups_coalesced'] += 1
+                return (call.result, True)
@@ -1,15 +1,145 @@
 # from imp import load_source
 from __future__ import absolute_import
+from .extractor import ExtractionFailed, ExtractorUnavailable
+from .search import SearchFailed
 from json import loads
-from re import search
-from subprocess import CalledProcessError, check_output
+from pathlib import Path
+from re import search, IGNORECASE
+from subprocess import CalledProcessError, Popen, PIPE
 from time import time
 from six.moves.urllib.parse import urlparse, ParseResult
+import logging
+
+
+# the fields update_site_media_info() needs besides title and media URL;
+# nothing else youtube-dl extracts (formats, subtitles, thumbnails...) is
+# ever serialized for, or parsed by, the bot
+MEDIA_INFO_FIELDS = (
+    'extractor_key', 'is_live', 'duration', 'ext', 'format_id', 'vcodec',
+    'height', 'tbr', 'protocol')
+
+
+def parse_media_info(output):
+    '''
+    Parses youtube-dl's --get-title --get-url --get-filename output, with
+    MEDIA_INFO_FIELDS tab-separated in the filename template, into a dict
+    like the one --dump-json would give (but for just those fields).
+    '''
+    lines = output.decode('utf-8', 'replace').rstrip('\n').split('\n')
+    if len(lines) < 3:
+        raise ValueError('unexpected youtube-dl output')
+    values = lines[-1].split('\t')
+    if len(values) != len(MEDIA_INFO_FIELDS):
+        raise ValueError('unexpected youtube-dl output')
+
+    info = {'title': '\n'.join(lines[:-2]), 'url': lines[-2]}
+    for field, value in zip(MEDIA_INFO_FIELDS, values):
+        if value == 'NA':
+            # youtube-dl's placeholder for missing fields
+            continue
+        if field == 'is_live':
+            value = value == 'True'
+        elif field in ('duration', 'tbr'):
+            value = float(value)
+        elif field == 'height':
+            value = int(value)
+        info[field] = value
+    return info
+
+
+# what a flat (unresolved) playlist listing keeps of each entry
+PLAYLIST_ENTRY_FIELDS = (
+    'url', 'webpage_url', 'id', 'ie_key', 'title', 'duration')
+
+
+def get_playlist_entry_uri(entry):
+    # flat entries give a page URL, or just an ID for some extractors
+    for key in ('webpage_url', 'url'):
+        if urlparse(entry.get(key) or '').scheme in ('http', 'https'):
+            return entry[key]
+    if entry.get('ie_key') == 'Youtube' and entry.get('id'):
+        return 'https://www.youtube.com/watch?v={}'.format(entry['id'])
+    return None
 
 
 class RequestTypes:
     SITE = 1
     DIRECT = 2
+    PLAYLIST = 3
+    LOCAL = 4
+
+
+class FailureTypes:
+    # why update_site_media_info() failed; keys for failure_ttls
+    EXTRACT_FAILED = 'extract_failed'
+    NO_MEDIA = 'no_media'
+    MALFORMED = 'malformed'
+    INTERNAL = 'internal'
+    SITE_FAILING = 'site_failing'
+
+
+class FormatSelector:
+    '''
+    Builds the youtube-dl format spec for the player's output size.
+
+    Everything gets scaled to the output frame, so the smallest format at or
+    above the output height will do, H.264 first as it's cheapest to decode,
+    and within the bitrate connection_speed (kbit/s; 0 for no limit) allows.
+    Failing that, the largest format below the output height, then the best
+    available. explain() tells which of those rules picked a format.
+    '''
+
+    def __init__(self, player_config):
+        self.height = int(player_config['output_video_frame_height'])
+        self.max_bitrate = int(player_config.get('connection_speed', 0))
+
+        self.tiers = [
+            ('worst', {'min_height': True, 'h264': True, 'max_bitrate': True},
+             'smallest H.264 format at or above {}p'.format(self.height)),
+            ('worst', {'min_height': True, 'max_bitrate': True},
+             'smallest format at or above {}p'.format(self.height)),
+            ('best', {'below_height': True},
+             'largest format below {}p'.format(self.height)),
+            ('best', {},
+             'best format available (sizes unknown)')
+        ]
+
+        specs = list()
+        for selector, conditions in [tier[:2] for tier in self.tiers]:
+            filters = list()
+            if 'min_height' in conditions:
+                filters.append('[height>={}]'.format(self.height))
+            if 'below_height' in conditions:
+                filters.append('[height<{}]'.format(self.height))
+            if 'h264' in conditions:
+                filters.append('[vcodec^=avc1]')
+            if 'max_bitrate' in conditions and self.max_bitrate:
+                filters.append('[tbr<=?{}]'.format(self.max_bitrate))
+            filters.append('[protocol!=?m3u8_native]')
+            specs.append('{}{}'.format(selector, ''.join(filters)))
+        # last resort: anything youtube-dl considers best
+        specs.append('best')
+        self.spec = '/'.join(specs)
+
+    def explain(self, info):
+        height = info.get('height')
+        for selector, conditions, reason in self.tiers:
+            if 'min_height' in conditions:
+                if height is None or height < self.height:
+                    continue
+            if 'below_height' in conditions:
+                if height is None or height >= self.height:
+                    continue
+            if 'h264' in conditions:
+                if not (info.get('vcodec') or '').startswith('avc1'):
+                    continue
+            if 'max_bitrate' in conditions and self.max_bitrate:
+                if (info.get('tbr') or 0) > self.max_bitrate:
+                    continue
+            if info.get('protocol') == 'm3u8_native':
+                continue
+            return reason
+        return 'only format available'
 
 
 class PlayRequest:
@@ -21,65 +151,312 @@ class PlayRequest:
         sender,
         direct=False,
         request_uri=None,
-        filter_module=None,
-        search_terms=None
+        searcher=None,
+        search_terms=None,
+        cache=None,
+        extractor=None,
+        format_selector=None,
+        failures=None,
+        breaker=None,
+        canonicalizer=None,
+        inflight=None,
+        prober=None,
+        library=None
     ):
         self.config = config
         self.httpsession = httpsession
         self.sender = sender
         self.direct = direct
         self.request_uri = request_uri
-        self.filter_module = filter_module
+        self.searcher = searcher
         self.search_terms = search_terms
+        self.cache = cache
+        self.extractor = extractor
+        self.format_selector = format_selector
+        self.failures = failures
+        self.breaker = breaker
+        self.canonicalizer = canonicalizer
+        self.inflight = inflight
+        self.prober = prober
+        self.library = library
         self.duration = 0
         self.last_fetched = 0
+        self.expires_at = 0
         self.rating = 0
         self.title = ''
         self.votes = dict()
         self.error = None
+        self.failure_type = None
         self.source_site = None
         self.media_uri = None
         self.request_type = None
 
         self.live_source = False
 
+        # for direct play: what probing the link found (size in bytes)
+        self.content_length = None
+        self.seekable = True
+
+        # for playlists: dicts of uri, title, duration, source_site per item
+        self.playlist_entries = None
+
+        # for searches: the URLs a repeat search would get next
+        self.search_candidates = list()
+
         self.prepared = False
 
+        # set while prepare() or update_site_media_info() run in the
+        # background; cancel() stops them
+        self.resolving = False
+        self.refreshing = False
+        self.cancelled = False
+        self.process = None
+
     # PREPARE REQUEST BY POPULATING OTHER ATTRIBUTES ###################
 
-    def update_site_media_info(self):
-        # fix slash-escape issue in request URI
+    def _run_ydl(self, args):
+        # like check_output, but the process can be killed by cancel()
+        process = Popen(
+            [self.config['ydl_bin']] + args, stdout=PIPE, stderr=PIPE)
+        self.process = process
+        if self.cancelled:
+            process.kill()
+        try:
+            output, errors = process.communicate()
+        finally:
+            self.process = None
+
+        if process.returncode:
+            raise CalledProcessError(process.returncode, args, output)
+        return output
+
+    def _extract_media_info(self, media_format):
+        # prefer the resident extraction service; fall back to running
+        # youtube-dl for just this request
+        if self.extractor:
+            try:
+                return self.extractor.extract(
+                    self.request_uri, media_format,
+                    ('title', 'url') + MEDIA_INFO_FIELDS, self)
+            except ExtractorUnavailable as e:
+                logging.warning(
+                    'extraction service unavailable ({}); '
+                    'running youtube-dl'.format(e))
+
+        return parse_media_info(self._run_ydl([
+            '--get-title',
+            '--get-url',
+            '--get-filename',
+            '--output',
+            '\t'.join('%({})s'.format(field) for field in MEDIA_INFO_FIELDS),
+            '--format',
+            media_format,
+            # playlists are only listed, in update_playlist_info(); for
+            # anything else that turns out to be one, take the first item
+            '--no-playlist',
+            '--playlist-items',
+            '1',
+            self.request_uri
+        ]))
+
+    def _list_playlist(self, max_items):
+        if self.extractor:
+            try:
+                return self.extractor.list_playlist(
+                    self.request_uri, max_items, PLAYLIST_ENTRY_FIELDS, self)
+            except ExtractorUnavailable as e:
+                logging.warning(
+                    'extraction service unavailable ({}); '
+                    'running youtube-dl'.format(e))
+
+        # a flat listing only reads the playlist pages; entries stay small
+        return loads(self._run_ydl([
+            '--flat-playlist',
+            '--dump-single-json',
+            '--playlist-end',
+            str(max_items),
+            self.request_uri
+        ]))
+
+    def cancel(self):
+        self.cancelled = True
+        process = self.process
+        if process:
+            try:
+                process.kill()
+            except OSError:
+                # already exited
+                pass
+
+    def _fix_request_uri(self):
         if isinstance(self.request_uri, ParseResult):
             self.request_uri = self.request_uri.geturl()
-        if self.request_uri.count('///'):
+        if self.canonicalizer:
+            # one form per media page, for caching and deduplication
+            self.request_uri = self.canonicalizer.canonicalize(
+                self.request_uri)
+        elif self.request_uri.count('///'):
+            # fix slash-escape issue in request URI
             self.request_uri = self.request_uri.replace('///', '//')
 
+    def _is_playlist(self):
+        return any(
+            search(pattern, self.request_uri, IGNORECASE)
+            for pattern in self.config.get('playlist_uri_patterns') or [])
+
+    def get_cache_key(self):
+        return self.request_uri.split('#')[0]
+
+    def load_cached_media_info(self):
+        if not self.cache:
+            return False
+        self._fix_request_uri()
+
+        entry, media_fresh = self.cache.get(self.get_cache_key())
+        if not entry:
+            return False
+
+        # a stale media URL gets refreshed before the request plays
+        self._apply_media_info(entry)
+        return True
+
+    def _apply_media_info(self, entry):
+        # from a cache entry, or another request's lookup
+        self.title = entry['title']
+        self.duration = entry['duration']
+        self.source_site = entry['source_site']
+        self.live_source = entry['is_live']
+        self.media_uri = entry['media_uri']
+        self.last_fetched = entry['fetched']
+        self.expires_at = entry['expires']
+
+    def _get_media_info(self):
+        return {
+            'title': self.title,
+            'duration': self.duration,
+            'source_site': self.source_site,
+            'is_live': self.live_source,
+            'media_uri': self.media_uri,
+            'fetched': self.last_fetched,
+            'expires': self.expires_at
+        }
+
+    def _get_media_expiry(self, extractor_key):
+        # signed media URLs often carry their expiry time (expire=, Expires=,
+        # exp= in tokens, /expire/ in paths); otherwise go by extractor
+        expiry_match = search(
+            r'[?&~/=](?:expires?|exp)[=/](\d{9,11})(?:\D|$)',
+            self.media_uri, IGNORECASE)
+        if expiry_match:
+            return int(expiry_match.group(1)) - self.config.get(
+                'media_expiry_margin', 60)
+
+        ttl = (self.config.get('media_ttl_overrides') or {}).get(
+            extractor_key, self.config.get('media_ttl', 300))
+        return self.last_fetched + ttl
+
+    def _get_site(self):
+        # host, for the circuit breaker
+        host = urlparse(self.request_uri).hostname or ''
+        if host.startswith('www.'):
+            host = host[4:]
+        return host
+
+    def update_site_media_info(self):
+        self._fix_request_uri()
+        cache_key = self.get_cache_key()
+        site = self._get_site()
+
+        # fail fast on URLs that just failed, and sites that keep failing
+        if self.failures:
+            failure = self.failures.get(cache_key)
+            if failure:
+                self.error, self.failure_type = failure
+                return False
+        if self.breaker and not self.breaker.allow(site):
+            self.error = ' '.join([
+                'looking up media from {} keeps failing;'.format(site),
+                'try again in a few minutes'
+            ])
+            self.failure_type = FailureTypes.SITE_FAILING
+            return False
+
+        if not self.inflight:
+            return self._lookup_site_media_info(cache_key, site)
+
+        # concurrent lookups of the same URL share one youtube-dl run
+        def lookup():
+            self._lookup_site_media_info(cache_key, site)
+            if self.cancelled:
+                # nothing to share; let whoever is waiting look it up
+                return None
+            return dict(
+                self._get_media_info(),
+                error=self.error, failure_type=self.failure_type)
+
+        outcome, shared = self.inflight.run(cache_key, lookup, self)
+        if outcome is None:
+            # cancelled
+            return False
+        if shared:
+            self.error = outcome['error']
+            self.failure_type = outcome['failure_type']
+            if self.error is None:
+                self._apply_media_info(outcome)
+        return self.error is None
+
+    def _lookup_site_media_info(self, cache_key, site):
+        self.error = None
+        self.failure_type = None
+        if self._update_site_media_info():
+            if self.breaker:
+                self.breaker.succeeded(site)
+            return True
+
+        if self.cancelled:
+            # killed by us; says nothing about the URL or site
+            return False
+        # only extractor or site breakage counts against the site; no
+        # media (a private or deleted video) is down to the URL, which the
+        # failure cache covers, and shows the site answering
+        if self.breaker:
+            if self.failure_type == FailureTypes.EXTRACT_FAILED:
+                self.breaker.failed(site)
+            elif self.failure_type == FailureTypes.NO_MEDIA:
+                self.breaker.succeeded(site)
+        if self.failures:
+            self.failures.put(cache_key, self.error, self.failure_type)
+        return False
+
+    def _update_site_media_info(self):
         # use youtube_dl to extract vital media info (into media_info)
-        ydl_raw_json = ''
+        media_format = 'best[height <=? 1080][protocol !=? m3u8_native]'
+        if self.format_selector:
+            media_format = self.format_selector.spec
+
+        ydl_output = ''
         try:
-            ydl_raw_json = check_output([
-                self.config['ydl_bin'],
-                '--dump-json',
-                '--format',
-                'best[height <=? 1080][protocol !=? m3u8_native]',
-                self.request_uri
-            ])
-        except CalledProcessError:
+            ydl_output = self._extract_media_info(media_format)
+        except (CalledProcessError, ExtractionFailed):
             self.error = ' '.join([
                 'failed to extract any playable media;',
                 'confirm site is supported and check URL for typos'
             ])
+            self.failure_type = FailureTypes.EXTRACT_FAILED
+            return False
+        except OSError:
+            self.error = ' '.join([
+                'youtube-dl could not be run;',
+                'please contact the developer'
+            ])
+            self.failure_type = FailureTypes.INTERNAL
             return False
-
-        # parse returned string JSON to a dict
-        ydl_output = ''
-        try:
-            ydl_output = loads(ydl_raw_json)
         except ValueError:
             self.error = ' '.join([
-                'error parsing youtube-dl json output;',
+                'error parsing youtube-dl output;',
                 'please contact the developer'
             ])
+            self.failure_type = FailureTypes.INTERNAL
             return False
 
         media_info = {}
@@ -90,10 +467,21 @@ class PlayRequest:
                 'no video URL found;',
                 'check that media isn\'t private or deleted'
             ])
+            self.failure_type = FailureTypes.NO_MEDIA
             return False
         else:
             media_info['url'] = ydl_output['url']
 
+        if self.format_selector:
+            logging.info(
+                'format {} ({}, {}p, {} kbit/s) for {}: {}'.format(
+                    ydl_output.get('format_id'),
+                    ydl_output.get('vcodec'),
+                    ydl_output.get('height'),
+                    ydl_output.get('tbr'),
+                    self.request_uri,
+                    self.format_selector.explain(ydl_output)))
+
         optional_keys = [
             "duration",
             "ext",
@@ -102,7 +490,6 @@ class PlayRequest:
             # "format_id",
             # "format_note",
             "is_live",
-            ["http_headers", "User-Agent"],
             "title"
         ]
 
@@ -137,6 +524,7 @@ class PlayRequest:
                                 'no video URL found;',
                                 'check that media isn\'t private or deleted'
                             ])
+                            self.failure_type = FailureTypes.NO_MEDIA
                             return False
                     else:
                         media_info[key] = ydl_output[key]
@@ -158,6 +546,7 @@ class PlayRequest:
 
                 if not site_match:
                     self.error = 'malformed domain {} in URL'.format(domain)
+                    self.failure_type = FailureTypes.MALFORMED
                     return False
 
                 media_info['source_site'] = site_match.groups()[0]
@@ -184,9 +573,64 @@ class PlayRequest:
                 self.duration = media_info['duration']
 
         self.last_fetched = time()
+        self.expires_at = self._get_media_expiry(
+            media_info.get('extractor_key'))
+
+        if self.cache:
+            self.cache.put(self.get_cache_key(), self._get_media_info())
 
         return True
 
+    def update_playlist_info(self):
+        max_items = self.config.get('playlist_max_items', 200)
+
+        try:
+            playlist = self._list_playlist(max_items)
+        except (CalledProcessError, ExtractionFailed):
+            self.error = ' '.join([
+                'failed to list playlist;',
+                'confirm site is supported and check URL for typos'
+            ])
+            return False
+        except OSError:
+            self.error = ' '.join([
+                'youtube-dl could not be run;',
+                'please contact the developer'
+            ])
+            return False
+        except ValueError:
+            self.error = ' '.join([
+                'error parsing youtube-dl output;',
+                'please contact the developer'
+            ])
+            return False
+
+        if 'entries' not in playlist:
+            # single item after all
+            self.request_type = RequestTypes.SITE
+            return self.update_site_media_info()
+
+        entries = list()
+        for entry in playlist['entries'] or []:
+            uri = get_playlist_entry_uri(entry)
+            if not uri:
+                continue
+            entries.append({
+                'uri': uri,
+                'title': entry.get('title') or uri,
+                'duration': int(entry.get('duration') or 0),
+                'source_site': entry.get('ie_key') or playlist.get(
+                    'extractor_key')
+            })
+        if not entries:
+            self.error = 'no playable items found in playlist'
+            return False
+
+        self.title = playlist.get('title') or self.request_uri
+        self.source_site = playlist.get('extractor_key')
+        self.playlist_entries = entries[:max_items]
+        return True
+
     def prepare(self):
 
         if not self.request_uri:
@@ -194,8 +638,20 @@ class PlayRequest:
                 self.error = 'empty request; nothing to do'
                 return False
 
-            # if not self.config['search_filter']:
-            if not self.filter_module:
+            # files in the local library play without any lookups
+            if self.library:
+                entry = self.library.search(self.search_terms)
+                if entry:
+                    self.request_type = RequestTypes.LOCAL
+                    self.media_uri = Path(entry['path']).as_uri()
+                    self.request_uri = self.media_uri
+                    self.title = entry['title']
+                    self.duration = entry['duration'] or 0
+                    self.source_site = 'library'
+                    self.prepared = True
+                    return True
+
+            if not (self.searcher and self.searcher.filters):
                 self.error = ' '.join([
                     'no search filter configured;',
                     'keyword search disabled'
@@ -203,24 +659,14 @@ class PlayRequest:
                 return False
 
             # attempt to fetch a URL
-
-            filter_output = []
-            filter_output = self.filter_module.get_uri(
-                self.httpsession, self.search_terms)
-
-            if not isinstance(filter_output, list):
-                self.error = 'search filter returned unexpected data'
+            try:
+                uri, self.search_candidates = self.searcher.search(
+                    self.httpsession, self.search_terms)
+            except SearchFailed as e:
+                self.error = str(e)
                 return False
 
-            if not len(filter_output) == 2:
-                self.error = 'search filter returned unexpected data'
-                return False
-
-            if filter_output[0] != 0:
-                self.error = filter_output[1]
-                return False
-
-            self.request_uri = urlparse(filter_output[1], scheme='http')
+            self.request_uri = urlparse(uri, scheme='http')
 
         if self.request_uri.scheme not in ('http', 'https'):
             self.error = "unsupported scheme '{}'".format(
@@ -234,12 +680,33 @@ class PlayRequest:
             self.title = '[direct-play] file: {}'.format(
                 self.request_uri.path.split('/')[-1])
             self.request_uri = self.request_uri.geturl()
+
+            # check the link before it's queued
+            if self.prober:
+                probe = self.prober.probe(self.media_uri)
+                if probe['error']:
+                    self.error = probe['error']
+                    self.failure_type = FailureTypes.NO_MEDIA
+                    return False
+                self.content_length = probe['length']
+                self.seekable = probe['seekable']
         else:
             # page URL given; parse for metadata and media URL
-            self.request_type = RequestTypes.SITE
+            self._fix_request_uri()
+
+            # (items queued from a playlist come typed as SITE already)
+            if self.request_type is None and self._is_playlist():
+                # list the items only; each is resolved as it nears the
+                # head of the queue
+                self.request_type = RequestTypes.PLAYLIST
+                if not self.update_playlist_info():
+                    return False
+            else:
+                self.request_type = RequestTypes.SITE
 
-            if not self.update_site_media_info():
-                return False
+                if not self.load_cached_media_info():
+                    if not self.update_site_media_info():
+                        return False
 
         self.prepared = True
         return True
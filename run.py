@@ -4,8 +4,8 @@ from __future__ import print_function
 from circuits import BaseComponent, handler
 from lib.commands import CommandExecutor
 from lib.core import PlayerManager, MessageProcessor, ICHCAPI
-from lib.events import do_join_room, do_shutdown
-from os import getpid, path, remove
+from lib.events import do_check_services, do_join_room, do_shutdown
+from os import getpid
 from requests import Session
 from setproctitle import getproctitle, setproctitle
 from socket import error as socket_error, socket, AF_UNIX, SOCK_DGRAM
@@ -69,6 +69,7 @@ class Phoebe(BaseComponent):
             ))
 
         self.fire(do_join_room(), self.ichcapi.channel)
+        self.fire(do_check_services(), self.playmgr.channel)
 
     @handler('signal')
     def _handle_signal(self, event, signo, stack):
@@ -77,20 +78,36 @@ class Phoebe(BaseComponent):
     @handler('do_shutdown')
     def shutdown(self):
         logging.critical('shutting down...')
+        self.ichcapi.in_shutdown = True
+
         # stop player
         self.playmgr.in_shutdown = True
-        self.playmgr.stop_player()
-
-        # clean up socket
-        socket_file = self.shm['config']['control_socket_file']
-        if path.exists(socket_file):
-            remove(socket_file)
+        self.playmgr.stop_player(wait=True)
+
+        # abandon requests still being prepared
+        for request in self.playmgr.requestqueue:
+            if request.resolving or request.refreshing:
+                request.cancel()
+        self.playmgr.resolver.shutdown(wait=False)
+        self.playmgr.searcher.shutdown()
+        if self.playmgr.library:
+            self.playmgr.library.shutdown()
+        self.playmgr.mediacache.close()
+        if self.playmgr.extractor_process:
+            self.playmgr.extractor_process.terminate()
+        if self.playmgr.playserver_process:
+            self.playmgr.playserver_process.terminate()
 
         # unregister components
         self.cmdexec.unregister()
         self.msgproc.unregister()
         if self.ichcapi.http_poll_timer:
             self.ichcapi.http_poll_timer.unregister()
+        if self.ichcapi.http_retry_timer:
+            self.ichcapi.http_retry_timer.unregister()
+        if self.playmgr.refresh_timer:
+            self.playmgr.refresh_timer.unregister()
+        self.ichcapi.httpworker.shutdown(wait=False)
         self.ichcapi.unregister()
         self.playmgr.unregister()
 
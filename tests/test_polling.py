@@ -0,0 +1,55 @@
+from __future__ import absolute_import
+from os import path
+from sys import path as sys_path
+from time import mktime
+import unittest
+
+sys_path.insert(0, path.join(path.dirname(path.abspath(__file__)), '..'))
+from lib.polling import ScheduledPolling  # noqa: E402
+
+CONFIG = {
+    'polling_interval': 1.0,
+    'max_polling_interval': 10.0,
+    'polling_ewma_alpha': 0.3,
+    'polling_ewma_scale': 0.5,
+    'polling_command_hold': 30.0
+}
+
+
+def at_hour(hour):
+    # a timestamp at the given local hour
+    return mktime((2024, 1, 15, hour, 30, 0, 0, 0, -1))
+
+
+def floor_at(profile, hour):
+    config = dict(CONFIG, polling_profile=profile)
+    return ScheduledPolling(config)._get_bounds(at_hour(hour))[0]
+
+
+class ScheduledPollingTest(unittest.TestCase):
+
+    def test_range(self):
+        profile = {'0-7': 6.0}
+        self.assertEqual(floor_at(profile, 0), 6.0)
+        self.assertEqual(floor_at(profile, 7), 6.0)
+        self.assertEqual(floor_at(profile, 8), 1.0)
+
+    def test_single_hour(self):
+        profile = {5: 3.0}
+        self.assertEqual(floor_at(profile, 5), 3.0)
+        self.assertEqual(floor_at(profile, 4), 1.0)
+        self.assertEqual(floor_at(profile, 6), 1.0)
+
+    def test_range_past_midnight(self):
+        profile = {'22-6': 6.0}
+        for hour in (22, 23, 0, 3, 6):
+            self.assertEqual(floor_at(profile, hour), 6.0)
+        for hour in (7, 12, 21):
+            self.assertEqual(floor_at(profile, hour), 1.0)
+
+    def test_floor_capped_by_ceiling(self):
+        self.assertEqual(floor_at({'0-23': 60.0}, 12), 10.0)
+
+
+if __name__ == '__main__':
+    unittest.main()
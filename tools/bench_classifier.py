@@ -0,0 +1,142 @@
+#!/usr/bin/python3
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from os import path
+from random import choice, randrange, seed
+from re import compile as rexcomp
+from sys import path as sys_path
+from timeit import repeat
+
+'''
+Micro-benchmark: classifying API response lines, per-line regex cascade
+(as ICHCAPI and MessageProcessor used to do it) against LineClassifier.
+
+usage: tools/bench_classifier.py [lines per response] [repeats]
+'''
+
+sys_path.insert(0, path.join(path.dirname(path.abspath(__file__)), '..'))
+from lib.classifier import LineClassifier  # noqa: E402
+
+API_CONFIG = {
+    'app_username': 'mybot',
+    'chat_prefix_regex': r'^\w+\|',
+    'control_regex': r'^\*\w+\|',
+    'privmsg_regex': r'^\*pm\|(?P<message>.*)$'
+}
+MSGPROC_CONFIG = {
+    'command_regex': r'^\w+\|(?P<user>\w+):\s+!(?P<command>\w+.*)$',
+    'stream_id_regex': 'stream: (?P<stream_id>\\S+)$'
+}
+
+
+def make_response(count):
+    seed(1)
+    users = ['user{}'.format(n) for n in range(200)]
+    lines = ['OK']
+    for _ in range(count):
+        roll = randrange(100)
+        user = choice(users)
+        if roll < 60:
+            lines.append('room|{}: just chatting about things, {}'.format(
+                user, randrange(10 ** 6)))
+        elif roll < 80:
+            lines.append('room|{}: !{}'.format(
+                user, choice(['play cats', 'yea', 'nay', 'now', 'next'])))
+        elif roll < 90:
+            lines.append('*sys|{} has joined the room'.format(user))
+        elif roll < 95:
+            lines.append('*pm|room|{}: !now'.format(user))
+        else:
+            lines.append('room|mybot: /me is now playing something')
+    lines.append('')
+    return '\r\n'.join(lines).encode()
+
+
+class LegacyClassifier:
+
+    def __init__(self, api_config, msgproc_config):
+        self.stream_id = None
+        self.ctrlre = rexcomp(api_config['control_regex'])
+        self.privmsgre = rexcomp(api_config['privmsg_regex'])
+        self.selfmsgre = rexcomp(
+            api_config['chat_prefix_regex'] + api_config['app_username'])
+        self.cmdre = rexcomp(msgproc_config['command_regex'])
+        self.stridre = rexcomp(msgproc_config['stream_id_regex'])
+
+    def classify(self, content):
+        response_text = content.decode().replace('\r', '').split('\n')
+
+        filtered_messages = list()
+        for line in response_text[1:]:
+            if len(line) == 0:
+                continue
+            if self.ctrlre.search(line):
+                privmsg_match = self.privmsgre.search(line)
+                if privmsg_match:
+                    filtered_messages.append(privmsg_match.group('message'))
+                continue
+            if self.selfmsgre.search(line):
+                continue
+            filtered_messages.append(line)
+
+        parsed = list()
+        for line in filtered_messages:
+            cmd_match = self.cmdre.search(line)
+            if not self.stream_id:
+                strid_match = self.stridre.search(line)
+                if strid_match:
+                    parsed.append(strid_match.group('stream_id').strip())
+            if cmd_match:
+                parsed.append(cmd_match.group('user', 'command'))
+        return parsed
+
+
+def classify(classifier, content):
+    # as ICHCAPI hands it over: header line split off, body left whole
+    status, _, body = content.replace(b'\r', b'').partition(b'\n')
+    return classifier.classify(body)
+
+
+def main():
+    from sys import argv
+    count = int(argv[1]) if len(argv) > 1 else 10000
+    repeats = int(argv[2]) if len(argv) > 2 else 20
+
+    content = make_response(count)
+    legacy = LegacyClassifier(API_CONFIG, MSGPROC_CONFIG)
+    classifier = LineClassifier(API_CONFIG, MSGPROC_CONFIG)
+
+    # both must agree on the commands found
+    legacy_commands = [p for p in legacy.classify(content)
+                       if isinstance(p, tuple)]
+    commands = [m[1] for m in classify(classifier, content) if m[0] == 2]
+    assert legacy_commands == commands, 'classifiers disagree'
+
+    print('{} lines, {} commands, best of {}'.format(
+        count, len(commands), repeats))
+
+    # before the stream ID turns up, chat lines are checked for it too;
+    # afterwards (i.e. almost always) they aren't
+    for label, stream_id in (
+        ('awaiting stream ID', None),
+        ('stream ID known', 'known')
+    ):
+        legacy.stream_id = stream_id
+        classifier.find_stream_id = stream_id is None
+
+        legacy_time = min(repeat(
+            lambda: legacy.classify(content), number=1, repeat=repeats))
+        single_time = min(repeat(
+            lambda: classify(classifier, content),
+            number=1, repeat=repeats))
+
+        print(label)
+        print('  regex cascade:    {:8.2f} ms'.format(legacy_time * 1000))
+        print('  LineClassifier:   {:8.2f} ms'.format(single_time * 1000))
+        print('  speedup:          {:8.2f}x'.format(
+            legacy_time / single_time))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,140 @@
+#!/usr/bin/python3
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from argparse import ArgumentParser
+from os import path
+from shutil import rmtree
+from subprocess import check_output, Popen, DEVNULL
+from sys import executable, path as sys_path
+from tempfile import mkdtemp
+from threading import Thread
+from time import sleep, time
+from yaml import safe_dump as dump_yaml
+from six.moves.BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+
+'''
+Benchmark: media info extraction latency, running youtube-dl once per request
+(the subprocess fallback) against the resident extraction service
+(bin/extract.py).
+
+By default both resolve a direct media link served locally, so the numbers
+are youtube-dl's own overhead rather than network time; pass --url to
+resolve real pages instead.
+
+usage: tools/bench_extractor.py [--ydl-bin youtube-dl] [--runs 10] [--url URL]
+'''
+
+ROOT = path.join(path.dirname(path.abspath(__file__)), '..')
+sys_path.insert(0, ROOT)
+from lib.extractor import ExtractorClient  # noqa: E402
+
+FORMAT = 'best[height <=? 1080][protocol !=? m3u8_native]'
+
+
+class MediaHandler(BaseHTTPRequestHandler):
+
+    def log_message(self, format, *args):
+        pass
+
+    def _headers(self):
+        self.send_response(200)
+        self.send_header('Content-Type', 'video/mp4')
+        self.send_header('Content-Length', '1024')
+        self.end_headers()
+
+    def do_HEAD(self):
+        self._headers()
+
+    def do_GET(self):
+        self._headers()
+        self.wfile.write(b'\0' * 1024)
+
+
+def summarize(label, timings):
+    # first run separately: caches (and, for the service, worker setup)
+    # are still cold
+    ordered = sorted(timings)
+    print('{:<18} first {:7.3f}s  median {:7.3f}s  mean {:7.3f}s'.format(
+        label, timings[0], ordered[len(ordered) // 2],
+        sum(timings) / len(timings)))
+
+
+def bench_subprocess(ydl_bin, urls, runs):
+    timings = list()
+    for run in range(runs):
+        for url in urls:
+            start = time()
+            check_output(
+                [ydl_bin, '--dump-json', '--format', FORMAT, url],
+                stderr=DEVNULL)
+            timings.append(time() - start)
+    return timings
+
+
+def bench_service(urls, runs):
+    workdir = mkdtemp(prefix='bench_extractor')
+    socket_file = path.join(workdir, 'extract.sock')
+    with open(path.join(workdir, 'config.yaml'), 'w') as config_file:
+        dump_yaml({
+            'name': 'bench-extractor',
+            'log_level': 'ERROR',
+            'Extractor': {
+                'socket_file': socket_file,
+                'version_check_interval': 60,
+                'restart_grace_period': 1
+            }
+        }, config_file)
+
+    process = Popen(
+        [executable, path.join(ROOT, 'bin', 'extract.py')], cwd=workdir)
+    try:
+        # time until the service takes requests (youtube-dl import)
+        start = time()
+        while not path.exists(socket_file):
+            if process.poll() is not None:
+                raise SystemExit('extraction service failed to start')
+            sleep(.01)
+        print('service startup: {:.3f}s'.format(time() - start))
+
+        client = ExtractorClient({'socket_file': socket_file})
+        timings = list()
+        for run in range(runs):
+            for url in urls:
+                start = time()
+                client.extract(url, FORMAT)
+                timings.append(time() - start)
+        return timings
+    finally:
+        process.terminate()
+        process.wait()
+        rmtree(workdir)
+
+
+def main():
+    parser = ArgumentParser(description='youtube-dl extraction benchmark')
+    parser.add_argument('--ydl-bin', default='youtube-dl')
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument(
+        '--url', action='append', dest='urls',
+        help='page to resolve (repeatable); default: a local media file')
+    options = parser.parse_args()
+
+    urls = options.urls
+    server = None
+    if not urls:
+        server = HTTPServer(('127.0.0.1', 0), MediaHandler)
+        Thread(target=server.serve_forever, daemon=True).start()
+        urls = ['http://127.0.0.1:{}/clip.mp4'.format(server.server_port)]
+
+    summarize(
+        'subprocess',
+        bench_subprocess(options.ydl_bin, urls, options.runs))
+    summarize('resident service', bench_service(urls, options.runs))
+
+    if server:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
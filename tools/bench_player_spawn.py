@@ -0,0 +1,160 @@
+#!/usr/bin/python3
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from argparse import ArgumentParser
+from multiprocessing.connection import Client
+from os import chdir, getcwd, path, symlink
+from shutil import rmtree
+from subprocess import Popen
+from sys import path as sys_path
+from tempfile import mkdtemp
+from threading import Event
+from time import sleep, time
+from yaml import safe_dump as dump_yaml, safe_load as load_yaml
+
+'''
+Benchmark: player spawn-to-preroll latency, starting each player as a new
+Python process (bin/play.py) against forking it off the player server
+(bin/playserver.py).
+
+Each player is given the media to preload once it's up, which it holds
+without streaming it; timings run from the spawn to the player taking
+control connections ("ready") and to the media having prerolled.
+SquishPlayer settings come from config.yaml in the current directory, if
+there is one, or else examples/config.yaml.
+
+usage: tools/bench_player_spawn.py [--runs 10] media (file or URI)
+'''
+
+ROOT = path.join(path.dirname(path.abspath(__file__)), '..')
+sys_path.insert(0, ROOT)
+from lib.player import PlayerProcess, PlayServerClient  # noqa: E402
+
+
+def summarize(label, timings):
+    # first run separately: page cache and, for the server, the plugins
+    # it hasn't preloaded are still cold
+    ordered = sorted(timings)
+    print('{:<20} first {:7.3f}s  median {:7.3f}s  mean {:7.3f}s'.format(
+        label, timings[0], ordered[len(ordered) // 2],
+        sum(timings) / len(timings)))
+
+
+def spawn_once(workdir, media_uri, run, playserver=None):
+    ready = Event()
+    prerolled = Event()
+    exited = Event()
+
+    def on_status(player, status, *args):
+        if status == 'ready':
+            ready.set()
+        elif status == 'prerolled':
+            prerolled.set()
+
+    start = time()
+    player = PlayerProcess(
+        'bench',
+        path.join(workdir, 'player.{}'.format(run)),
+        on_status,
+        lambda player: exited.set(),
+        playserver=playserver)
+
+    try:
+        while not ready.wait(.01):
+            if exited.is_set():
+                raise SystemExit('player failed to start; see play.log')
+        ready_at = time() - start
+
+        player.client = Client(player.address, authkey=b'phoebe')
+        player.client.send(['play'])
+        player.client.send(['preload', '1', media_uri, False])
+        player.client.recv()
+        while not prerolled.wait(.01):
+            if exited.is_set():
+                raise SystemExit('player failed to preroll; see play.log')
+        return (ready_at, time() - start)
+    finally:
+        if player.client:
+            player.client.send(['stop'])
+            player.client.close()
+        else:
+            player.process.terminate()
+        player.wait(10)
+        # the next player can't take the output until this one is gone
+        exited.wait(10)
+        player.remove_socket()
+
+
+def bench(workdir, media_uri, runs, playserver=None):
+    ready_timings = list()
+    preroll_timings = list()
+    for run in range(runs):
+        ready_at, prerolled_at = spawn_once(
+            workdir, media_uri, run, playserver)
+        ready_timings.append(ready_at)
+        preroll_timings.append(prerolled_at)
+    return (ready_timings, preroll_timings)
+
+
+def main():
+    parser = ArgumentParser(description='player spawn-to-preroll benchmark')
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('media', help='media file or URI to preroll')
+    options = parser.parse_args()
+
+    media_uri = options.media
+    if '://' not in media_uri:
+        media_uri = 'file://{}'.format(path.abspath(media_uri))
+
+    config_path = 'config.yaml'
+    if not path.exists(config_path):
+        config_path = path.join(ROOT, 'examples', 'config.yaml')
+    with open(config_path, 'r') as config_file:
+        base_config = load_yaml(config_file)
+
+    # players and the server run from a scratch directory of their own
+    workdir = mkdtemp(prefix='bench_player_spawn')
+    socket_file = path.join(workdir, 'playserver.sock')
+    with open(path.join(workdir, 'config.yaml'), 'w') as config_file:
+        dump_yaml({
+            'name': 'bench-player-spawn',
+            'log_level': 'ERROR',
+            'control_socket_file': path.join(workdir, 'player'),
+            'SquishPlayer': base_config['SquishPlayer'],
+            'PlayServer': {'socket_file': socket_file}
+        }, config_file)
+    symlink(path.join(path.abspath(ROOT), 'bin'), path.join(workdir, 'bin'))
+    cwd = getcwd()
+    chdir(workdir)
+
+    process = None
+    try:
+        ready, preroll = bench(workdir, media_uri, options.runs)
+        summarize('process: ready', ready)
+        summarize('process: prerolled', preroll)
+
+        process = Popen(['/usr/bin/python3', 'bin/playserver.py'])
+        # time until the server takes requests (gi import, Gst.init)
+        start = time()
+        while not path.exists(socket_file):
+            if process.poll() is not None:
+                raise SystemExit('player server failed to start')
+            sleep(.01)
+        print('server startup: {:.3f}s'.format(time() - start))
+
+        playserver = PlayServerClient({'socket_file': socket_file})
+        ready, preroll = bench(
+            workdir, media_uri, options.runs, playserver)
+        summarize('server: ready', ready)
+        summarize('server: prerolled', preroll)
+    finally:
+        if process:
+            process.terminate()
+            process.wait()
+        chdir(cwd)
+        rmtree(workdir)
+
+
+if __name__ == '__main__':
+    main()
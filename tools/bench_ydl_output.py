@@ -0,0 +1,176 @@
+#!/usr/bin/python3
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from argparse import ArgumentParser
+from json import dumps, loads
+from os import path
+from pickle import dumps as pickle
+from random import Random
+from sys import path as sys_path
+from timeit import repeat
+import tracemalloc
+
+'''
+Benchmark: the cost of getting media info out of youtube-dl, as a full
+--dump-json document (parsed whole, then picked through) against the
+projected output the resolver now asks for (--get-title --get-url
+--get-filename with a field template, or a field projection from the
+extraction service).
+
+Pass captured dumps (youtube-dl --dump-json URL > dump.json) as arguments;
+with none, a YouTube-shaped dump is synthesized (many formats, fragment
+lists, automatic captions, thumbnails).
+
+usage: tools/bench_ydl_output.py [--runs 20] [dump.json ...]
+'''
+
+ROOT = path.join(path.dirname(path.abspath(__file__)), '..')
+sys_path.insert(0, ROOT)
+from lib.utils import MEDIA_INFO_FIELDS, parse_media_info  # noqa: E402
+
+WANTED = ('title', 'url') + MEDIA_INFO_FIELDS
+
+
+def synthesize():
+    rng = Random(0)
+
+    def token(length):
+        return ''.join(
+            rng.choice('abcdefghijklmnopqrstuvwxyz0123456789_-')
+            for _ in range(length))
+
+    def googlevideo_url(itag):
+        return (
+            'https://r4---sn-{}.googlevideo.com/videoplayback?expire=1634'
+            '567890&ei={}&ip=203.0.113.7&id=o-{}&itag={}&source=youtube'
+            '&requiressl=yes&mime=video%2Fmp4&dur=212.040&lmt=1600000000'
+            '&fvip=4&c=WEB&txp=5535432&sparams={}&sig={}&lsparams={}'
+            '&lsig={}'.format(
+                token(8), token(22), token(44), itag, token(120),
+                token(90), token(60), token(90)))
+
+    formats = list()
+    for itag in range(1, 31):
+        height = [144, 240, 360, 480, 720, 1080][itag % 6]
+        dash = itag % 3 != 0
+        formats.append({
+            'format_id': str(itag),
+            'url': googlevideo_url(itag),
+            'ext': 'mp4',
+            'width': height * 16 // 9,
+            'height': height,
+            'tbr': round(rng.uniform(100, 5000), 3),
+            'fps': 30,
+            'vcodec': 'avc1.4d401f',
+            'acodec': 'none' if dash else 'mp4a.40.2',
+            'protocol': 'http_dash_segments' if dash else 'https',
+            'filesize': rng.randint(10 ** 6, 10 ** 8),
+            'format_note': '{}p'.format(height),
+            'fragment_base_url': googlevideo_url(itag) if dash else None,
+            'fragments': [
+                {'path': 'sq/{}'.format(n), 'duration': 5.0}
+                for n in range(43)] if dash else None,
+            'http_headers': {
+                'User-Agent': 'Mozilla/5.0 (X11; Linux x86_64)',
+                'Accept': 'text/html,application/xhtml+xml,*/*;q=0.8',
+                'Accept-Language': 'en-us,en;q=0.5'
+            },
+            'downloader_options': {'http_chunk_size': 10485760}
+        })
+
+    captions = dict()
+    for lang in range(120):
+        captions['l{}'.format(lang)] = [
+            {'ext': ext, 'url': 'https://www.youtube.com/api/timedtext?v='
+             '{}&lang=l{}&fmt={}&sig={}'.format(
+                 token(11), lang, ext, token(80))}
+            for ext in ('srv1', 'srv2', 'srv3', 'ttml', 'vtt')]
+
+    info = {
+        'id': token(11),
+        'title': 'Synthesized Video ' + token(20),
+        'description': ' '.join(token(8) for _ in range(600)),
+        'uploader': token(12),
+        'duration': 212,
+        'is_live': None,
+        'view_count': 123456789,
+        'tags': [token(10) for _ in range(30)],
+        'categories': ['Music'],
+        'thumbnails': [
+            {'url': 'https://i.ytimg.com/vi/{}/{}.jpg'.format(token(11), n),
+             'id': str(n), 'width': 168 + n * 16, 'height': 94 + n * 9}
+            for n in range(40)],
+        'automatic_captions': captions,
+        'subtitles': {},
+        'formats': formats,
+        'extractor': 'youtube',
+        'extractor_key': 'Youtube',
+        'webpage_url': 'https://www.youtube.com/watch?v=' + token(11)
+    }
+    # the selected format's fields are merged into the top level
+    info.update(formats[-1])
+    return dumps(info).encode('utf-8')
+
+
+def project(info):
+    # what --get-title --get-url --get-filename -o <field template> prints
+    def field(name):
+        value = info.get(name)
+        return 'NA' if value is None else str(value)
+    return '\n'.join([
+        info.get('title', 'NA'),
+        info.get('url', 'NA'),
+        '\t'.join(field(name) for name in MEDIA_INFO_FIELDS)
+    ]).encode('utf-8') + b'\n'
+
+
+def parse_full(dump):
+    info = loads(dump.decode('utf-8'))
+    return dict((key, info[key]) for key in WANTED if key in info)
+
+
+def measure(label, function, argument, runs):
+    tracemalloc.start()
+    function(argument)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    seconds = min(repeat(lambda: function(argument), number=1, repeat=runs))
+    print('  {:<28} {:>10.3f} ms  peak {:>9,} B'.format(
+        label, seconds * 1000, peak))
+
+
+def main():
+    parser = ArgumentParser(description='youtube-dl output parsing benchmark')
+    parser.add_argument('--runs', type=int, default=20)
+    parser.add_argument('dumps', nargs='*', help='--dump-json output files')
+    options = parser.parse_args()
+
+    samples = list()
+    for name in options.dumps:
+        with open(name, 'rb') as dump_file:
+            # one JSON document per line (e.g. from a playlist)
+            samples.extend(
+                ('{}:{}'.format(name, n + 1), line)
+                for n, line in enumerate(dump_file.read().splitlines())
+                if line.strip())
+    if not samples:
+        samples.append(('synthesized', synthesize()))
+
+    for name, dump in samples:
+        info = loads(dump.decode('utf-8'))
+        projected = project(info)
+        picked = dict((key, info[key]) for key in WANTED if key in info)
+        print('{}: {:,} B dump, {:,} B projected output'.format(
+            name, len(dump), len(projected)))
+        print('  {:<28} {:>10,} B full, {:,} B projected'.format(
+            'service reply (pickled)', len(pickle(info)), len(pickle(picked))))
+        # youtube-dl's own cost of serializing the dump for us
+        measure('serialize full dump', dumps, info, options.runs)
+        measure('parse full dump', parse_full, dump, options.runs)
+        measure('parse projected output', parse_media_info, projected,
+                options.runs)
+
+
+if __name__ == '__main__':
+    main()
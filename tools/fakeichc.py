@@ -0,0 +1,251 @@
+#!/usr/bin/python3
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from argparse import ArgumentParser
+from collections import deque
+from json import dumps
+from random import random, uniform
+from six.moves.BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from six.moves.socketserver import ThreadingMixIn
+from six.moves.urllib.parse import parse_qs, urlparse
+from threading import Lock
+from time import sleep
+from uuid import uuid4
+
+'''
+fakeichc: a local stand-in for the ICHC api.ashx endpoint.
+
+Implements join/recv/send with the OK-prefixed line protocol, a stream ID
+announcement on join, and injectable latency, errors and disconnects, so
+the bot (and tools/loaddriver.py) can run without icanhazchat.com. Point
+the bot at it with, e.g.:
+
+ICHCAPI:
+  entrypoint_url: http://127.0.0.1:8080/api.ashx
+  chat_prefix_regex: '^\\w+\\|'
+  control_regex: '^\\*\\w+\\|'
+  privmsg_regex: '^\\*pm\\|(?P<message>.*)$'
+MessageProcessor:
+  command_regex: ^\\w+\\|(?P<user>\\w+):\\s+!(?P<command>\\w+.*)$
+  stream_id_regex: 'stream: (?P<stream_id>\\S+)$'
+
+Lines handed out by recv (and send) responses look like:
+  room|user: text               chat in the room (own messages included)
+  *sys|text                     room notices
+  *pm|room|user: text           private message from user
+
+GET /stats returns request counts per user and action as JSON; GET /reset
+clears them.
+'''
+
+MAX_PENDING_LINES = 1000
+
+
+class Room:
+
+    def __init__(self, name, stream_id):
+        self.name = name
+        self.stream_id = stream_id
+        # key -> username
+        self.sessions = dict()
+        # key -> pending lines
+        self.pending = dict()
+        self.lock = Lock()
+
+    def _deliver(self, key, line):
+        self.pending[key].append(line)
+
+    def broadcast(self, line):
+        for key in self.sessions:
+            self._deliver(key, line)
+
+    def join(self, username):
+        key = uuid4().hex
+        with self.lock:
+            self.sessions[key] = username
+            self.pending[key] = deque([], MAX_PENDING_LINES)
+            self.broadcast('*sys|{} has joined the room'.format(username))
+            self._deliver(key, '*pm|{}|ichc: stream: {}'.format(
+                self.name, self.stream_id))
+        return key
+
+    def kick(self, key):
+        with self.lock:
+            username = self.sessions.pop(key, None)
+            self.pending.pop(key, None)
+            if username:
+                self.broadcast('*sys|{} has left the room'.format(username))
+
+    def drain(self, key):
+        with self.lock:
+            if key not in self.sessions:
+                return None
+            lines = list(self.pending[key])
+            self.pending[key].clear()
+        return lines
+
+    def send(self, key, message):
+        with self.lock:
+            if key not in self.sessions:
+                return False
+            username = self.sessions[key]
+
+            if message.startswith('/msg '):
+                parts = message.split(' ', 2)
+                if len(parts) < 3:
+                    return True
+                recipient = parts[1].lower()
+                for other, name in self.sessions.items():
+                    if name.lower() == recipient:
+                        self._deliver(other, '*pm|{}|{}: {}'.format(
+                            self.name, username, parts[2]))
+            elif message.startswith('/') and not message.startswith('/me '):
+                # /modme, /broadcast, /cam ...: acknowledge only
+                self._deliver(key, '*sys|{} ok'.format(message.split()[0]))
+            else:
+                self.broadcast('{}|{}: {}'.format(
+                    self.name, username, message))
+        return True
+
+
+class FakeICHC(ThreadingMixIn, HTTPServer):
+
+    daemon_threads = True
+
+    def __init__(self, address, options):
+        HTTPServer.__init__(self, address, APIRequestHandler)
+        self.options = options
+        self.rooms = dict()
+        # key -> room
+        self.keys = dict()
+        self.stats = dict()
+        self.stats_lock = Lock()
+
+    def get_room(self, name):
+        if name not in self.rooms:
+            self.rooms[name] = Room(name, self.options.stream_id)
+        return self.rooms[name]
+
+    def count(self, username, action):
+        with self.stats_lock:
+            user_stats = self.stats.setdefault(username, dict())
+            user_stats[action] = user_stats.get(action, 0) + 1
+
+
+class APIRequestHandler(BaseHTTPRequestHandler):
+
+    def log_message(self, format, *args):
+        if self.server.options.verbose:
+            BaseHTTPRequestHandler.log_message(self, format, *args)
+
+    def _reply(self, status, lines):
+        body = '\r\n'.join(lines + ['']).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'text/plain; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        options = self.server.options
+        url = urlparse(self.path)
+        params = dict(
+            (name, values[0]) for name, values in parse_qs(url.query).items())
+
+        if url.path == '/stats':
+            with self.server.stats_lock:
+                body = dumps(self.server.stats, indent=2, sort_keys=True)
+            return self._reply(200, [body])
+        if url.path == '/reset':
+            with self.server.stats_lock:
+                self.server.stats.clear()
+            return self._reply(200, ['OK'])
+
+        # injected trouble
+        if options.latency or options.jitter:
+            sleep(max(0, options.latency + uniform(
+                -options.jitter, options.jitter)))
+        if random() < options.disconnect_rate:
+            # drop the connection without a response
+            self.close_connection = True
+            return None
+        if random() < options.error_rate:
+            return self._reply(503, ['ERR', 'service unavailable'])
+
+        action = params.get('a')
+        if action == 'join':
+            if options.api_key and params.get('p') != options.api_key:
+                return self._reply(200, ['ERR', 'bad credentials'])
+            username = params.get('u', 'anonymous')
+            room = self.server.get_room(params.get('w', 'lobby'))
+            key = room.join(username)
+            self.server.keys[key] = room
+            self.server.count(username, 'join')
+            return self._reply(200, ['OK', key])
+
+        key = params.get('k')
+        room = self.server.keys.get(key)
+        if not room:
+            return self._reply(200, ['ERR', 'not joined'])
+        username = room.sessions.get(key, 'unknown')
+        self.server.count(username, action)
+
+        if random() < options.kick_rate:
+            room.kick(key)
+            return self._reply(200, ['ERR', 'not joined'])
+
+        if action == 'send':
+            if not room.send(key, params.get('w', '')):
+                return self._reply(200, ['ERR', 'not joined'])
+        elif action != 'recv':
+            return self._reply(200, ['ERR', 'unknown action'])
+
+        # recv, and send, responses carry whatever is pending
+        lines = room.drain(key)
+        if lines is None:
+            return self._reply(200, ['ERR', 'not joined'])
+        return self._reply(200, ['OK'] + lines)
+
+
+def main():
+    parser = ArgumentParser(description='local stand-in for the ICHC API')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument(
+        '--api-key', default=None,
+        help='only accept joins with this API key')
+    parser.add_argument(
+        '--stream-id', default='fakestream',
+        help='stream ID announced to joining clients')
+    parser.add_argument(
+        '--latency', type=float, default=0.0,
+        help='seconds added to every response')
+    parser.add_argument(
+        '--jitter', type=float, default=0.0,
+        help='random +/- seconds added to the latency')
+    parser.add_argument(
+        '--error-rate', type=float, default=0.0,
+        help='fraction of requests answered with HTTP 503')
+    parser.add_argument(
+        '--disconnect-rate', type=float, default=0.0,
+        help='fraction of requests dropped without a response')
+    parser.add_argument(
+        '--kick-rate', type=float, default=0.0,
+        help='fraction of requests whose session is ended (forcing a join)')
+    parser.add_argument('--verbose', action='store_true')
+    options = parser.parse_args()
+
+    server = FakeICHC((options.host, options.port), options)
+    print('fake ICHC API listening on http://{}:{}/api.ashx'.format(
+        options.host, options.port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
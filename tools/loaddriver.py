@@ -0,0 +1,264 @@
+#!/usr/bin/python3
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from argparse import ArgumentParser
+from json import loads
+from random import choice, expovariate, random
+from re import compile as rexcomp, escape
+from requests import Session
+from threading import Lock, Thread
+from time import sleep, time
+
+'''
+loaddriver: simulates a room full of chatting users against tools/fakeichc.py
+while the bot is connected to it, and reports command reply latency and the
+bot's API call volume.
+
+Each simulated user joins the room, polls it, and every so often either
+chats or issues one of !play, !yea or !now (or !hello, for users the
+permissions file allows it). A command's latency is the time from its send
+to the first bot line (room or PM) the user sees that answers it; commands
+with no answer within --reply-timeout are counted as unanswered (!now and
+!yea stay silent while nothing is playing).
+
+usage: tools/loaddriver.py --users 200 --duration 120
+'''
+
+CHATTER = [
+    'lol', 'anyone here?', 'this song though', 'brb', 'what is this',
+    'turn it up', 'nice', 'hi all'
+]
+PLAY_ARGUMENTS = [
+    'https://www.youtube.com/watch?v=dQw4w9WgXcQ',
+    'https://vimeo.com/76979871',
+    'daft punk around the world',
+    'lofi hip hop radio'
+]
+
+
+class Stats:
+
+    def __init__(self):
+        self.lock = Lock()
+        # command -> list of latencies
+        self.latencies = dict()
+        self.unanswered = dict()
+        self.sent = dict()
+        self.api_errors = 0
+
+    def count_sent(self, command):
+        with self.lock:
+            self.sent[command] = self.sent.get(command, 0) + 1
+
+    def add_latency(self, command, latency):
+        with self.lock:
+            self.latencies.setdefault(command, list()).append(latency)
+
+    def add_unanswered(self, command):
+        with self.lock:
+            self.unanswered[command] = self.unanswered.get(command, 0) + 1
+
+    def add_error(self):
+        with self.lock:
+            self.api_errors += 1
+
+
+def get_reply_pattern(command, username):
+    # what the bot's answer to each command looks like
+    username = escape(username)
+    if command == 'play':
+        return rexcomp(r"added to queue|couldn't queue")
+    if command == 'yea':
+        return rexcomp(r'rating of .* \*for {}\*'.format(username))
+    if command == 'now':
+        return rexcomp(r'is playing \* \*\*')
+    return rexcomp(r'Hello, {}\.'.format(username))
+
+
+class SimulatedUser(Thread):
+
+    def __init__(self, username, options, stats, deadline):
+        super(SimulatedUser, self).__init__()
+        self.daemon = True
+        self.username = username
+        self.options = options
+        self.stats = stats
+        self.deadline = deadline
+
+        self.session = Session()
+        self.key = None
+        self.bot_prefixes = (
+            '{}|{}: '.format(options.room, options.bot),
+            '*pm|{}|{}: '.format(options.room, options.bot)
+        )
+        # [command, pattern, sent at]
+        self.pending = list()
+
+    def _query(self, **params):
+        params['v'] = 1
+        try:
+            response = self.session.get(
+                self.options.url, params=params, timeout=10)
+        except Exception:
+            self.stats.add_error()
+            return None
+        lines = response.text.replace('\r', '').split('\n')
+        if lines[0] != 'OK':
+            self.stats.add_error()
+            return None
+        return lines[1:]
+
+    def _join(self):
+        lines = self._query(
+            a='join', u=self.username, p=self.options.api_key,
+            w=self.options.room)
+        if lines:
+            self.key = lines[0]
+
+    def _handle_lines(self, lines, now):
+        for line in lines:
+            if not line.startswith(self.bot_prefixes):
+                continue
+            for entry in list(self.pending):
+                if entry[1].search(line):
+                    self.stats.add_latency(entry[0], now - entry[2])
+                    self.pending.remove(entry)
+
+    def _expire_pending(self, now):
+        for entry in list(self.pending):
+            if now - entry[2] > self.options.reply_timeout:
+                self.stats.add_unanswered(entry[0])
+                self.pending.remove(entry)
+
+    def _act(self):
+        if random() > self.options.command_ratio:
+            message = choice(CHATTER)
+        else:
+            command = choice(self.options.commands)
+            message = '!{}'.format(command)
+            if command == 'play':
+                message = '!play {}'.format(choice(PLAY_ARGUMENTS))
+            self.stats.count_sent(command)
+            self.pending.append([
+                command, get_reply_pattern(command, self.username), time()])
+        lines = self._query(a='send', k=self.key, w=message)
+        if lines is None:
+            self.key = None
+        else:
+            self._handle_lines(lines, time())
+
+    def run(self):
+        next_action = time() + expovariate(1 / self.options.think_time)
+        # stop acting at the deadline, but wait out replies still due
+        while time() < self.deadline or self.pending:
+            if not self.key:
+                self._join()
+                if not self.key:
+                    sleep(self.options.poll_interval)
+                    continue
+
+            now = time()
+            if now >= next_action and now < self.deadline:
+                self._act()
+                next_action = now + expovariate(1 / self.options.think_time)
+            else:
+                lines = self._query(a='recv', k=self.key)
+                if lines is None:
+                    self.key = None
+                else:
+                    self._handle_lines(lines, time())
+
+            self._expire_pending(time())
+            sleep(self.options.poll_interval)
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def report(stats, api_stats, options, elapsed):
+    print('{} users, {:.0f}s'.format(options.users, elapsed))
+    print('{:<8} {:>6} {:>6} {:>8} {:>8} {:>8} {:>8}'.format(
+        'command', 'sent', 'lost', 'p50', 'p90', 'p99', 'max'))
+    for command in sorted(stats.sent):
+        latencies = stats.latencies.get(command, list())
+        row = [command, stats.sent[command], stats.unanswered.get(command, 0)]
+        if latencies:
+            row.extend([
+                percentile(latencies, 0.5),
+                percentile(latencies, 0.9),
+                percentile(latencies, 0.99),
+                max(latencies)
+            ])
+            print('{:<8} {:>6} {:>6} {:>8.3f} {:>8.3f} {:>8.3f} {:>8.3f}'
+                  .format(*row))
+        else:
+            print('{:<8} {:>6} {:>6} {:>8} {:>8} {:>8} {:>8}'.format(
+                *(row + ['-'] * 4)))
+    print('client API errors: {}'.format(stats.api_errors))
+
+    bot_calls = api_stats.get(options.bot)
+    if bot_calls:
+        total = sum(bot_calls.values())
+        print('bot API calls: {} ({:.2f}/s) -- {}'.format(
+            total, total / elapsed, ', '.join(
+                '{}: {}'.format(action, count)
+                for action, count in sorted(bot_calls.items()))))
+    else:
+        print("bot API calls: none seen for '{}'".format(options.bot))
+
+
+def main():
+    parser = ArgumentParser(description='simulated users for fakeichc')
+    parser.add_argument(
+        '--url', default='http://127.0.0.1:8080/api.ashx')
+    parser.add_argument('--room', default='lobby')
+    parser.add_argument('--api-key', default='')
+    parser.add_argument(
+        '--bot', default='mybot', help="the bot's app_username")
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument(
+        '--duration', type=float, default=60.0, help='seconds to run for')
+    parser.add_argument(
+        '--think-time', type=float, default=20.0,
+        help='mean seconds between a user sending anything')
+    parser.add_argument(
+        '--command-ratio', type=float, default=0.3,
+        help='fraction of sends that are bot commands')
+    parser.add_argument(
+        '--commands', default='play,yea,now',
+        help='comma-separated commands to pick from')
+    parser.add_argument(
+        '--poll-interval', type=float, default=1.0,
+        help='seconds between recv polls of each user')
+    parser.add_argument(
+        '--reply-timeout', type=float, default=30.0,
+        help='seconds before a command counts as unanswered')
+    options = parser.parse_args()
+    options.commands = options.commands.split(',')
+
+    base_url = options.url.rsplit('/', 1)[0]
+    session = Session()
+    session.get('{}/reset'.format(base_url))
+
+    stats = Stats()
+    start = time()
+    deadline = start + options.duration
+    users = [
+        SimulatedUser('user{}'.format(idx), options, stats, deadline)
+        for idx in range(options.users)
+    ]
+    for user in users:
+        user.start()
+    for user in users:
+        user.join()
+    elapsed = time() - start
+
+    api_stats = loads(session.get('{}/stats'.format(base_url)).text)
+    report(stats, api_stats, options, elapsed)
+
+
+if __name__ == '__main__':
+    main()